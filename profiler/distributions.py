@@ -5,7 +5,8 @@ from torch.autograd import Variable
 
 from profiler.profiling_utils import Profile, profile_print
 from pyro.distributions import (Bernoulli, Beta, Categorical, Cauchy, Dirichlet, Exponential, Gamma, LogNormal, Normal,
-                                OneHotCategorical, Poisson, Uniform)
+                                OneHotCategorical, Poisson, Uniform, VonMises)
+from pyro.distributions.testing.rejection_gamma import RejectionStandardGamma
 
 
 def T(arr):
@@ -56,6 +57,13 @@ DISTRIBUTIONS = {
     'Uniform': (Uniform, {
         'low': T([0, 0, 0, 0]),
         'high': T([4, 4, 4, 4])
+    }),
+    'VonMises': (VonMises, {
+        'loc': T([0.5, 0.5, 0.5, 0.5]),
+        'concentration': T([0.1, 1.0, 10.0, 100.0])
+    }),
+    'RejectionStandardGamma': (RejectionStandardGamma, {
+        'concentration': T([1.0, 2.4, 2.4, 10.0])
     })
 }
 
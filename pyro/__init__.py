@@ -2,7 +2,8 @@ import pyro.poutine as poutine
 from pyro.logger import log
 from pyro.poutine import condition, do, markov
 from pyro.primitives import (clear_param_store, enable_validation, factor, get_param_store, iarange, irange, module,
-                             param, plate, plate_stack, random_module, sample, validation_enabled)
+                             param, plate, plate_stack, random_module, sample, validation_enabled,
+                             vectorized_markov)
 from pyro.util import set_rng_seed
 
 version_prefix = '0.4.1'
@@ -35,4 +36,5 @@ __all__ = [
     "sample",
     "set_rng_seed",
     "validation_enabled",
+    "vectorized_markov",
 ]
@@ -4,7 +4,8 @@ from torch.distributions import constraints
 from pyro.distributions.torch import Categorical, MultivariateNormal
 from pyro.distributions.torch_distribution import TorchDistribution
 from pyro.distributions.util import broadcast_shape
-from pyro.ops.gaussian import Gaussian, gaussian_tensordot, matrix_and_mvn_to_gaussian, mvn_to_gaussian
+from pyro.ops.gaussian import (AffineNormal, Gaussian, SqrtGaussian, gaussian_tensordot, matrix_and_mvn_to_gaussian,
+                               matrix_and_mvn_to_sqrt_gaussian, mvn_to_gaussian, mvn_to_sqrt_gaussian)
 
 
 def _logmatmulexp(x, y):
@@ -41,13 +42,51 @@ def _sequential_logmatmulexp(logits):
     return logits.squeeze(-3)
 
 
+def _maxmatmul(x, y):
+    """
+    Matrix product in the ``(max, +)`` semiring, i.e. the tropical version of
+    :func:`_logmatmulexp`.
+    """
+    return (x.unsqueeze(-1) + y.unsqueeze(-3)).max(-2)[0]
+
+
+def _prefix_scan(op, x, dim):
+    """
+    For a tensor ``x`` whose time dimension is ``dim``, computes the prefix
+    reductions ``op(x[0], ..., x[t])`` for all ``t`` by an associative binary
+    ``op``, in ``O(log(time))`` parallel steps.
+    """
+    time = x.size(dim)
+    shift = 1
+    while shift < time:
+        x = torch.cat((x.narrow(dim, 0, shift),
+                       op(x.narrow(dim, 0, time - shift), x.narrow(dim, shift, time - shift))), dim=dim)
+        shift *= 2
+    return x
+
+
+def _compose_suffix(maps):
+    """
+    For a tensor of integer maps ``f`` with rightmost shape
+    ``(num_steps, state_dim)``, computes the suffix compositions::
+
+        g[t] = f[t] o f[t+1] o ... o f[T-1]
+
+    in ``O(log(time))`` parallel steps.
+    """
+    def compose(inner, outer):
+        return outer.gather(-1, inner)
+
+    return _prefix_scan(compose, maps.flip(-2), dim=-2).flip(-2)
+
+
 def _sequential_gaussian_tensordot(gaussian):
     """
     Integrates a Gaussian ``x`` whose rightmost batch dimension is time, computes::
 
         x[..., 0] @ x[..., 1] @ ... @ x[..., T-1]
     """
-    assert isinstance(gaussian, Gaussian)
+    assert isinstance(gaussian, (Gaussian, SqrtGaussian))
     assert gaussian.dim() % 2 == 0, "dim is not even"
     batch_shape = gaussian.batch_shape[:-1]
     state_dim = gaussian.dim() // 2
@@ -59,11 +98,52 @@ def _sequential_gaussian_tensordot(gaussian):
         x, y = x_y[..., 0], x_y[..., 1]
         contracted = gaussian_tensordot(x, y, state_dim)
         if time > even_time:
-            contracted = Gaussian.cat((contracted, gaussian[..., -1:]), dim=-1)
+            contracted = type(gaussian).cat((contracted, gaussian[..., -1:]), dim=-1)
         gaussian = contracted
     return gaussian[..., 0]
 
 
+def _gaussian_to_mvn(gaussian, validate_args=None):
+    """
+    Converts a normalized Gaussian to a MultivariateNormal distribution.
+    """
+    if isinstance(gaussian, SqrtGaussian):
+        gaussian = gaussian.to_gaussian()
+    precision = gaussian.precision
+    loc = gaussian.info_vec.unsqueeze(-1).cholesky_solve(precision.cholesky()).squeeze(-1)
+    return MultivariateNormal(loc, precision_matrix=precision, validate_args=validate_args)
+
+
+def _time_slice(x, t):
+    """
+    Selects time step ``t`` of a tensor of logits with rightmost shape
+    ``(num_steps, state_dim, state_dim)``, or of a
+    :class:`~pyro.ops.gaussian.Gaussian`,
+    :class:`~pyro.ops.gaussian.SqrtGaussian` or
+    :class:`~pyro.ops.gaussian.AffineNormal` whose rightmost batch dimension
+    is time. Homogeneous inputs, whose time dimension has size 1 or is
+    missing, are returned at every time step.
+    """
+    if isinstance(x, torch.Tensor):
+        if x.dim() < 3:
+            return x
+        return x[..., t if x.size(-3) > 1 else 0, :, :]
+    batch_shape = x.loc.shape[:-1] if isinstance(x, AffineNormal) else x.batch_shape
+    if not batch_shape:
+        return x
+    t = t if batch_shape[-1] > 1 else 0
+    if isinstance(x, AffineNormal):
+        return AffineNormal(x.matrix[..., t, :, :], x.loc[..., t, :], x.scale[..., t, :])
+    return x[..., t]
+
+
+def _check_time(hmm, t):
+    num_steps = hmm.event_shape[0]
+    if num_steps > 1 and t >= num_steps:
+        raise ValueError("Cannot filter beyond the num_steps = {} time steps of a "
+                         "heterogeneous HMM".format(num_steps))
+
+
 class DiscreteHMM(TorchDistribution):
     """
     Hidden Markov Model with discrete latent state and arbitrary observation
@@ -141,9 +221,12 @@ class DiscreteHMM(TorchDistribution):
         return new
 
     def log_prob(self, value):
-        # Combine observation and transition factors.
         value = value.unsqueeze(-1 - self.observation_dist.event_dim)
         observation_logits = self.observation_dist.log_prob(value)
+        return self._log_prob_from_logits(observation_logits)
+
+    def _log_prob_from_logits(self, observation_logits):
+        # Combine observation and transition factors.
         result = self.transition_logits + observation_logits.unsqueeze(-2)
 
         # Eliminate time dimension.
@@ -181,6 +264,98 @@ class DiscreteHMM(TorchDistribution):
         # Convert to a distribution.
         return Categorical(logits=logp, validate_args=self._validate_args)
 
+    def online_filter(self):
+        """
+        Creates a stateful filter that incorporates observations one time step
+        at a time, in time independent of the number of past observations.
+
+        :rtype: DiscreteHMMFilter
+        """
+        return DiscreteHMMFilter(self)
+
+    def smoothed_marginals(self, value):
+        """
+        Compute posterior marginals over latent states at each time step given
+        a sequence of observations. This differentiates :meth:`log_prob` with
+        respect to observation logits, so it costs about as much as
+        :meth:`log_prob`. The result is not differentiable.
+
+        :param ~torch.Tensor value: A sequence of observations.
+        :return: A posterior distribution over latent states whose
+            ``.batch_shape`` is ``batch_shape + (num_steps,)``.
+        :rtype: ~pyro.distributions.Categorical
+        """
+        value = value.unsqueeze(-1 - self.observation_dist.event_dim)
+        with torch.enable_grad():
+            observation_logits = self.observation_dist.log_prob(value).detach()
+            shape = broadcast_shape(observation_logits.shape, self.batch_shape + (1, 1))
+            observation_logits = observation_logits.expand(shape).clone().requires_grad_()
+            log_prob = self._log_prob_from_logits(observation_logits)
+            probs, = torch.autograd.grad(log_prob.sum(), [observation_logits])
+        return Categorical(probs=probs, validate_args=self._validate_args)
+
+    def sample_posterior(self, value):
+        """
+        Draw a latent trajectory from the posterior given a sequence of
+        observations, by forward filtering backward sampling. Both passes are
+        parallelized over time, achieving O(log(time)) parallel complexity.
+
+        :param ~torch.Tensor value: A sequence of observations.
+        :return: A tensor of latent states with shape
+            ``batch_shape + (num_steps,)``.
+        :rtype: ~torch.LongTensor
+        """
+        return self._posterior_states(value, sample=True)
+
+    def map_states(self, value):
+        """
+        Compute the most likely latent trajectory given a sequence of
+        observations, by Viterbi decoding. Both passes are parallelized over
+        time, achieving O(log(time)) parallel complexity.
+
+        :param ~torch.Tensor value: A sequence of observations.
+        :return: A tensor of latent states with shape
+            ``batch_shape + (num_steps,)``.
+        :rtype: ~torch.LongTensor
+        """
+        return self._posterior_states(value, sample=False)
+
+    def _posterior_states(self, value, sample):
+        value = value.unsqueeze(-1 - self.observation_dist.event_dim)
+        observation_logits = self.observation_dist.log_prob(value).detach()
+        transition_logits = self.transition_logits.detach()
+        initial_logits = self.initial_logits.detach()
+        logp = transition_logits + observation_logits.unsqueeze(-2)
+        shape = broadcast_shape(logp.shape, initial_logits.shape[:-1] + (1, 1, 1))
+        logp = logp.expand(shape)
+
+        # Forward pass: compute filtered logits at each time step, where in
+        # the (max, +) semiring, these are scores of the best partial paths.
+        if sample:
+            logp = _prefix_scan(_logmatmulexp, logp, dim=-3)
+            alpha = (initial_logits[..., None, :, None] + logp).logsumexp(-2)
+        else:
+            logp = _prefix_scan(_maxmatmul, logp, dim=-3)
+            alpha = (initial_logits[..., None, :, None] + logp).max(-2)[0]
+
+        if sample:
+            final = Categorical(logits=alpha[..., -1, :]).sample()
+        else:
+            final = alpha[..., -1, :].argmax(-1)
+        if shape[-3] == 1:
+            return final.unsqueeze(-1)
+
+        # Backward pass: each state is drawn given its successor, so the
+        # trajectory is a composition of maps from successor to state.
+        kernel = alpha[..., :-1, :].unsqueeze(-1) + transition_logits.expand(shape)[..., 1:, :, :]
+        kernel = kernel.transpose(-1, -2)
+        if sample:
+            maps = Categorical(logits=kernel).sample()
+        else:
+            maps = kernel.argmax(-1)
+        states = _compose_suffix(maps).gather(-1, final[..., None, None].expand(maps.shape[:-1] + (1,)))
+        return torch.cat((states.squeeze(-1), final.unsqueeze(-1)), dim=-1)
+
 
 class GaussianHMM(TorchDistribution):
     """
@@ -237,11 +412,15 @@ class GaussianHMM(TorchDistribution):
         This should have event_shape ``(obs_dim,)``.
     :type observation_dist: ~torch.distributions.MultivariateNormal or
         ~torch.distributions.Independent of ~torch.distributions.Normal
+    :param bool square_root: Whether to represent factors internally as
+        :class:`~pyro.ops.gaussian.SqrtGaussian` rather than
+        :class:`~pyro.ops.gaussian.Gaussian`. This is more numerically stable,
+        especially in single precision, at a similar cost.
     """
     arg_constraints = {}
 
     def __init__(self, initial_dist, transition_matrix, transition_dist,
-                 observation_matrix, observation_dist, validate_args=None):
+                 observation_matrix, observation_dist, validate_args=None, square_root=False):
         assert isinstance(initial_dist, torch.distributions.MultivariateNormal)
         assert isinstance(transition_matrix, torch.Tensor)
         assert isinstance(transition_dist, torch.distributions.MultivariateNormal)
@@ -264,9 +443,14 @@ class GaussianHMM(TorchDistribution):
         super(GaussianHMM, self).__init__(batch_shape, event_shape, validate_args=validate_args)
         self.hidden_dim = hidden_dim
         self.obs_dim = obs_dim
-        self._init = mvn_to_gaussian(initial_dist)
-        self._trans = matrix_and_mvn_to_gaussian(transition_matrix, transition_dist)
-        self._obs = matrix_and_mvn_to_gaussian(observation_matrix, observation_dist)
+        if square_root:
+            self._init = mvn_to_sqrt_gaussian(initial_dist)
+            self._trans = matrix_and_mvn_to_sqrt_gaussian(transition_matrix, transition_dist)
+            self._obs = matrix_and_mvn_to_sqrt_gaussian(observation_matrix, observation_dist)
+        else:
+            self._init = mvn_to_gaussian(initial_dist)
+            self._trans = matrix_and_mvn_to_gaussian(transition_matrix, transition_dist)
+            self._obs = matrix_and_mvn_to_gaussian(observation_matrix, observation_dist)
 
     def expand(self, batch_shape, _instance=None):
         new = self._get_checked_instance(GaussianHMM, _instance)
@@ -284,14 +468,21 @@ class GaussianHMM(TorchDistribution):
         return new
 
     def log_prob(self, value):
+        return self._log_prob_from_likelihood(self._obs.condition(value))
+
+    def _log_prob_from_likelihood(self, likelihood):
+        init, trans = self._init, self._trans
+        if isinstance(trans, SqrtGaussian) and isinstance(likelihood, Gaussian):
+            init, trans = init.to_gaussian(), trans.to_gaussian()
+
         # Combine observation and transition factors.
-        result = self._trans + self._obs.condition(value).event_pad(left=self.hidden_dim)
+        result = trans + likelihood.event_pad(left=self.hidden_dim)
 
         # Eliminate time dimension.
         result = _sequential_gaussian_tensordot(result.expand(result.batch_shape))
 
         # Combine initial factor.
-        result = gaussian_tensordot(self._init, result, dims=self.hidden_dim)
+        result = gaussian_tensordot(init, result, dims=self.hidden_dim)
 
         # Marginalize out final state.
         result = result.event_logsumexp()
@@ -318,10 +509,180 @@ class GaussianHMM(TorchDistribution):
         logp = gaussian_tensordot(self._init, logp, dims=self.hidden_dim)
 
         # Convert to a distribution
-        precision = logp.precision
-        loc = logp.info_vec.unsqueeze(-1).cholesky_solve(precision.cholesky()).squeeze(-1)
-        return MultivariateNormal(loc, precision_matrix=precision,
-                                  validate_args=self._validate_args)
+        return _gaussian_to_mvn(logp, self._validate_args)
+
+    def online_filter(self):
+        """
+        Creates a stateful filter that incorporates observations one time step
+        at a time, in time independent of the number of past observations.
+
+        :rtype: GaussianHMMFilter
+        """
+        return GaussianHMMFilter(self)
+
+    def map_states(self, value):
+        """
+        Compute the most likely hidden trajectory given a sequence of
+        observations, which coincides with the posterior mean trajectory.
+        This differentiates :meth:`log_prob` with respect to a linear term of
+        the observation likelihood at each time step, so it costs about as
+        much as :meth:`log_prob`. The result is not differentiable.
+
+        :param ~torch.Tensor value: A sequence of observations.
+        :return: A tensor of hidden states with shape
+            ``batch_shape + (num_steps, hidden_dim)``.
+        :rtype: ~torch.Tensor
+        """
+        with torch.enable_grad():
+            likelihood = self._obs.condition(value.detach())
+            if isinstance(likelihood, SqrtGaussian):
+                likelihood = likelihood.to_gaussian()
+            shape = broadcast_shape(likelihood.batch_shape, self.batch_shape + (1,))
+            linear = torch.zeros(shape + (self.hidden_dim,), dtype=likelihood.info_vec.dtype,
+                                 device=likelihood.info_vec.device, requires_grad=True)
+            likelihood = Gaussian(likelihood.log_normalizer.detach(),
+                                  likelihood.info_vec.detach() + linear,
+                                  likelihood.precision.detach())
+            log_prob = self._log_prob_from_likelihood(likelihood)
+            loc, = torch.autograd.grad(log_prob.sum(), [linear])
+        return loc
+
+
+class DiscreteHMMFilter(object):
+    """
+    Online filter for a :class:`DiscreteHMM`, batched over the HMM's
+    ``batch_shape``. Each call to :meth:`update` carries the posterior over
+    the current latent state forward in ``O(state_dim ** 2)`` time per batch
+    element, so that after observing ``value`` one step at a time,
+    :attr:`posterior` agrees with ``hmm.filter(value)`` and the sum of the
+    returned log normalizers agrees with ``hmm.log_prob(value)``.
+
+    For observation distributions that are heterogeneous in time, each update
+    evaluates the observation log density at all time steps.
+
+    :param DiscreteHMM hmm: A discrete hidden Markov model.
+    :ivar int num_steps: The number of observations incorporated so far.
+    :ivar ~torch.Tensor logits: Normalized logits of the posterior over the
+        current latent state, of shape ``hmm.batch_shape + (state_dim,)``.
+    """
+    def __init__(self, hmm):
+        assert isinstance(hmm, DiscreteHMM)
+        self.hmm = hmm
+        self.num_steps = 0
+        self.logits = hmm.initial_logits.expand(hmm.batch_shape + hmm.initial_logits.shape[-1:])
+
+    @property
+    def posterior(self):
+        """
+        :return: The posterior over the current latent state.
+        :rtype: ~pyro.distributions.Categorical
+        """
+        return Categorical(logits=self.logits, validate_args=self.hmm._validate_args)
+
+    def update(self, value):
+        """
+        Incorporates an observation at the next time step.
+
+        :param ~torch.Tensor value: An observation of shape
+            ``hmm.batch_shape + observation_dist.event_shape``.
+        :return: The log density of ``value`` conditioned on all previous
+            observations, of shape ``hmm.batch_shape``.
+        :rtype: ~torch.Tensor
+        """
+        _check_time(self.hmm, self.num_steps)
+        observation_dist = self.hmm.observation_dist
+        event_shape = observation_dist.event_shape
+        value = value.reshape(value.shape[:value.dim() - len(event_shape)] + (1, 1) + event_shape)
+        observation_logits = observation_dist.log_prob(value)
+        observation_logits = observation_logits[..., self.num_steps if observation_logits.size(-2) > 1 else 0, :]
+
+        transition_logits = _time_slice(self.hmm.transition_logits, self.num_steps)
+        logits = (self.logits.unsqueeze(-1) + transition_logits).logsumexp(-2) + observation_logits
+        log_normalizer = logits.logsumexp(-1)
+        self.logits = logits - log_normalizer.unsqueeze(-1)
+        self.num_steps += 1
+        return log_normalizer
+
+    def predict(self, num_steps=1):
+        """
+        Forecasts the latent state ``num_steps`` time steps ahead, without
+        changing the state of the filter.
+
+        :param int num_steps: The number of time steps to forecast.
+        :return: A distribution over latent states.
+        :rtype: ~pyro.distributions.Categorical
+        """
+        logits = self.logits
+        for t in range(self.num_steps, self.num_steps + num_steps):
+            _check_time(self.hmm, t)
+            transition_logits = _time_slice(self.hmm.transition_logits, t)
+            logits = (logits.unsqueeze(-1) + transition_logits).logsumexp(-2)
+        return Categorical(logits=logits, validate_args=self.hmm._validate_args)
+
+
+class GaussianHMMFilter(object):
+    """
+    Online filter for a :class:`GaussianHMM`, batched over the HMM's
+    ``batch_shape``. Each call to :meth:`update` carries the Gaussian belief
+    over the current hidden state forward in ``O(hidden_dim ** 3)`` time per
+    batch element, so that after observing ``value`` one step at a time,
+    :attr:`posterior` agrees with ``hmm.filter(value)`` and the sum of the
+    returned log normalizers agrees with ``hmm.log_prob(value)``.
+
+    :param GaussianHMM hmm: A Gaussian hidden Markov model.
+    :ivar int num_steps: The number of observations incorporated so far.
+    """
+    def __init__(self, hmm):
+        assert isinstance(hmm, GaussianHMM)
+        self.hmm = hmm
+        self.num_steps = 0
+        self._belief = hmm._init.expand(hmm.batch_shape)
+
+    @property
+    def posterior(self):
+        """
+        :return: The posterior over the current hidden state.
+        :rtype: ~pyro.distributions.MultivariateNormal
+        """
+        return _gaussian_to_mvn(self._belief, self.hmm._validate_args)
+
+    def update(self, value):
+        """
+        Incorporates an observation at the next time step.
+
+        :param ~torch.Tensor value: An observation of shape
+            ``hmm.batch_shape + (obs_dim,)``.
+        :return: The log density of ``value`` conditioned on all previous
+            observations, of shape ``hmm.batch_shape``.
+        :rtype: ~torch.Tensor
+        """
+        _check_time(self.hmm, self.num_steps)
+        hidden_dim = self.hmm.hidden_dim
+        trans = _time_slice(self.hmm._trans, self.num_steps)
+        obs = _time_slice(self.hmm._obs, self.num_steps)
+        belief = gaussian_tensordot(self._belief,
+                                    trans + obs.condition(value).event_pad(left=hidden_dim),
+                                    dims=hidden_dim)
+        log_normalizer = belief.event_logsumexp()
+        belief.log_normalizer = belief.log_normalizer - log_normalizer
+        self._belief = belief
+        self.num_steps += 1
+        return log_normalizer
+
+    def predict(self, num_steps=1):
+        """
+        Forecasts the hidden state ``num_steps`` time steps ahead, without
+        changing the state of the filter.
+
+        :param int num_steps: The number of time steps to forecast.
+        :return: A distribution over hidden states.
+        :rtype: ~pyro.distributions.MultivariateNormal
+        """
+        belief = self._belief
+        for t in range(self.num_steps, self.num_steps + num_steps):
+            _check_time(self.hmm, t)
+            belief = gaussian_tensordot(belief, _time_slice(self.hmm._trans, t), dims=self.hmm.hidden_dim)
+        return _gaussian_to_mvn(belief, self.hmm._validate_args)
 
 
 class GaussianMRF(TorchDistribution):
@@ -363,10 +724,14 @@ class GaussianMRF(TorchDistribution):
         distribution factor over a hidden and an observed state. This should
         have batch_shape broadcastable to ``self.batch_shape + (num_steps,)``.
         This should have event_shape ``(hidden_dim + obs_dim,)``.
+    :param bool square_root: Whether to represent factors internally as
+        :class:`~pyro.ops.gaussian.SqrtGaussian` rather than
+        :class:`~pyro.ops.gaussian.Gaussian`. This is more numerically stable,
+        especially in single precision, at a similar cost.
     """
     arg_constraints = {}
 
-    def __init__(self, initial_dist, transition_dist, observation_dist, validate_args=None):
+    def __init__(self, initial_dist, transition_dist, observation_dist, validate_args=None, square_root=False):
         assert isinstance(initial_dist, torch.distributions.MultivariateNormal)
         assert isinstance(transition_dist, torch.distributions.MultivariateNormal)
         assert isinstance(observation_dist, torch.distributions.MultivariateNormal)
@@ -382,9 +747,10 @@ class GaussianMRF(TorchDistribution):
         super(GaussianMRF, self).__init__(batch_shape, event_shape, validate_args=validate_args)
         self.hidden_dim = hidden_dim
         self.obs_dim = obs_dim
-        self._init = mvn_to_gaussian(initial_dist)
-        self._trans = mvn_to_gaussian(transition_dist)
-        self._obs = mvn_to_gaussian(observation_dist)
+        to_gaussian = mvn_to_sqrt_gaussian if square_root else mvn_to_gaussian
+        self._init = to_gaussian(initial_dist)
+        self._trans = to_gaussian(transition_dist)
+        self._obs = to_gaussian(observation_dist)
 
     def expand(self, batch_shape, _instance=None):
         new = self._get_checked_instance(GaussianMRF, _instance)
@@ -413,8 +779,8 @@ class GaussianMRF(TorchDistribution):
         # Concatenate p(obs,hidden) and p(hidden) into a single Gaussian.
         batch_dim = 1 + max(len(self._init.batch_shape) + 1, len(logp_oh.batch_shape))
         batch_shape = (1,) * (batch_dim - len(logp_oh.batch_shape)) + logp_oh.batch_shape
-        logp = Gaussian.cat([logp_oh.expand(batch_shape),
-                             logp_h.expand(batch_shape)])
+        logp = type(logp_oh).cat([logp_oh.expand(batch_shape),
+                                  logp_h.expand(batch_shape)])
 
         # Eliminate time dimension.
         logp = _sequential_gaussian_tensordot(logp)
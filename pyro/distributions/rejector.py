@@ -1,3 +1,6 @@
+import inspect
+import math
+
 import torch
 
 from pyro.distributions.score_parts import ScoreParts
@@ -9,8 +12,9 @@ class Rejector(TorchDistribution):
     Rejection sampled distribution given an acceptance rate function.
 
     :param Distribution propose: A proposal distribution that samples batched
-        proposals via ``propose()``. :meth:`rsample` supports a ``sample_shape``
-        arg only if ``propose()`` supports a ``sample_shape`` arg.
+        proposals via ``propose(sample_shape)``. A ``propose()`` that takes no
+        arguments is also supported, in which case :meth:`rsample` stacks
+        one call per element of ``sample_shape``.
     :param callable log_prob_accept: A callable that inputs a batch of
         proposals and returns a batch of log acceptance probabilities.
     :param log_scale: Total log probability of acceptance.
@@ -36,21 +40,27 @@ class Rejector(TorchDistribution):
             self._propose_log_prob_cache = x, self.propose.log_prob(x)
         return self._propose_log_prob_cache[1]
 
+    def _propose_shaped(self, sample_shape):
+        sample_shape = torch.Size(sample_shape)
+        try:
+            inspect.signature(self.propose).bind(sample_shape)
+        except TypeError:
+            # Fall back to stacking calls of a propose() without arguments.
+            if not sample_shape:
+                return self.propose()
+            xs = [self.propose() for _ in range(sample_shape.numel())]
+            return torch.stack(xs).reshape(sample_shape + xs[0].shape)
+        except ValueError:
+            pass  # The signature cannot be inspected, so assume it accepts a sample_shape.
+        return self.propose(sample_shape)
+
     def rsample(self, sample_shape=torch.Size()):
-        # Implements parallel batched accept-reject sampling.
-        x = self.propose(sample_shape) if sample_shape else self.propose()
-        log_prob_accept = self.log_prob_accept(x)
-        probs = torch.exp(log_prob_accept).clamp_(0.0, 1.0)
-        done = torch.bernoulli(probs).bool()
-        while not done.all():
-            proposed_x = self.propose(sample_shape) if sample_shape else self.propose()
-            log_prob_accept = self.log_prob_accept(proposed_x)
-            prob_accept = torch.exp(log_prob_accept).clamp_(0.0, 1.0)
-            accept = torch.bernoulli(prob_accept).bool() & ~done
-            if accept.any():
-                x[accept] = proposed_x[accept]
-                done |= accept
-        return x
+        def propose(sample_shape):
+            x = self._propose_shaped(sample_shape)
+            prob_accept = torch.exp(self.log_prob_accept(x)).clamp_(0.0, 1.0)
+            return x, torch.bernoulli(prob_accept).bool()
+
+        return rejection_sample(propose, sample_shape)
 
     def log_prob(self, x):
         return self._propose_log_prob(x) + self._log_prob_accept(x)
@@ -59,3 +69,50 @@ class Rejector(TorchDistribution):
         score_function = self._log_prob_accept(x)
         log_prob = self.log_prob(x)
         return ScoreParts(log_prob, score_function, log_prob)
+
+
+def rejection_sample(propose, sample_shape=torch.Size(), target_accept=0.99, max_oversample=64):
+    """
+    Batched accept-reject sampling, independently for each batch element.
+
+    After a first round of one proposal per element, each round draws a block
+    of proposals for all elements, sized from the running acceptance rate so
+    that each remaining element is accepted with probability about
+    ``target_accept``. The first accepted proposal of each element is then
+    selected by differentiable masking. Thus most elements are done after one
+    or two rounds, even for large ``sample_shape``.
+
+    :param callable propose: A function that inputs a ``sample_shape`` and
+        returns a pair ``(x, accept)`` of a batch of proposals ``x`` of shape
+        ``sample_shape + batch_shape + event_shape`` and a boolean tensor
+        ``accept`` of shape ``sample_shape + batch_shape``.
+    :param torch.Size sample_shape: The sample shape.
+    :param float target_accept: Target probability that each remaining element
+        is accepted in each round.
+    :param int max_oversample: Maximum number of proposals per element per
+        round.
+    :returns: A batch of accepted proposals of shape
+        ``sample_shape + batch_shape + event_shape``.
+    :rtype: torch.Tensor
+    """
+    sample_shape = torch.Size(sample_shape)
+    x, done = propose(sample_shape)
+    event_dim = x.dim() - done.dim()
+    num_proposed = done.numel()
+    num_accepted = done.sum().item()
+    while num_accepted < done.numel():
+        # Use a pessimistic estimate of the acceptance rate to size the block.
+        rate = max(num_accepted, 1) / (num_proposed + 1)
+        num_samples = int(math.ceil(math.log1p(-target_accept) / math.log1p(-rate)))
+        num_samples = max(1, min(max_oversample, num_samples))
+        proposed_x, accept = propose((num_samples,) + sample_shape)
+        num_proposed += num_samples * (done.numel() - num_accepted)
+        accept &= ~done
+
+        # Select the first accepted proposal of each element.
+        done |= accept.any(0)
+        accept = accept.reshape(accept.shape + (1,) * event_dim)
+        for i in reversed(range(num_samples)):
+            x = torch.where(accept[i], proposed_x[i], x)
+        num_accepted = done.sum().item()
+    return x
@@ -104,6 +104,21 @@ class SpanningTree(TorchDistribution):
 
     @lazy_property
     def log_partition_function(self):
+        # The result is shared among instances with identical unmodified
+        # edge_logits, unless it would need to be differentiated.
+        global _log_partition_cache
+        edge_logits = self.edge_logits
+        cacheable = not (edge_logits.requires_grad and torch.is_grad_enabled())
+        if cacheable and _log_partition_cache is not None:
+            cached_logits, cached_version, result = _log_partition_cache
+            if cached_logits is edge_logits and cached_version == edge_logits._version:
+                return result
+        result = self._log_partition_function()
+        if cacheable:
+            _log_partition_cache = edge_logits, edge_logits._version, result.detach()
+        return result
+
+    def _log_partition_function(self):
         # By Kirchoff's matrix-tree theorem, the partition function is the
         # determinant of a truncated version of the graph Laplacian matrix. We
         # use a Cholesky decomposition to compute the log determinant.
@@ -148,11 +163,12 @@ class SpanningTree(TorchDistribution):
             (2017) https://arxiv.org/abs/1611.07451
         [4] `An almost-linear time algorithm for uniform random spanning tree generation`,
             Aaron Schild (2017) https://arxiv.org/abs/1711.06455
+
+        When ``sample_shape`` is nonempty, independent chains are run for all
+        samples at once, vectorized over samples by the "python" backend.
         """
-        if sample_shape:
-            raise NotImplementedError("SpanningTree does not support batching")
-        edges = sample_tree(self.edge_logits, **self.sampler_options)
-        assert edges.dim() >= 2 and edges.shape[-2:] == self.event_shape
+        edges = sample_tree(self.edge_logits, sample_shape=sample_shape, **self.sampler_options)
+        assert edges.shape == sample_shape + self.event_shape
         return edges
 
     def enumerate_support(self, expand=True):
@@ -168,6 +184,7 @@ class SpanningTree(TorchDistribution):
 ################################################################################
 
 _cpp_module = None
+_log_partition_cache = None
 
 
 def _get_cpp_module():
@@ -323,6 +340,63 @@ def _sample_tree_mcmc(edge_logits, edges):
     return edges
 
 
+@torch.no_grad()
+def _sample_trees_mcmc(edge_logits, edges):
+    # This is a batched version of _sample_tree_mcmc() that runs an
+    # independent chain for each of the N trees in edges.
+    N, E = edges.shape[:2]
+    if E <= 1:
+        return edges
+
+    V = E + 1
+    grid = make_complete_graph(V)
+    rows = torch.arange(N)
+
+    # Each of E edges in each tree is stored as an id k in [0, K) indexing into
+    # the complete graph. The id of an edge (v1,v2) is k = v1+v2*(v2-1)/2.
+    edge_ids = edges[..., 0] + edges[..., 1] * (edges[..., 1] - 1) // 2
+    # This stores each tree as a symmetric adjacency matrix.
+    adjacency = torch.zeros(N, V, V, dtype=edge_logits.dtype)
+    adjacency[rows.unsqueeze(-1), edges[..., 0], edges[..., 1]] = 1
+    adjacency[rows.unsqueeze(-1), edges[..., 1], edges[..., 0]] = 1
+
+    # Cycle through all edges in an independent random order for each chain.
+    order = torch.rand(N, E).argsort(-1)
+    for e in order.unbind(-1):
+        # Remove an edge from each tree.
+        k = edge_ids[rows, e]
+        v1, v2 = grid[0, k], grid[1, k]
+        adjacency[rows, v1, v2] = 0
+        adjacency[rows, v2, v1] = 0
+
+        # Find the component containing v1 by propagating along the remaining edges.
+        components = torch.zeros(N, V, dtype=torch.bool)
+        components[rows, v1] = 1
+        while True:
+            reached = adjacency.bmm(components.unsqueeze(-1).to(adjacency.dtype)).squeeze(-1) > 0
+            reached |= components
+            if (reached == components).all():
+                break
+            components = reached
+
+        # Perform a single-site Gibbs update by moving each edge elsewhere.
+        valid = components[:, grid[0]] ^ components[:, grid[1]]
+        valid_logits = edge_logits.masked_fill(~valid, -math.inf)
+        shift = valid_logits.max(-1, keepdim=True)[0].clamp(min=torch.finfo(valid_logits.dtype).min)
+        valid_probs = (valid_logits - shift).exp()
+        # Keep the old edge in chains where all valid edges have zero probability.
+        valid_probs[rows, k] += (valid_probs.sum(-1) == 0).to(valid_probs.dtype)
+        k = torch.multinomial(valid_probs, 1).squeeze(-1)
+        v1, v2 = grid[0, k], grid[1, k]
+        adjacency[rows, v1, v2] = 1
+        adjacency[rows, v2, v1] = 1
+        edge_ids[rows, e] = k
+
+    # Convert edge ids to a canonical list of pairs.
+    edge_ids = edge_ids.sort(-1)[0]
+    return torch.stack([grid[0, edge_ids], grid[1, edge_ids]], -1)
+
+
 def sample_tree_mcmc(edge_logits, edges, backend="python"):
     """
     Sample a random spanning tree of a dense weighted graph using MCMC.
@@ -394,6 +468,43 @@ def _sample_tree_approx(edge_logits):
     return edges
 
 
+@torch.no_grad()
+def _sample_trees_approx(edge_logits, num_samples):
+    # This is a batched version of _sample_tree_approx().
+    K = len(edge_logits)
+    V = int(round(0.5 + (0.25 + 2 * K)**0.5))
+    assert K == V * (V - 1) // 2
+    E = V - 1
+    N = num_samples
+    grid = make_complete_graph(V)
+    rows = torch.arange(N)
+
+    edge_ids = torch.empty((N, E), dtype=torch.long)
+    # This maps each vertex to whether it is a member of each cumulative tree.
+    components = torch.zeros(N, V, dtype=torch.bool)
+
+    # Sample the first edge at random.
+    probs = (edge_logits - edge_logits.max()).exp()
+    k = torch.multinomial(probs.expand(N, K), 1).squeeze(-1)
+    components[rows, grid[0, k]] = 1
+    components[rows, grid[1, k]] = 1
+    edge_ids[:, 0] = k
+
+    # Sample edges connecting each cumulative tree to a new leaf.
+    for e in range(1, E):
+        mask = components[:, grid[0]] ^ components[:, grid[1]]
+        valid_logits = edge_logits.masked_fill(~mask, -math.inf)
+        probs = (valid_logits - valid_logits.max(-1, keepdim=True)[0]).exp()
+        k = torch.multinomial(probs, 1).squeeze(-1)
+        components[rows, grid[0, k]] = 1
+        components[rows, grid[1, k]] = 1
+        edge_ids[:, e] = k
+
+    # Convert edge ids to a canonical list of pairs.
+    edge_ids = edge_ids.sort(-1)[0]
+    return torch.stack([grid[0, edge_ids], grid[1, edge_ids]], -1)
+
+
 def sample_tree_approx(edge_logits, backend="python"):
     """
     Approximately sample a random spanning tree of a dense weighted graph.
@@ -415,7 +526,27 @@ def sample_tree_approx(edge_logits, backend="python"):
         raise ValueError("unknown backend: {}".format(repr(backend)))
 
 
-def sample_tree(edge_logits, init_edges=None, mcmc_steps=1, backend="python"):
+def sample_tree(edge_logits, init_edges=None, mcmc_steps=1, backend="python", sample_shape=torch.Size()):
+    """
+    Sample a random spanning tree of a dense weighted graph, by running
+    ``mcmc_steps`` steps of :func:`sample_tree_mcmc` starting from
+    ``init_edges`` or from :func:`sample_tree_approx`.
+
+    :param torch.Tensor edge_logits: A length-K array of nonnormalized log
+        probabilities.
+    :param torch.Tensor init_edges: An optional E x 2 tensor of initial edges,
+        or a batch of such tensors broadcastable to ``sample_shape``.
+    :param int mcmc_steps: The number of MCMC steps.
+    :param str backend: One of "python" or "cpp".
+    :param torch.Size sample_shape: A batch shape of independent samples. The
+        "python" backend vectorizes over samples, whereas the "cpp" backend
+        draws samples one at a time.
+    :returns: A tensor of shape ``sample_shape + (E, 2)``.
+    :rtype: torch.Tensor
+    """
+    sample_shape = torch.Size(sample_shape)
+    if sample_shape:
+        return _sample_trees(edge_logits, init_edges, mcmc_steps, backend, sample_shape)
     edges = init_edges
     if edges is None:
         edges = sample_tree_approx(edge_logits, backend=backend)
@@ -424,6 +555,22 @@ def sample_tree(edge_logits, init_edges=None, mcmc_steps=1, backend="python"):
     return edges
 
 
+def _sample_trees(edge_logits, init_edges, mcmc_steps, backend, sample_shape):
+    num_samples = sample_shape.numel()
+    edges = init_edges
+    if edges is not None:
+        edges = edges.expand(sample_shape + edges.shape[-2:]).reshape((num_samples,) + edges.shape[-2:])
+    if backend == "python":
+        if edges is None:
+            edges = _sample_trees_approx(edge_logits, num_samples)
+        for step in range(mcmc_steps):
+            edges = _sample_trees_mcmc(edge_logits, edges)
+    else:
+        edges = torch.stack([sample_tree(edge_logits, None if edges is None else edges[i], mcmc_steps, backend)
+                             for i in range(num_samples)])
+    return edges.reshape(sample_shape + edges.shape[-2:])
+
+
 ################################################################################
 # Enumeration implementation.
 ################################################################################
@@ -5,6 +5,7 @@ from torch.distributions import constraints
 from torch.distributions.utils import broadcast_all
 
 from pyro.distributions import TorchDistribution
+from pyro.distributions.rejector import rejection_sample
 
 
 def _eval_poly(y, coef):
@@ -97,19 +98,17 @@ class VonMises(TorchDistribution):
         Best, D. J., and Nicholas I. Fisher.
         "Efficient simulation of the von Mises distribution." Applied Statistics (1979): 152-157.
         """
-        shape = self._extended_shape(sample_shape)
-        x = torch.empty(shape, dtype=self.loc.dtype, device=self.loc.device)
-        done = torch.zeros(shape, dtype=self.loc.dtype, device=self.loc.device).bool()
-        while not done.all():
+        def propose(sample_shape):
+            shape = self._extended_shape(sample_shape)
             u = torch.rand((3,) + shape, dtype=self.loc.dtype, device=self.loc.device)
             u1, u2, u3 = u.unbind()
             z = torch.cos(math.pi * u1)
             f = (1 + self._proposal_r * z) / (self._proposal_r + z)
             c = self.concentration * (self._proposal_r - f)
             accept = ((c * (2 - c) - u2) > 0) | ((c / u2).log() + 1 - c >= 0)
-            if accept.any():
-                x[accept] = torch.sign(u3[accept] - 0.5) * torch.acos(f[accept])
-                done |= accept
+            return torch.sign(u3 - 0.5) * torch.acos(f), accept
+
+        x = rejection_sample(propose, sample_shape)
         return (x + math.pi + self.loc) % (2 * math.pi) - math.pi
 
     def expand(self, batch_shape):
@@ -10,7 +10,7 @@ from pyro.infer.mcmc.nuts import NUTS
 from pyro.infer.predictive import Predictive
 from pyro.infer.renyi_elbo import RenyiELBO
 from pyro.infer.smcfilter import SMCFilter
-from pyro.infer.svi import SVI
+from pyro.infer.svi import SVI, DataParallelSVI
 from pyro.infer.trace_elbo import JitTrace_ELBO, Trace_ELBO
 from pyro.infer.trace_mean_field_elbo import JitTraceMeanField_ELBO, TraceMeanField_ELBO
 from pyro.infer.trace_tail_adaptive_elbo import TraceTailAdaptive_ELBO
@@ -23,6 +23,7 @@ from pyro.infer.svgd import SVGD, RBFSteinKernel, IMQSteinKernel
 __all__ = [
     "config_enumerate",
     "CSIS",
+    "DataParallelSVI",
     "enable_validation",
     "is_validation_enabled",
     "ELBO",
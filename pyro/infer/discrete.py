@@ -5,7 +5,7 @@ from opt_einsum import shared_intermediates
 
 import pyro.ops.packed as packed
 from pyro import poutine
-from pyro.infer.traceenum_elbo import TraceEnum_ELBO
+from pyro.infer.traceenum_elbo import TraceEnum_ELBO, _find_markov_dims
 from pyro.ops.contract import contract_tensor_tree
 from pyro.ops.einsum.adjoint import require_backward
 from pyro.ops.rings import MapRing, SampleRing
@@ -91,10 +91,12 @@ def _sample_posterior_from_trace(model, enum_trace, temperature, *args, **kwargs
         log_probs.setdefault(ordinal, []).extend(terms)
 
     # Run forward-backward algorithm, collecting the ordinal of each connected component.
+    markov_dims = _find_markov_dims(enum_trace, dim_to_size)
     cache = getattr(enum_trace, "_sharing_cache", {})
     ring = _make_ring(temperature, cache, dim_to_size)
     with shared_intermediates(cache):
-        log_probs = contract_tensor_tree(log_probs, sum_dims, ring=ring)  # run forward algorithm
+        log_probs = contract_tensor_tree(log_probs, sum_dims, ring=ring,
+                                         markov_dims=markov_dims)  # run forward algorithm
     query_to_ordinal = {}
     pending = object()  # a constant value for pending queries
     for query in queries:
@@ -127,7 +129,8 @@ def _sample_posterior_from_trace(model, enum_trace, temperature, *args, **kwargs
                 ordinal = query_to_ordinal[log_prob]
                 new_node["cond_indep_stack"] = tuple(
                     f for f in node["cond_indep_stack"]
-                    if not (f.vectorized and f.size > 1) or plate_to_symbol[f.name] in ordinal)
+                    if not (f.vectorized and f.size > 1) or plate_to_symbol[f.name] in ordinal or
+                    plate_to_symbol[f.name] in markov_dims)
 
                 # Gather if node depended on an enumerated value.
                 sample = log_prob._pyro_backward_result
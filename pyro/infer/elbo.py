@@ -4,7 +4,7 @@ from abc import ABCMeta, abstractmethod
 
 import pyro
 import pyro.poutine as poutine
-from pyro.infer.util import is_validation_enabled
+from pyro.infer.util import TraceStructureCache, is_validation_enabled
 from pyro.poutine.util import prune_subsample_sites
 from pyro.util import check_site_shape
 
@@ -78,6 +78,7 @@ class ELBO(object, metaclass=ABCMeta):
         self.ignore_jit_warnings = ignore_jit_warnings
         self.jit_options = jit_options
         self.tail_adaptive_beta = tail_adaptive_beta
+        self._structure_cache = TraceStructureCache()
 
     def _guess_max_plate_nesting(self, model, guide, *args, **kwargs):
         """
@@ -135,6 +136,22 @@ class ELBO(object, metaclass=ABCMeta):
 
         return wrapped_fn
 
+    def _sum_particle_log_prob(self, log_prob):
+        """
+        Sums a site's ``log_prob`` tensor from a vectorized trace over all
+        dims except the ``num_particles_vectorized`` plate dim.
+
+        :param torch.Tensor log_prob: a site's ``log_prob`` tensor.
+        :return: a tensor of shape ``(num_particles,)``.
+        :rtype: torch.Tensor
+        """
+        dim = log_prob.dim() - self.max_plate_nesting
+        if dim < 0 or self.num_particles == 1:
+            return log_prob.sum().expand(self.num_particles)
+        log_prob = log_prob.reshape(log_prob.shape[:dim + 1] + (-1,)).sum(-1)
+        log_prob = log_prob.reshape(-1, log_prob.size(-1)).sum(0)
+        return log_prob.expand(self.num_particles)
+
     def _get_vectorized_trace(self, model, guide, *args, **kwargs):
         """
         Wraps the model and guide to vectorize ELBO computation over
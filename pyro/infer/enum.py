@@ -2,8 +2,10 @@ import numbers
 from functools import partial
 from queue import LifoQueue
 
+import torch
+
 from pyro import poutine
-from pyro.infer.util import is_validation_enabled
+from pyro.infer.util import get_trace_fingerprint, is_validation_enabled
 from pyro.poutine import Trace
 from pyro.poutine.util import prune_subsample_sites
 from pyro.util import check_model_guide_match, check_site_shape, ignore_jit_warnings
@@ -32,15 +34,23 @@ def iter_discrete_extend(trace, site, **ignored):
         yield extended_trace
 
 
-def get_importance_trace(graph_type, max_plate_nesting, model, guide, *args, **kwargs):
+def get_importance_trace(graph_type, max_plate_nesting, model, guide, *args, structure_cache=None, **kwargs):
     """
     Returns a single trace from the guide, and the model that is run
     against it.
+
+    If a :class:`~pyro.infer.util.TraceStructureCache` is passed as
+    ``structure_cache``, validation is skipped whenever the structure of the
+    traces is unchanged since the previous call with that cache.
     """
     guide_trace = poutine.trace(guide, graph_type=graph_type).get_trace(*args, **kwargs)
     model_trace = poutine.trace(poutine.replay(model, trace=guide_trace),
                                 graph_type=graph_type).get_trace(*args, **kwargs)
-    if is_validation_enabled():
+    validate = is_validation_enabled()
+    if structure_cache is not None:
+        fingerprint = max_plate_nesting, get_trace_fingerprint(model_trace, guide_trace)
+        validate = validate and not structure_cache.is_validated(fingerprint)
+    if validate:
         check_model_guide_match(model_trace, guide_trace, max_plate_nesting)
 
     guide_trace = prune_subsample_sites(guide_trace)
@@ -48,13 +58,15 @@ def get_importance_trace(graph_type, max_plate_nesting, model, guide, *args, **k
 
     model_trace.compute_log_prob()
     guide_trace.compute_score_parts()
-    if is_validation_enabled():
+    if validate:
         for site in model_trace.nodes.values():
             if site["type"] == "sample":
                 check_site_shape(site, max_plate_nesting)
         for site in guide_trace.nodes.values():
             if site["type"] == "sample":
                 check_site_shape(site, max_plate_nesting)
+    if structure_cache is not None:
+        structure_cache.update(fingerprint, validated=validate)
 
     return model_trace, guide_trace
 
@@ -82,7 +94,7 @@ def iter_discrete_traces(graph_type, fn, *args, **kwargs):
         yield traced_fn.get_trace(*args, **kwargs)
 
 
-def _config_fn(default, expand, num_samples, site):
+def _config_fn(default, expand, num_samples, topk, topk_mass, site):
     if site["type"] != "sample" or site["is_observed"]:
         return {}
     if type(site["fn"]).__name__ == "_Subsample":
@@ -91,16 +103,23 @@ def _config_fn(default, expand, num_samples, site):
         return {"enumerate": site["infer"].get("enumerate", default),
                 "num_samples": site["infer"].get("num_samples", num_samples)}
     if getattr(site["fn"], "has_enumerate_support", False):
-        return {"enumerate": site["infer"].get("enumerate", default),
-                "expand": site["infer"].get("expand", expand)}
+        config = {"enumerate": site["infer"].get("enumerate", default),
+                  "expand": site["infer"].get("expand", expand)}
+        # Truncation is only supported for categorical sites; others are fully enumerated.
+        if isinstance(site["fn"], (torch.distributions.Categorical, torch.distributions.OneHotCategorical)):
+            if topk is not None:
+                config["topk"] = site["infer"].get("topk", topk)
+            if topk_mass is not None:
+                config["topk_mass"] = site["infer"].get("topk_mass", topk_mass)
+        return config
     return {}
 
 
-def _config_enumerate(default, expand, num_samples):
-    return partial(_config_fn, default, expand, num_samples)
+def _config_enumerate(default, expand, num_samples, topk=None, topk_mass=None):
+    return partial(_config_fn, default, expand, num_samples, topk, topk_mass)
 
 
-def config_enumerate(guide=None, default="parallel", expand=False, num_samples=None):
+def config_enumerate(guide=None, default="parallel", expand=False, num_samples=None, topk=None, topk_mass=None):
     """
     Configures enumeration for all relevant sites in a guide. This is mainly
     used in conjunction with :class:`~pyro.infer.traceenum_elbo.TraceEnum_ELBO`.
@@ -139,6 +158,21 @@ def config_enumerate(guide=None, default="parallel", expand=False, num_samples=N
         than exhaustive enumeration. This makes sense for both continuous and
         discrete distributions.
     :type num_samples: int or None
+    :param topk: if not ``None``, enumerate over only the ``topk`` most
+        probable values of each :class:`~pyro.distributions.Categorical` or
+        :class:`~pyro.distributions.OneHotCategorical` site, so that cost
+        scales with ``topk`` rather than with the size of the support. Each
+        site's distribution is renormalized to its truncated support, thus the
+        ELBO is exact for the truncated model and guide, and is an
+        approximation to the ELBO of the original model and guide.
+        Truncated values are always expanded. Other enumerable sites are
+        enumerated over their full support. This only applies to parallel
+        enumeration.
+    :type topk: int or None
+    :param topk_mass: if not ``None``, further truncate the support of each
+        site to the fewest values that cover this probability mass in every
+        batch element.
+    :type topk_mass: float or None
     :return: an annotated guide
     :rtype: callable
     """
@@ -154,9 +188,24 @@ def config_enumerate(guide=None, default="parallel", expand=False, num_samples=N
         if default == "sequential":
             raise ValueError('Local sampling does not support "sequential" sampling; '
                              'use "parallel" sampling instead.')
+    if topk is not None:
+        if not (isinstance(topk, numbers.Integral) and topk > 0):
+            raise ValueError("Invalid topk, expected None or positive integer, but got {}".format(repr(topk)))
+    if topk_mass is not None:
+        if not (isinstance(topk_mass, numbers.Real) and 0 < topk_mass <= 1):
+            raise ValueError("Invalid topk_mass, expected None or a number in (0, 1], but got {}".format(
+                repr(topk_mass)))
+    if topk is not None or topk_mass is not None:
+        if num_samples is not None:
+            raise ValueError("Local sampling does not support truncated enumeration; "
+                             "set either num_samples or topk and topk_mass.")
+        if default == "sequential":
+            raise ValueError('Truncated enumeration does not support "sequential" enumeration; '
+                             'use "parallel" enumeration instead.')
 
     # Support usage as a decorator:
     if guide is None:
-        return lambda guide: config_enumerate(guide, default=default, expand=expand, num_samples=num_samples)
+        return lambda guide: config_enumerate(guide, default=default, expand=expand, num_samples=num_samples,
+                                              topk=topk, topk_mass=topk_mass)
 
-    return poutine.infer_config(guide, config_fn=_config_enumerate(default, expand, num_samples))
+    return poutine.infer_config(guide, config_fn=_config_enumerate(default, expand, num_samples, topk, topk_mass))
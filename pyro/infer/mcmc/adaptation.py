@@ -8,6 +8,35 @@ from pyro.ops.dual_averaging import DualAveraging
 from pyro.ops.welford import WelfordCovariance
 
 adapt_window = namedtuple("adapt_window", ["start", "end"])
+# Inverse mass matrix of the form `diag(scale) @ (I + vectors @ diag(values) @ vectors.T) @ diag(scale)`,
+# where `vectors` has orthonormal columns.
+low_rank_matrix = namedtuple("low_rank_matrix", ["scale", "vectors", "values"])
+
+
+def _exp(x):
+    return x.exp() if torch.is_tensor(x) else math.exp(x)
+
+
+def _log(x):
+    return x.log() if torch.is_tensor(x) else math.log(x)
+
+
+def _block_matvec(blocks, r):
+    # product of a block diagonal matrix, given as a list of dense blocks, with `r`
+    r_blocks = r.split([block.size(-1) for block in blocks], dim=-1)
+    return torch.cat([block.matmul(r_block.unsqueeze(-1)).squeeze(-1)
+                      for block, r_block in zip(blocks, r_blocks)], dim=-1)
+
+
+def _low_rank_correction(vectors, values, u):
+    # computes `vectors @ diag(values) @ vectors.T @ u`, in O(D x rank)
+    return (u.unsqueeze(-2).matmul(vectors) * values.unsqueeze(-2)).matmul(vectors.transpose(-1, -2)).squeeze(-2)
+
+
+def _low_rank_matvec(matrix, r):
+    # product of a `low_rank_matrix` with `r`
+    u = matrix.scale * r
+    return matrix.scale * (u + _low_rank_correction(matrix.vectors, matrix.values, u))
 
 
 class WarmupAdapter(object):
@@ -16,6 +45,27 @@ class WarmupAdapter(object):
     warmup phase. This class provides lookup properties to read the latest
     values of ``step_size`` and ``inverse_mass_matrix``. These values are
     periodically updated when adaptation is engaged.
+
+    When sampling a batch of chains in a single process, ``step_size`` is a
+    tensor holding one step size per chain, and ``inverse_mass_matrix`` has
+    the chain dimension as its leading dimension. All chains are adapted
+    independently of each other.
+
+    The structure of the mass matrix is one of:
+
+    - ``"diag"``: ``inverse_mass_matrix`` is a vector holding its diagonal.
+    - ``"dense"``: ``inverse_mass_matrix`` is a dense matrix.
+    - ``"block"``: ``inverse_mass_matrix`` is block diagonal, given as a list
+      of dense blocks, one for each latent site.
+    - ``"low_rank"``: ``inverse_mass_matrix`` is a diagonal matrix plus a low
+      rank correction, given as a :data:`low_rank_matrix`. The diagonal is
+      adapted using Welford's scheme, and the low rank correction holds the
+      ``mass_rank`` leading principal components of the standardized samples
+      of the latest adaptation window. This costs O(D x mass_rank) per product.
+
+    :param str mass_structure: the structure of the mass matrix. If `None`, this
+        is ``"diag"`` or ``"dense"`` depending on ``is_diag_mass``.
+    :param int mass_rank: rank of the correction for ``mass_structure="low_rank"``.
     """
 
     def __init__(self,
@@ -23,17 +73,28 @@ class WarmupAdapter(object):
                  adapt_step_size=False,
                  target_accept_prob=0.8,
                  adapt_mass_matrix=False,
-                 is_diag_mass=True):
+                 is_diag_mass=True,
+                 mass_structure=None,
+                 mass_rank=10):
+        if mass_structure is None:
+            mass_structure = "diag" if is_diag_mass else "dense"
+        if mass_structure not in ("diag", "dense", "block", "low_rank"):
+            raise ValueError("mass_structure must be one of 'diag', 'dense', 'block' or 'low_rank', "
+                             "but got {}.".format(mass_structure))
         self.adapt_step_size = adapt_step_size
         self.adapt_mass_matrix = adapt_mass_matrix
         self.target_accept_prob = target_accept_prob
-        self.is_diag_mass = is_diag_mass
+        self.mass_structure = mass_structure
+        self.is_diag_mass = mass_structure == "diag"
+        self.mass_rank = mass_rank
         self.step_size = 1 if step_size is None else step_size
         self._adaptation_disabled = not (adapt_step_size or adapt_mass_matrix)
         if adapt_step_size:
             self._step_size_adapt_scheme = DualAveraging()
         if adapt_mass_matrix:
-            self._mass_matrix_adapt_scheme = WelfordCovariance(diagonal=is_diag_mass)
+            self._mass_matrix_adapt_scheme = WelfordCovariance(diagonal=mass_structure != "dense")
+            # samples of the current window, for the low rank correction
+            self._window_samples = []
 
         # We separate warmup_steps into windows:
         #   start_buffer + window 1 + window 2 + window 3 + ... + end_buffer
@@ -93,7 +154,7 @@ class WarmupAdapter(object):
         if self._find_reasonable_step_size is not None:
             with pyro.validation_enabled(False):
                 self.step_size = self._find_reasonable_step_size(z)
-        self._step_size_adapt_scheme.prox_center = math.log(10 * self.step_size)
+        self._step_size_adapt_scheme.prox_center = _log(10 * self.step_size)
         self._step_size_adapt_scheme.reset()
 
     def _update_step_size(self, accept_prob):
@@ -101,22 +162,104 @@ class WarmupAdapter(object):
         H = self.target_accept_prob - accept_prob
         self._step_size_adapt_scheme.step(H)
         log_step_size, _ = self._step_size_adapt_scheme.get_state()
-        self.step_size = math.exp(log_step_size)
+        self.step_size = _exp(log_step_size)
 
     def _update_r_dist(self):
-        loc = torch.zeros(self._inverse_mass_matrix.size(0),
-                          dtype=self._inverse_mass_matrix.dtype,
-                          device=self._inverse_mass_matrix.device)
-        if self.is_diag_mass:
+        if self.mass_structure == "diag":
+            loc = self._inverse_mass_matrix.new_zeros(self._inverse_mass_matrix.shape)
             self._r_dist = dist.Normal(loc, self._inverse_mass_matrix.rsqrt())
-        else:
+        elif self.mass_structure == "dense":
+            loc = self._inverse_mass_matrix.new_zeros(self._inverse_mass_matrix.shape[:-1])
             self._r_dist = dist.MultivariateNormal(loc,
                                                    precision_matrix=self._inverse_mass_matrix)
+        else:
+            # momentum is sampled as a linear transform of standard normal noise
+            if self.mass_structure == "block":
+                self._r_factors = [block.cholesky() for block in self._inverse_mass_matrix]
+                loc = torch.cat([block.new_zeros(block.shape[:-1]) for block in self._inverse_mass_matrix], -1)
+            else:
+                self._r_factors = (1 + self._inverse_mass_matrix.values).rsqrt() - 1
+                loc = self._inverse_mass_matrix.scale.new_zeros(self._inverse_mass_matrix.scale.shape)
+            self._r_dist = dist.Normal(loc, 1.)
+
+    def _reset_mass_matrix_adapt_scheme(self):
+        if self.mass_structure == "block":
+            self._mass_matrix_adapt_scheme = [WelfordCovariance(diagonal=False)
+                                              for _ in self._inverse_mass_matrix]
+        else:
+            self._mass_matrix_adapt_scheme.reset()
+            self._window_samples = []
+
+    def _update_mass_matrix_adapt_scheme(self, z_flat):
+        if self.mass_structure == "block":
+            z_blocks = z_flat.split([block.size(-1) for block in self._inverse_mass_matrix], dim=-1)
+            for scheme, z_block in zip(self._mass_matrix_adapt_scheme, z_blocks):
+                scheme.update(z_block)
+        else:
+            self._mass_matrix_adapt_scheme.update(z_flat)
+            if self.mass_structure == "low_rank":
+                self._window_samples.append(z_flat)
+
+    def _get_inverse_mass_matrix(self):
+        if self.mass_structure == "block":
+            return [scheme.get_covariance() for scheme in self._mass_matrix_adapt_scheme]
+        cov = self._mass_matrix_adapt_scheme.get_covariance()
+        if self.mass_structure != "low_rank":
+            return cov
+        # principal components of the standardized window samples
+        scale = cov.sqrt()
+        samples = torch.stack(self._window_samples, dim=-2)
+        n = samples.size(-2)
+        samples = samples - self._mass_matrix_adapt_scheme._mean.unsqueeze(-2)
+        samples = samples / (scale.unsqueeze(-2) * math.sqrt(n - 1))
+        _, s, v = torch.svd(samples)
+        size, rank = scale.size(-1), min(self.mass_rank, s.size(-1))
+        eigvals = s[..., :rank] ** 2
+        # the remaining directions are given the average of the remaining eigenvalues
+        # (the eigenvalues of the correlation matrix sum up to `size`)
+        if rank < size:
+            residual = ((size - eigvals.sum(-1, keepdim=True)) / (size - rank)).clamp(min=1e-3)
+        else:
+            residual = eigvals.new_ones(eigvals.shape[:-1] + (1,))
+        # shrink the correction towards zero, as for the diagonal (from Stan)
+        values = (n / (n + 5.)) * (eigvals / residual - 1)
+        return low_rank_matrix(scale * residual.sqrt(), v[..., :rank], values)
+
+    def sample_r(self, name):
+        r"""
+        Samples a flattened momentum from the distribution with covariance given
+        by the mass matrix.
+
+        :param str name: name of the sample site.
+        """
+        r = pyro.sample(name, self._r_dist)
+        if self.mass_structure == "block":
+            r_blocks = r.split([factor.size(-1) for factor in self._r_factors], dim=-1)
+            # r = L^{-T} noise has covariance (L L^T)^{-1}
+            r = torch.cat([r_block.unsqueeze(-1).triangular_solve(factor, upper=False, transpose=True)[0]
+                           for factor, r_block in zip(self._r_factors, r_blocks)], dim=-2).squeeze(-1)
+        elif self.mass_structure == "low_rank":
+            # apply the inverse square root of the inverse mass matrix
+            vectors = self._inverse_mass_matrix.vectors
+            r = (r + _low_rank_correction(vectors, self._r_factors, r)) / self._inverse_mass_matrix.scale
+        return r
+
+    def inverse_mass_matvec(self, r):
+        r"""
+        Computes the product of the inverse mass matrix with a flattened momentum ``r``.
+        """
+        if self.mass_structure == "diag":
+            return self._inverse_mass_matrix * r
+        elif self.mass_structure == "dense":
+            return self._inverse_mass_matrix.matmul(r.unsqueeze(-1)).squeeze(-1)
+        elif self.mass_structure == "block":
+            return _block_matvec(self._inverse_mass_matrix, r)
+        return _low_rank_matvec(self._inverse_mass_matrix, r)
 
     def _end_adaptation(self):
         if self.adapt_step_size:
             _, log_step_size_avg = self._step_size_adapt_scheme.get_state()
-            self.step_size = math.exp(log_step_size_avg)
+            self.step_size = _exp(log_step_size_avg)
 
     def configure(self, warmup_steps, initial_step_size=None, inv_mass_matrix=None,
                   find_reasonable_step_size_fn=None):
@@ -149,7 +292,8 @@ class WarmupAdapter(object):
 
         :param int t: time step, beginning at 0.
         :param dict z: latent variables.
-        :param float accept_prob: acceptance probability of the proposal.
+        :param torch.Tensor accept_prob: acceptance probability of the proposal.
+            This has shape ``(num_chains,)`` when a batch of chains is adapted.
         """
         if t >= self._warmup_steps or self._adaptation_disabled:
             return
@@ -157,11 +301,13 @@ class WarmupAdapter(object):
         num_windows = len(self._adaptation_schedule)
         mass_matrix_adaptation_phase = self.adapt_mass_matrix and \
             (0 < self._current_window < num_windows - 1)
+        # leading batch dims of `z`, if any, index independent chains
+        batch_shape = accept_prob.shape
         if self.adapt_step_size:
-            self._update_step_size(accept_prob.item())
+            self._update_step_size(accept_prob if batch_shape else accept_prob.item())
         if mass_matrix_adaptation_phase:
-            z_flat = torch.cat([z[name].reshape(-1) for name in sorted(z)])
-            self._mass_matrix_adapt_scheme.update(z_flat.detach())
+            z_flat = torch.cat([z[name].reshape(batch_shape + (-1,)) for name in sorted(z)], dim=-1)
+            self._update_mass_matrix_adapt_scheme(z_flat.detach())
         if t == window.end:
             if self._current_window == num_windows - 1:
                 self._current_window += 1
@@ -173,7 +319,7 @@ class WarmupAdapter(object):
                 return
 
             if mass_matrix_adaptation_phase:
-                self.inverse_mass_matrix = self._mass_matrix_adapt_scheme.get_covariance()
+                self.inverse_mass_matrix = self._get_inverse_mass_matrix()
                 if self.adapt_step_size:
                     self.reset_step_size_adaptation(z)
 
@@ -192,7 +338,7 @@ class WarmupAdapter(object):
         self._inverse_mass_matrix = value
         self._update_r_dist()
         if self.adapt_mass_matrix:
-            self._mass_matrix_adapt_scheme.reset()
+            self._reset_mass_matrix_adapt_scheme()
 
     @property
     def r_dist(self):
@@ -22,6 +22,7 @@ import pyro
 from pyro.infer.mcmc.hmc import HMC
 from pyro.infer.mcmc.nuts import NUTS
 from pyro.infer.mcmc.logger import initialize_logger, DIAGNOSTIC_MSG, TqdmHandler, ProgressBar
+from pyro.infer.mcmc.sample_store import SampleStore
 from pyro.infer.mcmc.util import diagnostics, initialize_model, summary
 import pyro.poutine as poutine
 
@@ -63,12 +64,19 @@ def logger_thread(log_queue, warmup_steps, num_samples, num_chains, disable_prog
 
 
 class _Worker(object):
-    def __init__(self, chain_id, result_queue, log_queue, event, kernel, num_samples,
-                 warmup_steps, initial_params=None, hook=None):
+    """
+    Runs a single chain in a worker process. Samples are written into a ring
+    of ``num_blocks`` blocks of ``block_size`` rows in a shared memory tensor,
+    and only the location of each completed block is sent to the main process
+    via `result_queue`. The `free_blocks` semaphore counts the number of blocks
+    which have been read by the main process and can be overwritten.
+    """
+    def __init__(self, chain_id, result_queue, log_queue, free_blocks, kernel, num_samples,
+                 warmup_steps, initial_params=None, hook=None, block_size=100, num_blocks=2):
         self.chain_id = chain_id
         self.kernel = kernel
-        if initial_params is not None:
-            self.kernel.initial_params = initial_params
+        # the kernel is shared by all workers, so initial params are set in the worker process
+        self.initial_params = initial_params
         self.num_samples = num_samples
         self.warmup_steps = warmup_steps
         self.rng_seed = (torch.initial_seed() + chain_id) % MAX_SEED
@@ -76,10 +84,14 @@ class _Worker(object):
         self.result_queue = result_queue
         self.default_tensor_type = torch.Tensor().type()
         self.hook = hook
-        self.event = event
+        self.free_blocks = free_blocks
+        self.block_size = block_size
+        self.num_blocks = num_blocks
 
     def run(self, *args, **kwargs):
         pyro.set_rng_seed(self.rng_seed)
+        if self.initial_params is not None:
+            self.kernel.initial_params = self.initial_params
         torch.set_default_tensor_type(self.default_tensor_type)
         # XXX we clone CUDA tensor args to resolve the issue "Invalid device pointer"
         # at https://github.com/pytorch/pytorch/issues/10375
@@ -92,11 +104,29 @@ class _Worker(object):
         logging_hook = _add_logging_hook(logger, None, self.hook)
 
         try:
-            for sample in _gen_samples(self.kernel, self.warmup_steps, self.num_samples, logging_hook,
-                                       *args, **kwargs):
-                self.result_queue.put_nowait((self.chain_id, sample))
-                self.event.wait()
-                self.event.clear()
+            samples = _gen_samples(self.kernel, self.warmup_steps, self.num_samples, logging_hook,
+                                   *args, **kwargs)
+            z_structure = next(samples)
+            params = self.kernel.initial_params
+            num_params = sum(shape.numel() for shape in z_structure.values())
+            site_value = next(iter(params.values())) if params else torch.tensor([])
+            buffer = site_value.new_empty(self.num_blocks * self.block_size, num_params).share_memory_()
+            self.result_queue.put_nowait((self.chain_id, (z_structure, buffer)))
+
+            for i in range(self.num_samples):
+                pos = i % buffer.size(0)
+                if pos % self.block_size == 0:
+                    # wait until the main process has read this block
+                    self.free_blocks.acquire()
+                    start = pos
+                buffer[pos] = next(samples)
+                if pos + 1 - start == self.block_size or i + 1 == self.num_samples:
+                    self.result_queue.put_nowait((self.chain_id, slice(start, pos + 1)))
+            # wait for all blocks to be read before the buffer is released
+            for _ in range(self.num_blocks):
+                self.free_blocks.acquire()
+            for val in samples:
+                self.result_queue.put_nowait((self.chain_id, val))
             self.result_queue.put_nowait((self.chain_id, None))
         except Exception as e:
             logger.exception(e)
@@ -161,11 +191,63 @@ class _UnarySampler(object):
         progress_bar.close()
 
 
+class _VectorizedSampler(object):
+    """
+    Single process runner class for running MCMC chains as a batch, where
+    the kernel samples the chains in lockstep.
+    """
+
+    def __init__(self, kernel, num_samples, warmup_steps, num_chains, disable_progbar,
+                 initial_params=None, hook=None):
+        self.kernel = kernel
+        self.kernel._num_chains = num_chains
+        if initial_params is not None:
+            self.kernel.initial_params = initial_params
+        self.warmup_steps = warmup_steps
+        self.num_samples = num_samples
+        self.num_chains = num_chains
+        self.disable_progbar = disable_progbar
+        self.hook = hook
+        super(_VectorizedSampler, self).__init__()
+
+    def terminate(self, *args, **kwargs):
+        pass
+
+    def run(self, *args, **kwargs):
+        logger = logging.getLogger("pyro.infer.mcmc")
+        progress_bar = ProgressBar(self.warmup_steps, self.num_samples, disable=self.disable_progbar)
+        logger = initialize_logger(logger, "", progress_bar)
+        hook_w_logging = _add_logging_hook(logger, progress_bar, self.hook)
+        kernel = self.kernel
+        kernel.setup(self.warmup_steps, *args, **kwargs)
+        params = kernel.initial_params
+        # yield structure (key, value.shape) of the params of each chain
+        z_structure = {k: v.shape[1:] for k, v in params.items()}
+        for chain_id in range(self.num_chains):
+            yield z_structure, chain_id
+        for i in range(self.warmup_steps):
+            params = kernel.sample(params)
+            hook_w_logging(kernel, params, 'warmup', i)
+        for i in range(self.num_samples):
+            params = kernel.sample(params)
+            hook_w_logging(kernel, params, 'sample', i)
+            z_flat = torch.cat([params[site].reshape(self.num_chains, -1) for site in sorted(params)], dim=-1) \
+                if params else torch.empty(self.num_chains, 0)
+            for chain_id in range(self.num_chains):
+                yield z_flat[chain_id], chain_id
+        diagnostics = kernel.diagnostics()
+        for chain_id in range(self.num_chains):
+            yield diagnostics[chain_id], chain_id
+        kernel.cleanup()
+        progress_bar.close()
+
+
 class _MultiSampler(object):
     """
     Parallel runner class for running MCMC chains in parallel. This uses the
     `torch.multiprocessing` module (itself a light wrapper over the python
-    `multiprocessing` module) to spin up parallel workers.
+    `multiprocessing` module) to spin up parallel workers. Samples are passed
+    from the workers in blocks, via shared memory buffers.
     """
     def __init__(self, kernel, num_samples, warmup_steps, num_chains, mp_context,
                  disable_progbar, initial_params=None, hook=None):
@@ -188,14 +270,18 @@ class _MultiSampler(object):
                                                  self.num_chains, disable_progbar))
         self.log_thread.daemon = True
         self.log_thread.start()
-        self.events = [self.ctx.Event() for _ in range(num_chains)]
+        self.num_blocks = 2
+        self.block_size = max(min(num_samples, 100), 1)
+        self.free_blocks = [self.ctx.Semaphore(self.num_blocks) for _ in range(num_chains)]
+        self.buffers = [None] * num_chains
 
     def init_workers(self, *args, **kwargs):
         self.workers = []
         for i in range(self.num_chains):
             init_params = {k: v[i] for k, v in self.initial_params.items()} if self.initial_params is not None else None
-            worker = _Worker(i, self.result_queue, self.log_queue, self.events[i], self.kernel,
-                             self.num_samples, self.warmup_steps, initial_params=init_params, hook=self.hook)
+            worker = _Worker(i, self.result_queue, self.log_queue, self.free_blocks[i], self.kernel,
+                             self.num_samples, self.warmup_steps, initial_params=init_params, hook=self.hook,
+                             block_size=self.block_size, num_blocks=self.num_blocks)
             worker.daemon = True
             self.workers.append(self.ctx.Process(name=str(i), target=worker.run,
                                                  args=args, kwargs=kwargs))
@@ -232,11 +318,21 @@ class _MultiSampler(object):
                 if isinstance(val, Exception):
                     # Exception trace is already logged by worker.
                     raise val
-                if val is not None:
-                    yield val, chain_id
-                    self.events[chain_id].set()
-                else:
+                if val is None:
                     active_workers -= 1
+                elif isinstance(val, tuple):
+                    # structure of params, and the shared buffer which holds samples
+                    z_structure, self.buffers[chain_id] = val
+                    yield z_structure, chain_id
+                elif isinstance(val, slice):
+                    # read a block of samples, and hand it back to the worker
+                    block = self.buffers[chain_id][val].clone()
+                    self.free_blocks[chain_id].release()
+                    for sample in block:
+                        yield sample, chain_id
+                else:
+                    self.buffers[chain_id] = None
+                    yield val, chain_id
             exc_raised = False
         finally:
             self.terminate(terminate_workers=exc_raised)
@@ -256,6 +352,13 @@ class MCMC(object):
         the "spawn" context is available in Windows). This has also not
         been extensively tested on the Windows platform.
 
+    .. note:: With ``chain_method="vectorized"``, all chains are run in the
+        main process as a single batch, by adding a leading chain dimension to
+        each latent site. This is only supported by the :class:`~pyro.infer.mcmc.HMC`
+        and :class:`~pyro.infer.mcmc.NUTS` kernels, and requires the model to
+        broadcast correctly over this additional (leftmost) batch dimension, as
+        with ``vectorize_particles=True`` in :class:`~pyro.infer.elbo.ELBO`.
+
     :param kernel: An instance of the ``TraceKernel`` class, which when
         given an execution trace returns another sample trace from the target
         (posterior) distribution.
@@ -265,8 +368,9 @@ class MCMC(object):
         during the warmup phase are discarded. If not provided, default is
         half of `num_samples`.
     :param int num_chains: Number of MCMC chains to run in parallel. Depending on
-        whether `num_chains` is 1 or more than 1, this class internally dispatches
-        to either `_UnarySampler` or `_MultiSampler`.
+        whether `num_chains` is 1 or more than 1, and on `chain_method`, this class
+        internally dispatches to either `_UnarySampler`, `_MultiSampler` or
+        `_VectorizedSampler`.
     :param dict initial_params: dict containing initial tensors in unconstrained
         space to initiate the markov chain. The leading dimension's size must match
         that of `num_chains`. If not specified, parameter values will be sampled from
@@ -274,7 +378,8 @@ class MCMC(object):
     :param hook_fn: Python callable that takes in `(kernel, samples, stage, i)`
         as arguments. stage is either `sample` or `warmup` and i refers to the
         i'th sample for the given stage. This can be used to implement additional
-        logging, or more generally, run arbitrary code per generated sample.
+        logging, or more generally, run arbitrary code per generated sample. With
+        ``chain_method="vectorized"``, `samples` have a leading chain dimension.
     :param str mp_context: Multiprocessing context to use when `num_chains > 1`.
         Only applicable for Python 3.5 and above. Use `mp_context="spawn"` for
         CUDA.
@@ -284,35 +389,50 @@ class MCMC(object):
         Switch to `True` for debugging purposes.
     :param dict transforms: dictionary that specifies a transform for a sample site
         with constrained support to unconstrained space.
+    :param str chain_method: One of "parallel" (default), which runs the chains
+        in separate processes, or "vectorized", which runs the chains as a batch
+        in the main process.
+    :param ~pyro.infer.mcmc.sample_store.SampleStore sample_store: storage for the
+        draws, which are streamed into it as they are generated. This can be used
+        to thin the draws, to only retain the most recent draws, or to write them
+        to disk rather than keeping them in memory. Defaults to an in-memory store
+        which retains every draw.
     """
     def __init__(self, kernel, num_samples, warmup_steps=None, initial_params=None,
                  num_chains=1, hook_fn=None, mp_context=None, disable_progbar=False,
-                 disable_validation=True, transforms=None):
+                 disable_validation=True, transforms=None, chain_method="parallel",
+                 sample_store=None):
+        if chain_method not in ("parallel", "vectorized"):
+            raise ValueError("chain_method must be one of 'parallel' or 'vectorized', "
+                             "but got {}.".format(chain_method))
+        if chain_method == "vectorized" and not isinstance(kernel, (HMC, NUTS)):
+            raise ValueError("chain_method='vectorized' is only supported for HMC and NUTS kernels.")
         self.warmup_steps = num_samples if warmup_steps is None else warmup_steps  # Stan
         self.num_samples = num_samples
         self.kernel = kernel
         self.transforms = transforms
         self.disable_validation = disable_validation
+        self.sample_store = SampleStore() if sample_store is None else sample_store
         self._samples = None
         if isinstance(self.kernel, (HMC, NUTS)) and self.kernel.potential_fn is not None:
             if initial_params is None:
                 raise ValueError("Must provide valid initial parameters to begin sampling"
                                  " when using `potential_fn` in HMC/NUTS kernel.")
-        if num_chains > 1:
+        if num_chains > 1 or chain_method == "vectorized":
             # check that initial_params is different for each chain
             if initial_params:
                 for v in initial_params.values():
                     if v.shape[0] != num_chains:
                         raise ValueError("The leading dimension of tensors in `initial_params` "
                                          "must match the number of chains.")
-                if mp_context is None:
+                if mp_context is None and chain_method == "parallel":
                     # change multiprocessing context to 'spawn' for CUDA tensors.
                     if list(initial_params.values())[0].is_cuda:
                         mp_context = "spawn"
 
             # verify num_chains is compatible with available CPU.
             available_cpu = max(mp.cpu_count() - 1, 1)  # reserving 1 for the main process.
-            if num_chains > available_cpu:
+            if chain_method == "parallel" and num_chains > available_cpu:
                 warnings.warn("num_chains={} is more than available_cpu={}. "
                               "Resetting number of chains to available CPU count."
                               .format(num_chains, available_cpu))
@@ -327,46 +447,17 @@ class MCMC(object):
         self.num_chains = num_chains
         self._diagnostics = [None] * num_chains
 
-        if num_chains > 1:
+        if chain_method == "vectorized":
+            self.sampler = _VectorizedSampler(kernel, num_samples, self.warmup_steps, num_chains,
+                                              disable_progbar, initial_params=initial_params, hook=hook_fn)
+        elif num_chains > 1:
             self.sampler = _MultiSampler(kernel, num_samples, self.warmup_steps, num_chains, mp_context,
                                          disable_progbar, initial_params=initial_params, hook=hook_fn)
         else:
             self.sampler = _UnarySampler(kernel, num_samples, self.warmup_steps, disable_progbar,
                                          initial_params=initial_params, hook=hook_fn)
 
-    @poutine.block
-    def run(self, *args, **kwargs):
-        num_samples = [0] * self.num_chains
-        z_flat_acc = [[] for _ in range(self.num_chains)]
-        with pyro.validation_enabled(not self.disable_validation):
-            for x, chain_id in self.sampler.run(*args, **kwargs):
-                if num_samples[chain_id] == 0:
-                    num_samples[chain_id] += 1
-                    z_structure = x
-                elif num_samples[chain_id] == self.num_samples + 1:
-                    self._diagnostics[chain_id] = x
-                else:
-                    num_samples[chain_id] += 1
-                    if self.num_chains > 1:
-                        x_cloned = x.clone()
-                        del x
-                    else:
-                        x_cloned = x
-                    z_flat_acc[chain_id].append(x_cloned)
-
-        z_flat_acc = torch.stack([torch.stack(l) for l in z_flat_acc])
-
-        # unpack latent
-        pos = 0
-        z_acc = z_structure.copy()
-        for k in sorted(z_structure):
-            shape = z_structure[k]
-            next_pos = pos + shape.numel()
-            z_acc[k] = z_flat_acc[:, :, pos:next_pos].reshape(
-                (self.num_chains, self.num_samples) + shape)
-            pos = next_pos
-        assert pos == z_flat_acc.shape[-1]
-
+    def _get_transforms(self, *args, **kwargs):
         # If transforms is not explicitly provided, infer automatically using
         # model args, kwargs.
         if self.transforms is None and isinstance(self.kernel, (HMC, NUTS)):
@@ -378,11 +469,41 @@ class MCMC(object):
                                                             model_kwargs=kwargs)
             else:
                 self.transforms = {}
+        return self.transforms or {}
+
+    @poutine.block
+    def run(self, *args, **kwargs):
+        num_samples = [0] * self.num_chains
+        store = self.sample_store
+        store.reset(self.num_chains, self.num_samples)
+        site_layout = None
+        with pyro.validation_enabled(not self.disable_validation):
+            for x, chain_id in self.sampler.run(*args, **kwargs):
+                if num_samples[chain_id] == 0:
+                    num_samples[chain_id] += 1
+                    if site_layout is None:
+                        # positions of the sites in the flattened latent
+                        site_layout = []
+                        pos = 0
+                        for k in sorted(x):
+                            next_pos = pos + x[k].numel()
+                            site_layout.append((k, x[k], pos, next_pos))
+                            pos = next_pos
+                        transforms = self._get_transforms(*args, **kwargs)
+                elif num_samples[chain_id] == self.num_samples + 1:
+                    self._diagnostics[chain_id] = x
+                else:
+                    num_samples[chain_id] += 1
+                    # unpack latent, and transform it back to constrained space
+                    z = {}
+                    for k, shape, pos, next_pos in site_layout:
+                        z[k] = x[pos:next_pos].reshape(shape)
+                        if k in transforms:
+                            z[k] = transforms[k].inv(z[k])
+                    store.append(chain_id, z)
 
-        # transform samples back to constrained space
-        for name, transform in self.transforms.items():
-            z_acc[name] = transform.inv(z_acc[name])
-        self._samples = z_acc
+        store.finalize()
+        self._samples = store.get_samples()
 
         # terminate the sampler (shut down worker processes)
         self.sampler.terminate(True)
@@ -416,24 +537,31 @@ class MCMC(object):
             samples = {k: v.index_select(batch_dim, idxs) for k, v in samples.items()}
         return samples
 
-    def diagnostics(self):
+    def diagnostics(self, batch_size=None):
         """
         Gets some diagnostics statistics such as effective sample size, split
         Gelman-Rubin, or divergent transitions from the sampler.
+
+        :param int batch_size: if not `None`, the statistics of each site are
+            computed for ``batch_size`` elements at a time, to bound memory usage.
         """
-        diag = diagnostics(self._samples)
+        diag = diagnostics(self._samples, batch_size=batch_size)
         for diag_name in self._diagnostics[0]:
             diag[diag_name] = {'chain {}'.format(i): self._diagnostics[i][diag_name]
                                for i in range(self.num_chains)}
         return diag
 
-    def summary(self, prob=0.9):
+    def summary(self, prob=0.9, batch_size=None):
         """
         Prints a summary table displaying diagnostics of samples obtained from
         posterior. The diagnostics displayed are mean, standard deviation, median,
         the 90% Credibility Interval, :func:`~pyro.ops.stats.effective_sample_size`,
-        :func:`~pyro.ops.stats.split_gelman_rubin`.
+        :func:`~pyro.ops.stats.split_gelman_rubin`. The mean and standard deviation
+        are the online estimates of :attr:`sample_store`, over all post-warmup draws.
 
         :param float prob: the probability mass of samples within the credibility interval.
+        :param int batch_size: if not `None`, the statistics of each site are
+            computed for ``batch_size`` elements at a time, to bound memory usage.
         """
-        summary(self._samples, prob=prob)
+        moments = {k: (mean, var.sqrt()) for k, (mean, var) in self.sample_store.moments().items()}
+        summary(self._samples, prob=prob, batch_size=batch_size, moments=moments)
@@ -7,13 +7,17 @@ import pyro
 import pyro.distributions as dist
 from pyro.distributions.util import eye_like, scalar_like
 
-from pyro.infer.mcmc.adaptation import WarmupAdapter
+from pyro.infer.mcmc.adaptation import WarmupAdapter, low_rank_matrix
 from pyro.infer.mcmc.mcmc_kernel import MCMCKernel
-from pyro.infer.mcmc.util import initialize_model
-from pyro.ops.integrator import velocity_verlet
+from pyro.infer.mcmc.util import _where, initialize_model
+from pyro.ops.integrator import potential_grad, velocity_verlet, velocity_verlet_packed
 from pyro.util import optional, torch_isnan
 
 
+def _mean(x):
+    return x.mean().item() if torch.is_tensor(x) else x
+
+
 class HMC(MCMCKernel):
     r"""
     Simple Hamiltonian Monte Carlo kernel, where ``step_size`` and ``num_steps``
@@ -41,7 +45,13 @@ class HMC(MCMCKernel):
         during warm-up phase using Dual Averaging scheme.
     :param bool adapt_mass_matrix: A flag to decide if we want to adapt mass
         matrix during warm-up phase using Welford scheme.
-    :param bool full_mass: A flag to decide if mass matrix is dense or diagonal.
+    :param full_mass: A flag to decide if mass matrix is dense or diagonal. This
+        can also be a string specifying a structured mass matrix, which scales to
+        models with many latent variables: ``"block"`` for a block diagonal mass
+        matrix with a dense block for each latent site, or ``"low_rank"`` for a
+        diagonal mass matrix plus a low rank correction, which is estimated from
+        the principal components of the samples in each adaptation window.
+    :type full_mass: bool or str
     :param dict transforms: Optional dictionary that specifies a transform
         for a sample site with constrained support to unconstrained space. The
         transform should be invertible, and implement `log_abs_det_jacobian`.
@@ -60,11 +70,23 @@ class HMC(MCMCKernel):
         tracer when ``jit_compile=True``. Default is False.
     :param float target_accept_prob: Increasing this value will lead to a smaller
         step size, hence the sampling will be slower and more robust. Default to 0.8.
+    :param str jit_cache_dir: Optional directory in which compiled potential
+        functions are persisted when ``jit_compile=True``, so that they can be
+        reused across runs and processes. See
+        :func:`~pyro.infer.mcmc.util.initialize_model` for details.
+    :param int mass_rank: The rank of the correction to the diagonal mass
+        matrix when ``full_mass="low_rank"``. Default to 10.
 
     .. note:: Internally, the mass matrix will be ordered according to the order
         of the names of latent variables, not the order of their appearance in
         the model.
 
+    .. note:: When used with ``MCMC(..., chain_method="vectorized")``, all chains
+        are run in a single process, with the chain dimension being the leading
+        dimension of each latent site. Each chain has its own step size and mass
+        matrix. If ``potential_fn`` is provided, it should take in parameters with
+        a leading chain dimension and return the potential energy of each chain.
+
     Example:
 
         >>> true_coefs = torch.tensor([1., 2., 3.])
@@ -99,7 +121,9 @@ class HMC(MCMCKernel):
                  jit_compile=False,
                  jit_options=None,
                  ignore_jit_warnings=False,
-                 target_accept_prob=0.8):
+                 target_accept_prob=0.8,
+                 jit_cache_dir=None,
+                 mass_rank=10):
         if not ((model is None) ^ (potential_fn is None)):
             raise ValueError("Only one of `model` or `potential_fn` must be specified.")
         # NB: deprecating args - model, transforms
@@ -109,6 +133,7 @@ class HMC(MCMCKernel):
         self._jit_compile = jit_compile
         self._jit_options = jit_options
         self._ignore_jit_warnings = ignore_jit_warnings
+        self._jit_cache_dir = jit_cache_dir
 
         self.potential_fn = potential_fn
         if trajectory_length is not None:
@@ -122,20 +147,57 @@ class HMC(MCMCKernel):
         # After https://github.com/stan-dev/stan/pull/356, it is set to a fixed log(0.8).
         self._direction_threshold = math.log(0.8)  # from Stan
         self._max_sliced_energy = 1000
+        # number of chains that are run as a batch; set by MCMC
+        self._num_chains = None
         self._reset()
         self._adapter = WarmupAdapter(step_size,
                                       adapt_step_size=adapt_step_size,
                                       adapt_mass_matrix=adapt_mass_matrix,
                                       target_accept_prob=target_accept_prob,
-                                      is_diag_mass=not full_mass)
+                                      is_diag_mass=not full_mass,
+                                      mass_structure=full_mass if isinstance(full_mass, str) else None,
+                                      mass_rank=mass_rank)
         super(HMC, self).__init__()
 
+    @property
+    def _chain_shape(self):
+        return () if self._num_chains is None else (self._num_chains,)
+
+    def _flatten(self, r):
+        return torch.cat([r[site_name].reshape(self._chain_shape + (-1,)) for site_name in sorted(r)], dim=-1)
+
+    def _get_site_layout(self):
+        # positions of sample sites in the flattened (packed) tensors
+        layout = []
+        pos = 0
+        for name, param in sorted(self.initial_params.items()):
+            shape = param.shape[len(self._chain_shape):]
+            next_pos = pos + shape.numel()
+            layout.append((name, pos, next_pos, shape))
+            pos = next_pos
+        return layout
+
+    def _unflatten(self, r_flat):
+        if self._site_layout is None:
+            self._site_layout = self._get_site_layout()
+        batch_shape = r_flat.shape[:-1]
+        return {name: r_flat[..., pos:next_pos].reshape(batch_shape + shape)
+                for name, pos, next_pos, shape in self._site_layout}
+
+    def _packed_potential_fn(self, z_flat):
+        return self.potential_fn(self._unflatten(z_flat))
+
+    def _flat_kinetic_energy(self, r_flat):
+        return 0.5 * (self._inverse_mass_matvec(r_flat) * r_flat).sum(-1)
+
+    def _inverse_mass_matvec(self, r_flat):
+        return self._adapter.inverse_mass_matvec(r_flat)
+
     def _kinetic_energy(self, r):
-        r_flat = torch.cat([r[site_name].reshape(-1) for site_name in sorted(r)])
-        if self.inverse_mass_matrix.dim() == 2:
-            return 0.5 * self.inverse_mass_matrix.matmul(r_flat).dot(r_flat)
-        else:
-            return 0.5 * self.inverse_mass_matrix.dot(r_flat ** 2)
+        return self._flat_kinetic_energy(self._flatten(r))
+
+    def _kinetic_grad(self, r):
+        return self._unflatten(self._inverse_mass_matvec(self._flatten(r)))
 
     def _energy(self, z, r):
         return self._kinetic_energy(r) + self.potential_fn(z)
@@ -147,12 +209,15 @@ class HMC(MCMCKernel):
         self._divergences = []
         self._prototype_trace = None
         self._initial_params = None
+        self._site_layout = None
         self._z_last = None
         self._potential_energy_last = None
         self._z_grads_last = None
         self._warmup_steps = None
 
     def _find_reasonable_step_size(self, z):
+        if self._num_chains is not None:
+            return self._find_reasonable_step_size_vectorized(z)
         step_size = self.step_size
 
         # We are going to find a step_size which make accept_prob (Metropolis correction)
@@ -162,7 +227,7 @@ class HMC(MCMCKernel):
         r, _ = self._sample_r(name="r_presample_0")
         energy_current = self._kinetic_energy(r) + potential_energy
         z_new, r_new, z_grads_new, potential_energy_new = velocity_verlet(
-            z, r, self.potential_fn, self.inverse_mass_matrix, step_size)
+            z, r, self.potential_fn, self.inverse_mass_matrix, step_size, kinetic_grad=self._kinetic_grad)
         energy_new = self._kinetic_energy(r_new) + potential_energy_new
         delta_energy = energy_new - energy_current
         # direction=1 means keep increasing step_size, otherwise decreasing step_size.
@@ -183,23 +248,41 @@ class HMC(MCMCKernel):
             r, _ = self._sample_r(name="r_presample_{}".format(t))
             energy_current = self._kinetic_energy(r) + potential_energy
             z_new, r_new, z_grads_new, potential_energy_new = velocity_verlet(
-                z, r, self.potential_fn, self.inverse_mass_matrix, step_size)
+                z, r, self.potential_fn, self.inverse_mass_matrix, step_size, kinetic_grad=self._kinetic_grad)
             energy_new = self._kinetic_energy(r_new) + potential_energy_new
             delta_energy = energy_new - energy_current
             direction_new = 1 if self._direction_threshold < -delta_energy else -1
         return step_size
 
+    def _find_reasonable_step_size_vectorized(self, z):
+        # Same scheme as above, where each chain keeps scaling its own step size
+        # until its accept_prob crosses the target.
+        potential_energy = self.potential_fn(z)
+
+        def get_direction(step_size, t):
+            r, _ = self._sample_r(name="r_presample_{}".format(t))
+            energy_current = self._kinetic_energy(r) + potential_energy
+            z_new, r_new, z_grads_new, potential_energy_new = velocity_verlet(
+                z, r, self.potential_fn, self.inverse_mass_matrix, step_size, kinetic_grad=self._kinetic_grad)
+            energy_new = self._kinetic_energy(r_new) + potential_energy_new
+            delta_energy = energy_new - energy_current
+            return torch.where(self._direction_threshold < -delta_energy,
+                               delta_energy.new_tensor(1.), delta_energy.new_tensor(-1.))
+
+        step_size = self.step_size
+        direction = get_direction(step_size, 0)
+        step_size_scale = 2 ** direction
+        searching = torch.ones_like(direction, dtype=torch.bool)
+        t = 0
+        while searching.any():
+            t += 1
+            step_size = torch.where(searching, step_size_scale * step_size, step_size)
+            searching = searching & (get_direction(step_size, t) == direction)
+        return step_size
+
     def _sample_r(self, name):
-        r_dist = self._adapter.r_dist
-        r_flat = pyro.sample(name, r_dist)
-        r = {}
-        pos = 0
-        for name, param in sorted(self.initial_params.items()):
-            next_pos = pos + param.numel()
-            r[name] = r_flat[pos:next_pos].reshape(param.shape)
-            pos = next_pos
-        assert pos == r_flat.size(0)
-        return r, r_flat
+        r_flat = self._adapter.sample_r(name)
+        return self._unflatten(r_flat), r_flat
 
     @property
     def inverse_mass_matrix(self):
@@ -220,6 +303,7 @@ class HMC(MCMCKernel):
     @initial_params.setter
     def initial_params(self, params):
         self._initial_params = params
+        self._site_layout = None
 
     def _initialize_model_properties(self, model_args, model_kwargs):
         init_params, potential_fn, transforms, trace = initialize_model(
@@ -231,6 +315,9 @@ class HMC(MCMCKernel):
             jit_compile=self._jit_compile,
             jit_options=self._jit_options,
             skip_jit_warnings=self._ignore_jit_warnings,
+            num_chains=1 if self._num_chains is None else self._num_chains,
+            vectorize_chains=self._num_chains is not None,
+            jit_cache_dir=self._jit_cache_dir,
         )
         self.potential_fn = potential_fn
         self.transforms = transforms
@@ -239,15 +326,33 @@ class HMC(MCMCKernel):
         self._prototype_trace = trace
 
     def _initialize_adapter(self):
-        mass_matrix_size = sum([p.numel() for p in self.initial_params.values()])
+        batch_dim = len(self._chain_shape)
+        mass_matrix_size = sum([p.shape[batch_dim:].numel() for p in self.initial_params.values()])
         site_value = list(self.initial_params.values())[0]
-        if self._adapter.is_diag_mass:
-            initial_mass_matrix = torch.ones(mass_matrix_size,
+        mass_structure = self._adapter.mass_structure
+        if mass_structure == "diag":
+            initial_mass_matrix = torch.ones(self._chain_shape + (mass_matrix_size,),
                                              dtype=site_value.dtype,
                                              device=site_value.device)
-        else:
+        elif mass_structure == "dense":
             initial_mass_matrix = eye_like(site_value, mass_matrix_size)
+            initial_mass_matrix = initial_mass_matrix.expand(self._chain_shape + initial_mass_matrix.shape)
+        elif mass_structure == "block":
+            # one dense block for each latent site, in the order of the flattened params
+            initial_mass_matrix = []
+            for name, param in sorted(self.initial_params.items()):
+                block_size = param.shape[batch_dim:].numel()
+                block = eye_like(site_value, block_size)
+                initial_mass_matrix.append(block.expand(self._chain_shape + block.shape))
+        else:
+            scale = site_value.new_ones(self._chain_shape + (mass_matrix_size,))
+            initial_mass_matrix = low_rank_matrix(scale, site_value.new_zeros(scale.shape + (0,)),
+                                                  site_value.new_zeros(self._chain_shape + (0,)))
+        initial_step_size = None
+        if self._num_chains is not None:
+            initial_step_size = site_value.new_ones(self._chain_shape) * self.step_size
         self._adapter.configure(self._warmup_steps,
+                                initial_step_size=initial_step_size,
                                 inv_mass_matrix=initial_mass_matrix,
                                 find_reasonable_step_size_fn=self._find_reasonable_step_size)
 
@@ -256,6 +361,10 @@ class HMC(MCMCKernel):
 
     def setup(self, warmup_steps, *args, **kwargs):
         self._warmup_steps = warmup_steps
+        if self._num_chains is not None:
+            self._accept_cnt = torch.zeros(self._num_chains, dtype=torch.long)
+            self._mean_accept_prob = torch.zeros(self._num_chains)
+            self._divergences = [[] for _ in range(self._num_chains)]
         if self.model is not None:
             self._initialize_model_properties(args, kwargs)
         potential_energy = self.potential_fn(self.initial_params)
@@ -280,6 +389,8 @@ class HMC(MCMCKernel):
         return self._z_last, self._potential_energy_last, self._z_grads_last
 
     def sample(self, params):
+        if self._num_chains is not None:
+            return self._sample_vectorized(params)
         z, potential_energy, z_grads = self._fetch_from_cache()
         # recompute PE when cache is cleared
         if z is None:
@@ -293,19 +404,24 @@ class HMC(MCMCKernel):
             if self._t > self._warmup_steps:
                 self._accept_cnt += 1
             return params
-        r, _ = self._sample_r(name="r_t={}".format(self._t))
-        energy_current = self._kinetic_energy(r) + potential_energy
+        _, r_flat = self._sample_r(name="r_t={}".format(self._t))
+        energy_current = self._flat_kinetic_energy(r_flat) + potential_energy
 
         # Temporarily disable distributions args checking as
         # NaNs are expected during step size adaptation
         with optional(pyro.validation_enabled(False), self._t < self._warmup_steps):
-            z_new, r_new, z_grads_new, potential_energy_new = velocity_verlet(z, r, self.potential_fn,
-                                                                              self.inverse_mass_matrix,
-                                                                              self.step_size,
-                                                                              self.num_steps,
-                                                                              z_grads=z_grads)
+            # integrate in place on packed copies of z, r and z_grads
+            z_new, r_new, z_grads_new, potential_energy_new = velocity_verlet_packed(
+                self._flatten(z),
+                r_flat,
+                self._packed_potential_fn,
+                self.inverse_mass_matrix,
+                self.step_size,
+                self.num_steps,
+                z_grads=None if z_grads is None else self._flatten(z_grads),
+                kinetic_grad=self._inverse_mass_matvec)
             # apply Metropolis correction.
-            energy_proposal = self._kinetic_energy(r_new) + potential_energy_new
+            energy_proposal = self._flat_kinetic_energy(r_new) + potential_energy_new
         delta_energy = energy_proposal - energy_current
         # handle the NaN case which may be the case for a diverging trajectory
         # when using a large step size.
@@ -319,8 +435,8 @@ class HMC(MCMCKernel):
         accepted = False
         if rand < accept_prob:
             accepted = True
-            z = z_new
-            self._cache(z, potential_energy_new, z_grads_new)
+            z = self._unflatten(z_new)
+            self._cache(z, potential_energy_new, self._unflatten(z_grads_new))
 
         self._t += 1
         if self._t > self._warmup_steps:
@@ -334,12 +450,87 @@ class HMC(MCMCKernel):
         self._mean_accept_prob += (accept_prob.item() - self._mean_accept_prob) / n
         return z.copy()
 
+    def _prepare_vectorized_sample(self, params):
+        """
+        Fetches the current state of all chains, and returns `None` if there
+        are no sample sites.
+        """
+        z, potential_energy, z_grads = self._fetch_from_cache()
+        if z is None:
+            z = params
+        elif len(z) == 0:
+            self._t += 1
+            self._mean_accept_prob = 1.
+            if self._t > self._warmup_steps:
+                self._accept_cnt += 1
+            return None
+        if z_grads is None:
+            z_grads, potential_energy = potential_grad(self.potential_fn, z)
+            self._cache(z, potential_energy, z_grads)
+        return z, potential_energy, z_grads
+
+    def _record_vectorized_sample(self, z, accepted, accept_prob):
+        self._t += 1
+        if self._t > self._warmup_steps:
+            n = self._t - self._warmup_steps
+            self._accept_cnt += accepted.long()
+        else:
+            n = self._t
+            self._adapter.step(self._t, z, accept_prob)
+        self._mean_accept_prob = self._mean_accept_prob + (accept_prob - self._mean_accept_prob) / n
+
+    def _sample_vectorized(self, params):
+        state = self._prepare_vectorized_sample(params)
+        if state is None:
+            return params
+        z, potential_energy, z_grads = state
+        r, _ = self._sample_r(name="r_t={}".format(self._t))
+        energy_current = self._kinetic_energy(r) + potential_energy
+
+        # Each chain takes its own number of steps; chains whose trajectory is
+        # complete keep their state while the remaining chains are integrated.
+        num_steps = (self.trajectory_length / self.step_size).long().clamp(min=1)
+        z_new, r_new, z_grads_new, potential_energy_new = z, r, z_grads, potential_energy
+        with optional(pyro.validation_enabled(False), self._t < self._warmup_steps):
+            for i in range(int(num_steps.max())):
+                z_next, r_next, z_grads_next, potential_energy_next = velocity_verlet(
+                    z_new, r_new, self.potential_fn, self.inverse_mass_matrix, self.step_size,
+                    z_grads=z_grads_new, kinetic_grad=self._kinetic_grad)
+                moving = i < num_steps
+                z_new = _where(moving, z_next, z_new)
+                r_new = _where(moving, r_next, r_new)
+                z_grads_new = _where(moving, z_grads_next, z_grads_new)
+                potential_energy_new = torch.where(moving, potential_energy_next, potential_energy_new)
+            energy_proposal = self._kinetic_energy(r_new) + potential_energy_new
+        delta_energy = energy_proposal - energy_current
+        delta_energy = torch.where(torch.isnan(delta_energy), delta_energy.new_tensor(float("inf")), delta_energy)
+        if self._t >= self._warmup_steps:
+            for chain_id in (delta_energy > self._max_sliced_energy).nonzero().reshape(-1).tolist():
+                self._divergences[chain_id].append(self._t - self._warmup_steps)
+
+        accept_prob = (-delta_energy).exp().clamp(max=1.)
+        rand = pyro.sample("rand_t={}".format(self._t), dist.Uniform(torch.zeros_like(accept_prob),
+                                                                     torch.ones_like(accept_prob)))
+        accepted = rand < accept_prob
+        z = _where(accepted, z_new, z)
+        self._cache(z,
+                    torch.where(accepted, potential_energy_new, potential_energy),
+                    _where(accepted, z_grads_new, z_grads))
+        self._record_vectorized_sample(z, accepted, accept_prob)
+        return z.copy()
+
     def logging(self):
         return OrderedDict([
-            ("step size", "{:.2e}".format(self.step_size)),
-            ("acc. prob", "{:.3f}".format(self._mean_accept_prob))
+            ("step size", "{:.2e}".format(_mean(self.step_size))),
+            ("acc. prob", "{:.3f}".format(_mean(self._mean_accept_prob)))
         ])
 
     def diagnostics(self):
+        num_samples = self._t - self._warmup_steps
+        if self._num_chains is not None:
+            # one dict of diagnostics per chain
+            return [{"divergences": self._divergences[i],
+                     "acceptance rate": self._accept_cnt[i].item() / num_samples}
+                    for i in range(self._num_chains)]
         return {"divergences": self._divergences,
-                "acceptance rate": self._accept_cnt / (self._t - self._warmup_steps)}
+                "acceptance rate": self._accept_cnt / num_samples}
@@ -6,7 +6,8 @@ import pyro
 import pyro.distributions as dist
 from pyro.distributions.util import scalar_like
 from pyro.infer.mcmc.hmc import HMC
-from pyro.ops.integrator import velocity_verlet
+from pyro.infer.mcmc.util import _where
+from pyro.ops.integrator import potential_grad, velocity_verlet, velocity_verlet_packed
 from pyro.util import optional, torch_isnan
 
 
@@ -15,6 +16,10 @@ def _logaddexp(x, y):
     return (minval - maxval).exp().log1p() + maxval
 
 
+def _batched_logaddexp(x, y):
+    return torch.stack([x, y]).logsumexp(0)
+
+
 # sum_accept_probs and num_proposals are used to calculate
 # the statistic accept_prob for Dual Averaging scheme;
 # z_left_grads and z_right_grads are kept to avoid recalculating
@@ -65,7 +70,13 @@ class NUTS(HMC):
         during warm-up phase using Dual Averaging scheme.
     :param bool adapt_mass_matrix: A flag to decide if we want to adapt mass
         matrix during warm-up phase using Welford scheme.
-    :param bool full_mass: A flag to decide if mass matrix is dense or diagonal.
+    :param full_mass: A flag to decide if mass matrix is dense or diagonal. This
+        can also be a string specifying a structured mass matrix, which scales to
+        models with many latent variables: ``"block"`` for a block diagonal mass
+        matrix with a dense block for each latent site, or ``"low_rank"`` for a
+        diagonal mass matrix plus a low rank correction, which is estimated from
+        the principal components of the samples in each adaptation window.
+    :type full_mass: bool or str
     :param bool use_multinomial_sampling: A flag to decide if we want to sample
         candidates along its trajectory using "multinomial sampling" or using
         "slice sampling". Slice sampling is used in the original NUTS paper [1],
@@ -92,6 +103,12 @@ class NUTS(HMC):
         so the sampling will be slower but more robust. Default to 0.8.
     :param int max_tree_depth: Max depth of the binary tree created during the doubling
         scheme of NUTS sampler. Default to 10.
+    :param str jit_cache_dir: Optional directory in which compiled potential
+        functions are persisted when ``jit_compile=True``, so that they can be
+        reused across runs and processes. See
+        :func:`~pyro.infer.mcmc.util.initialize_model` for details.
+    :param int mass_rank: The rank of the correction to the diagonal mass
+        matrix when ``full_mass="low_rank"``. Default to 10.
 
     Example:
 
@@ -127,7 +144,9 @@ class NUTS(HMC):
                  jit_options=None,
                  ignore_jit_warnings=False,
                  target_accept_prob=0.8,
-                 max_tree_depth=10):
+                 max_tree_depth=10,
+                 jit_cache_dir=None,
+                 mass_rank=10):
         super(NUTS, self).__init__(model,
                                    potential_fn,
                                    step_size,
@@ -139,7 +158,9 @@ class NUTS(HMC):
                                    jit_compile=jit_compile,
                                    jit_options=jit_options,
                                    ignore_jit_warnings=ignore_jit_warnings,
-                                   target_accept_prob=target_accept_prob)
+                                   target_accept_prob=target_accept_prob,
+                                   jit_cache_dir=jit_cache_dir,
+                                   mass_rank=mass_rank)
         self.use_multinomial_sampling = use_multinomial_sampling
         self._max_tree_depth = max_tree_depth
         # There are three conditions to stop doubling process:
@@ -156,127 +177,273 @@ class NUTS(HMC):
 
     def _is_turning(self, r_left, r_right, r_sum):
         # We follow the strategy in Section A.4.2 of [2] for this implementation.
-        r_left_flat = torch.cat([r_left[site_name].reshape(-1) for site_name in sorted(r_left)])
-        r_right_flat = torch.cat([r_right[site_name].reshape(-1) for site_name in sorted(r_right)])
-        r_sum = r_sum - (r_left_flat + r_right_flat) / 2
-        if self.inverse_mass_matrix.dim() == 2:
-            if (self.inverse_mass_matrix.matmul(r_left_flat).dot(r_sum) > 0 and
-                    self.inverse_mass_matrix.matmul(r_right_flat).dot(r_sum) > 0):
-                return False
-        else:
-            if (self.inverse_mass_matrix.mul(r_left_flat).dot(r_sum) > 0 and
-                    self.inverse_mass_matrix.mul(r_right_flat).dot(r_sum) > 0):
-                return False
-        return True
-
-    def _build_basetree(self, z, r, z_grads, log_slice, direction, energy_current):
+        r_sum = r_sum - (r_left + r_right) / 2
+        not_turning = (((self._inverse_mass_matvec(r_left) * r_sum).sum(-1) > 0) &
+                       ((self._inverse_mass_matvec(r_right) * r_sum).sum(-1) > 0))
+        if self._num_chains is not None:
+            return ~not_turning
+        return not bool(not_turning)
+
+    def _build_tree(self, z, r, z_grads, log_slice, direction, tree_depth, energy_current,
+                    r_ckpts, r_sum_ckpts):
+        """
+        Builds a subtree with `2 ** tree_depth` leaves by taking leapfrog steps from
+        the flattened state `(z, r, z_grads)` in the given `direction`. The state
+        is updated in place, and ends up at the last leaf of the subtree.
+
+        Rather than recursing over the two halves of the subtree, the proposal is
+        sampled progressively among the leaves, and the U-turn condition of each
+        balanced sub-subtree is checked once its last leaf is built. To do so, the
+        momentum `r` and the running sum `r_sum` at the first leaf of each pending
+        sub-subtree are stored in the buffers `r_ckpts` and `r_sum_ckpts`, which
+        have at least `tree_depth` rows.
+        """
         step_size = self.step_size if direction == 1 else -self.step_size
-        z_new, r_new, z_grads, potential_energy = velocity_verlet(
-            z, r, self.potential_fn, self.inverse_mass_matrix, step_size, z_grads=z_grads)
-        r_new_flat = torch.cat([r_new[site_name].reshape(-1) for site_name in sorted(r_new)])
+        num_leaves = 2 ** tree_depth
+        # uniform random numbers used to accept a leaf as the proposal of the subtree
+        rands = pyro.sample("leaf_rand_t={}_treedepth={}".format(self._t, tree_depth),
+                            dist.Uniform(r.new_zeros(num_leaves), r.new_ones(num_leaves)))
+        z_proposal = z_proposal_pe = z_proposal_grads = tree_weight = None
+        r_sum = torch.zeros_like(r)
+        sum_accept_probs = 0.
+        turning = diverging = False
+        for leaf_idx in range(num_leaves):
+            _, _, _, potential_energy = velocity_verlet_packed(
+                z, r, self._packed_potential_fn, self.inverse_mass_matrix, step_size, z_grads=z_grads,
+                kinetic_grad=self._inverse_mass_matvec)
+            energy_new = potential_energy + self._flat_kinetic_energy(r)
+            # handle the NaN case
+            energy_new = scalar_like(energy_new, float("inf")) if torch_isnan(energy_new) else energy_new
+            sliced_energy = energy_new + log_slice
+            delta_energy = energy_new - energy_current
+            sum_accept_probs = sum_accept_probs + (-delta_energy).exp().clamp(max=1.0)
+            if sliced_energy > self._max_sliced_energy:
+                diverging = True
+                break
+
+            if self.use_multinomial_sampling:
+                leaf_weight = -sliced_energy
+            else:
+                # As a part of the slice sampling process (see below), along the trajectory
+                #   we eliminate states which p(z, r) < u, or dE > 0.
+                # Due to this elimination (and stop doubling conditions),
+                #   the weight of binary tree might not equal to 2^tree_depth.
+                leaf_weight = scalar_like(sliced_energy, 1. if sliced_energy <= 0 else 0.)
+
+            # The probability that the proposal is the new leaf is computed based on
+            #     the weight of the leaf relative to the leaves built so far.
+            if tree_weight is None:
+                tree_weight = leaf_weight
+                leaf_prob = 1.
+            elif self.use_multinomial_sampling:
+                tree_weight = _logaddexp(tree_weight, leaf_weight)
+                leaf_prob = (leaf_weight - tree_weight).exp()
+            else:
+                tree_weight = tree_weight + leaf_weight
+                # For the special case that all weights are 0, we keep the first leaf
+                #   (any is fine, because the probability of picking it at the end is 0!).
+                leaf_prob = leaf_weight / tree_weight if tree_weight > 0 else 0.
+            if rands[leaf_idx] < leaf_prob:
+                z_proposal, z_proposal_pe, z_proposal_grads = z.clone(), potential_energy, z_grads.clone()
+
+            r_sum.add_(r)
+            # The first leaf of a sub-subtree has an even index, and its last leaf has an
+            #     odd index. The checkpoint index of a leaf is the number of its nonzero bits,
+            #     except the last bit; the number of trailing nonzero bits of an odd index is
+            #     the number of sub-subtrees which end at that leaf.
+            ckpt_idx_max = bin(leaf_idx >> 1).count("1")
+            if leaf_idx % 2 == 0:
+                r_ckpts[ckpt_idx_max] = r
+                r_sum_ckpts[ckpt_idx_max] = r_sum
+            else:
+                num_subtrees = len(bin(leaf_idx)) - len(bin(leaf_idx).rstrip("1"))
+                for ckpt_idx in range(ckpt_idx_max, ckpt_idx_max - num_subtrees, -1):
+                    subtree_r_sum = r_sum - r_sum_ckpts[ckpt_idx] + r_ckpts[ckpt_idx]
+                    if self._is_turning(r_ckpts[ckpt_idx], r, subtree_r_sum):
+                        turning = True
+                        break
+                if turning:
+                    break
+
+        return _TreeInfo(z, r, z_grads, z, r, z_grads, z_proposal, z_proposal_pe, z_proposal_grads,
+                         r_sum, tree_weight, turning, diverging, sum_accept_probs, leaf_idx + 1)
+
+    def _build_basetree_vectorized(self, z, r, z_grads, log_slice, direction, energy_current, active):
+        # Chains which are not `active` take a step of size zero, and contribute
+        # nothing to the tree.
+        step_size = direction * self.step_size * active.type_as(direction)
+        z_new, r_new, z_grads_new, potential_energy = velocity_verlet(
+            z, r, self.potential_fn, self.inverse_mass_matrix, step_size, z_grads=z_grads,
+            kinetic_grad=self._kinetic_grad)
+        z_new = _where(active, z_new, z)
+        r_new = _where(active, r_new, r)
+        z_grads_new = _where(active, z_grads_new, z_grads)
+        r_new_flat = self._flatten(r_new) * active.unsqueeze(-1).type_as(direction)
         energy_new = potential_energy + self._kinetic_energy(r_new)
         # handle the NaN case
-        energy_new = scalar_like(energy_new, float("inf")) if torch_isnan(energy_new) else energy_new
+        energy_new = torch.where(torch.isnan(energy_new), energy_new.new_tensor(float("inf")), energy_new)
         sliced_energy = energy_new + log_slice
-        diverging = (sliced_energy > self._max_sliced_energy)
+        diverging = (sliced_energy > self._max_sliced_energy) & active
         delta_energy = energy_new - energy_current
-        accept_prob = (-delta_energy).exp().clamp(max=1.0)
+        accept_prob = torch.where(active, (-delta_energy).exp().clamp(max=1.0), delta_energy.new_tensor(0.))
 
         if self.use_multinomial_sampling:
-            tree_weight = -sliced_energy
+            tree_weight = torch.where(active, -sliced_energy, sliced_energy.new_tensor(-float("inf")))
         else:
-            # As a part of the slice sampling process (see below), along the trajectory
-            #   we eliminate states which p(z, r) < u, or dE > 0.
-            # Due to this elimination (and stop doubling conditions),
-            #   the weight of binary tree might not equal to 2^tree_depth.
-            tree_weight = scalar_like(sliced_energy, 1. if sliced_energy <= 0 else 0.)
+            tree_weight = ((sliced_energy <= 0) & active).type_as(sliced_energy)
 
-        return _TreeInfo(z_new, r_new, z_grads, z_new, r_new, z_grads, z_new, potential_energy,
-                         z_grads, r_new_flat, tree_weight, False, diverging, accept_prob, 1)
+        return _TreeInfo(z_new, r_new, z_grads_new, z_new, r_new, z_grads_new, z_new, potential_energy,
+                         z_grads_new, r_new_flat, tree_weight, torch.zeros_like(active), diverging,
+                         accept_prob, active.type_as(accept_prob))
 
-    def _build_tree(self, z, r, z_grads, log_slice, direction, tree_depth, energy_current):
+    def _build_tree_vectorized(self, z, r, z_grads, log_slice, direction, tree_depth, energy_current, active):
+        # Same as `_build_tree`, but for a batch of chains which double their
+        # trajectories in lockstep. Chains which stop doubling early are masked
+        # out by `active`.
         if tree_depth == 0:
-            return self._build_basetree(z, r, z_grads, log_slice, direction, energy_current)
-
-        # build the first half of tree
-        half_tree = self._build_tree(z, r, z_grads, log_slice,
-                                     direction, tree_depth-1, energy_current)
-        z_proposal = half_tree.z_proposal
-        z_proposal_pe = half_tree.z_proposal_pe
-        z_proposal_grads = half_tree.z_proposal_grads
-
-        # Check conditions to stop doubling. If we meet that condition,
-        #     there is no need to build the other tree.
-        if half_tree.turning or half_tree.diverging:
+            return self._build_basetree_vectorized(z, r, z_grads, log_slice, direction, energy_current, active)
+
+        half_tree = self._build_tree_vectorized(z, r, z_grads, log_slice, direction, tree_depth - 1,
+                                                energy_current, active)
+        other_active = active & ~half_tree.turning & ~half_tree.diverging
+        if not other_active.any():
             return half_tree
 
-        # Else, build remaining half of tree.
-        # If we are going to the right, start from the right leaf of the first half.
-        if direction == 1:
-            z = half_tree.z_right
-            r = half_tree.r_right
-            z_grads = half_tree.z_right_grads
-        else:  # otherwise, start from the left leaf of the first half
-            z = half_tree.z_left
-            r = half_tree.r_left
-            z_grads = half_tree.z_left_grads
-        other_half_tree = self._build_tree(z, r, z_grads, log_slice,
-                                           direction, tree_depth-1, energy_current)
+        go_right = direction > 0
+        z = _where(go_right, half_tree.z_right, half_tree.z_left)
+        r = _where(go_right, half_tree.r_right, half_tree.r_left)
+        z_grads = _where(go_right, half_tree.z_right_grads, half_tree.z_left_grads)
+        other_half_tree = self._build_tree_vectorized(z, r, z_grads, log_slice, direction, tree_depth - 1,
+                                                      energy_current, other_active)
 
         if self.use_multinomial_sampling:
-            tree_weight = _logaddexp(half_tree.weight, other_half_tree.weight)
+            tree_weight = _batched_logaddexp(half_tree.weight, other_half_tree.weight)
+            other_half_tree_prob = (other_half_tree.weight - tree_weight).exp()
         else:
             tree_weight = half_tree.weight + other_half_tree.weight
+            other_half_tree_prob = other_half_tree.weight / tree_weight
         sum_accept_probs = half_tree.sum_accept_probs + other_half_tree.sum_accept_probs
         num_proposals = half_tree.num_proposals + other_half_tree.num_proposals
         r_sum = half_tree.r_sum + other_half_tree.r_sum
 
-        # The probability of that proposal belongs to which half of tree
-        #     is computed based on the weights of each half.
-        if self.use_multinomial_sampling:
-            other_half_tree_prob = (other_half_tree.weight - tree_weight).exp()
-        else:
-            # For the special case that the weights of each half are both 0,
-            #   we choose the proposal from the first half
-            #   (any is fine, because the probability of picking it at the end is 0!).
-            other_half_tree_prob = (other_half_tree.weight / tree_weight if tree_weight > 0
-                                    else scalar_like(tree_weight, 0.))
+        # Weights of both halves can be zero, in which case we choose the proposal
+        # from the first half.
+        other_half_tree_prob = other_half_tree_prob.masked_fill(
+            ~other_active | torch.isnan(other_half_tree_prob), 0.)
         is_other_half_tree = pyro.sample("is_other_half_tree",
-                                         dist.Bernoulli(probs=other_half_tree_prob))
-
-        if is_other_half_tree == 1:
-            z_proposal = other_half_tree.z_proposal
-            z_proposal_pe = other_half_tree.z_proposal_pe
-            z_proposal_grads = other_half_tree.z_proposal_grads
-
-        # leaves of the full tree are determined by the direction
-        if direction == 1:
-            z_left = half_tree.z_left
-            r_left = half_tree.r_left
-            z_left_grads = half_tree.z_left_grads
-            z_right = other_half_tree.z_right
-            r_right = other_half_tree.r_right
-            z_right_grads = other_half_tree.z_right_grads
-        else:
-            z_left = other_half_tree.z_left
-            r_left = other_half_tree.r_left
-            z_left_grads = other_half_tree.z_left_grads
-            z_right = half_tree.z_right
-            r_right = half_tree.r_right
-            z_right_grads = half_tree.z_right_grads
-
-        # We already check if first half tree is turning. Now, we check
-        #     if the other half tree or full tree are turning.
-        turning = other_half_tree.turning or self._is_turning(r_left, r_right, r_sum)
-
-        # The divergence is checked by the second half tree (the first half is already checked).
-        diverging = other_half_tree.diverging
+                                         dist.Bernoulli(probs=other_half_tree_prob)).bool()
+        z_proposal = _where(is_other_half_tree, other_half_tree.z_proposal, half_tree.z_proposal)
+        z_proposal_pe = torch.where(is_other_half_tree, other_half_tree.z_proposal_pe, half_tree.z_proposal_pe)
+        z_proposal_grads = _where(is_other_half_tree, other_half_tree.z_proposal_grads,
+                                  half_tree.z_proposal_grads)
+
+        # Leaves of the full tree are determined by the direction. Inactive chains
+        # of the other half tree stay at the leaf of the first half.
+        z_left = _where(go_right, half_tree.z_left, other_half_tree.z_left)
+        r_left = _where(go_right, half_tree.r_left, other_half_tree.r_left)
+        z_left_grads = _where(go_right, half_tree.z_left_grads, other_half_tree.z_left_grads)
+        z_right = _where(go_right, other_half_tree.z_right, half_tree.z_right)
+        r_right = _where(go_right, other_half_tree.r_right, half_tree.r_right)
+        z_right_grads = _where(go_right, other_half_tree.z_right_grads, half_tree.z_right_grads)
+
+        turning = torch.where(other_active,
+                              other_half_tree.turning | self._is_turning(self._flatten(r_left),
+                                                                         self._flatten(r_right), r_sum),
+                              half_tree.turning)
+        diverging = torch.where(other_active, other_half_tree.diverging, half_tree.diverging)
 
         return _TreeInfo(z_left, r_left, z_left_grads, z_right, r_right, z_right_grads, z_proposal,
                          z_proposal_pe, z_proposal_grads, r_sum, tree_weight, turning, diverging,
                          sum_accept_probs, num_proposals)
 
+    def _sample_vectorized(self, params):
+        state = self._prepare_vectorized_sample(params)
+        if state is None:
+            return params
+        z, potential_energy, z_grads = state
+        r, r_flat = self._sample_r(name="r_t={}".format(self._t))
+        energy_current = self._kinetic_energy(r) + potential_energy
+
+        if self.use_multinomial_sampling:
+            log_slice = -energy_current
+        else:
+            slice_exp_term = pyro.sample("slicevar_exp_t={}".format(self._t),
+                                         dist.Exponential(torch.ones_like(energy_current)))
+            log_slice = -energy_current - slice_exp_term
+
+        z_left = z_right = z
+        r_left = r_right = r
+        z_left_grads = z_right_grads = z_grads
+        accepted = torch.zeros_like(energy_current, dtype=torch.bool)
+        r_sum = r_flat
+        sum_accept_probs = torch.zeros_like(energy_current)
+        num_proposals = torch.zeros_like(energy_current)
+        tree_weight = torch.full_like(energy_current, 0. if self.use_multinomial_sampling else 1.)
+        # chains which are still doubling their trajectories
+        active = torch.ones_like(energy_current, dtype=torch.bool)
+
+        with optional(pyro.validation_enabled(False), self._t < self._warmup_steps):
+            tree_depth = 0
+            while tree_depth < self._max_tree_depth and active.any():
+                direction = pyro.sample("direction_t={}_treedepth={}".format(self._t, tree_depth),
+                                        dist.Bernoulli(probs=torch.full_like(energy_current, 0.5)))
+                go_right = direction.bool()
+                direction = 2 * direction - 1
+                new_tree = self._build_tree_vectorized(_where(go_right, z_right, z_left),
+                                                       _where(go_right, r_right, r_left),
+                                                       _where(go_right, z_right_grads, z_left_grads),
+                                                       log_slice, direction, tree_depth, energy_current, active)
+                # update leaves for the next doubling process
+                extend_right = active & go_right
+                extend_left = active & ~go_right
+                z_right = _where(extend_right, new_tree.z_right, z_right)
+                r_right = _where(extend_right, new_tree.r_right, r_right)
+                z_right_grads = _where(extend_right, new_tree.z_right_grads, z_right_grads)
+                z_left = _where(extend_left, new_tree.z_left, z_left)
+                r_left = _where(extend_left, new_tree.r_left, r_left)
+                z_left_grads = _where(extend_left, new_tree.z_left_grads, z_left_grads)
+
+                sum_accept_probs = sum_accept_probs + new_tree.sum_accept_probs
+                num_proposals = num_proposals + new_tree.num_proposals
+
+                # stop doubling
+                if self._t >= self._warmup_steps:
+                    for chain_id in new_tree.diverging.nonzero().reshape(-1).tolist():
+                        self._divergences[chain_id].append(self._t - self._warmup_steps)
+                active = active & ~new_tree.diverging & ~new_tree.turning
+
+                tree_depth += 1
+
+                if self.use_multinomial_sampling:
+                    new_tree_prob = (new_tree.weight - tree_weight).exp()
+                else:
+                    new_tree_prob = new_tree.weight / tree_weight
+                rand = pyro.sample("rand_t={}_treedepth={}".format(self._t, tree_depth),
+                                   dist.Uniform(torch.zeros_like(new_tree_prob),
+                                                torch.ones_like(new_tree_prob)))
+                accept = active & (rand < new_tree_prob)
+                z = _where(accept, new_tree.z_proposal, z)
+                potential_energy = torch.where(accept, new_tree.z_proposal_pe, potential_energy)
+                z_grads = _where(accept, new_tree.z_proposal_grads, z_grads)
+                accepted = accepted | accept
+
+                r_sum = torch.where(active.unsqueeze(-1), r_sum + new_tree.r_sum, r_sum)
+                active = active & ~self._is_turning(self._flatten(r_left), self._flatten(r_right), r_sum)
+                # update tree_weight
+                if self.use_multinomial_sampling:
+                    tree_weight = torch.where(active, _batched_logaddexp(tree_weight, new_tree.weight),
+                                              tree_weight)
+                else:
+                    tree_weight = torch.where(active, tree_weight + new_tree.weight, tree_weight)
+
+        self._cache(z, potential_energy, z_grads)
+        accept_prob = sum_accept_probs / num_proposals
+        self._record_vectorized_sample(z, accepted, accept_prob)
+        return z.copy()
+
     def sample(self, params):
+        if self._num_chains is not None:
+            return self._sample_vectorized(params)
         z, potential_energy, z_grads = self._fetch_from_cache()
         # recompute PE when cache is cleared
         if z is None:
@@ -318,14 +485,21 @@ class NUTS(HMC):
                                          dist.Exponential(scalar_like(energy_current, 1.)))
             log_slice = -energy_current - slice_exp_term
 
-        z_left = z_right = z
-        r_left = r_right = r
-        z_left_grads = z_right_grads = z_grads
+        if z_grads is None:
+            z_grads, potential_energy = potential_grad(self.potential_fn, z)
+            self._cache(z, potential_energy, z_grads)
+        # leaves of the trajectory, which are updated in place when the tree is extended
+        z_left, z_right = self._flatten(z), self._flatten(z)
+        r_left, r_right = r_flat.clone(), r_flat.clone()
+        z_left_grads, z_right_grads = self._flatten(z_grads), self._flatten(z_grads)
         accepted = False
         r_sum = r_flat
         sum_accept_probs = 0.
         num_proposals = 0
         tree_weight = scalar_like(energy_current, 0. if self.use_multinomial_sampling else 1.)
+        # buffers for the checkpoints of the U-turn checks within each subtree
+        r_ckpts = r_flat.new_empty(self._max_tree_depth, r_flat.size(0))
+        r_sum_ckpts = r_flat.new_empty(self._max_tree_depth, r_flat.size(0))
 
         # Temporarily disable distributions args checking as
         # NaNs are expected during step size adaptation.
@@ -338,14 +512,14 @@ class NUTS(HMC):
                 direction = int(direction.item())
                 if direction == 1:  # go to the right, start from the right leaf of current tree
                     new_tree = self._build_tree(z_right, r_right, z_right_grads, log_slice,
-                                                direction, tree_depth, energy_current)
+                                                direction, tree_depth, energy_current, r_ckpts, r_sum_ckpts)
                     # update leaf for the next doubling process
                     z_right = new_tree.z_right
                     r_right = new_tree.r_right
                     z_right_grads = new_tree.z_right_grads
                 else:  # go the the left, start from the left leaf of current tree
                     new_tree = self._build_tree(z_left, r_left, z_left_grads, log_slice,
-                                                direction, tree_depth, energy_current)
+                                                direction, tree_depth, energy_current, r_ckpts, r_sum_ckpts)
                     z_left = new_tree.z_left
                     r_left = new_tree.r_left
                     z_left_grads = new_tree.z_left_grads
@@ -373,8 +547,8 @@ class NUTS(HMC):
                                                 scalar_like(new_tree_prob, 1.)))
                 if rand < new_tree_prob:
                     accepted = True
-                    z = new_tree.z_proposal
-                    self._cache(z, new_tree.z_proposal_pe, new_tree.z_proposal_grads)
+                    z = self._unflatten(new_tree.z_proposal)
+                    self._cache(z, new_tree.z_proposal_pe, self._unflatten(new_tree.z_proposal_grads))
 
                 r_sum = r_sum + new_tree.r_sum
                 if self._is_turning(r_left, r_right, r_sum):  # stop doubling
@@ -0,0 +1,171 @@
+import os
+from urllib.parse import quote
+
+import numpy as np
+import torch
+
+from pyro.ops.welford import WelfordCovariance
+
+
+class SampleStore(object):
+    """
+    Storage for the draws generated by :class:`~pyro.infer.mcmc.api.MCMC`. Draws
+    are written to preallocated per-site buffers as they arrive, either in memory
+    or, when ``path`` is specified, to ``.npy`` files on disk which are then
+    memory-mapped by :meth:`get_samples`. Independently of thinning and retention,
+    the mean and variance of each site are tracked online for each chain using
+    :class:`~pyro.ops.welford.WelfordCovariance`, over all post-warmup draws.
+
+    Example::
+
+        store = SampleStore(path="/tmp/mcmc_run", thinning=10, retention=1000)
+        mcmc = MCMC(NUTS(model), num_samples=100000, sample_store=store)
+        mcmc.run(data)
+        samples = mcmc.get_samples()  # memory-mapped, at most 1000 draws per chain
+        mean, var = store.moments()["z"]  # computed over all 100000 draws
+
+    :param str path: directory for the on-disk store. One ``<site>.npy`` file of
+        shape ``num_chains x num_retained x site_shape`` is written per sample
+        site, and read back as CPU tensors. If `None` (default), draws are kept
+        in memory.
+    :param int thinning: only every ``thinning``-th draw of each chain is retained.
+    :param int retention: if not `None`, only the ``retention`` most recent retained
+        draws of each chain are kept (in a circular buffer). By default, all retained
+        draws are kept.
+    :param int chunk_size: number of draws buffered for each chain before being
+        written to the on-disk store.
+    """
+    def __init__(self, path=None, thinning=1, retention=None, chunk_size=100):
+        if thinning < 1:
+            raise ValueError("thinning must be a positive integer, but got {}.".format(thinning))
+        if retention is not None and retention < 1:
+            raise ValueError("retention must be a positive integer, but got {}.".format(retention))
+        self.path = path
+        self.thinning = thinning
+        self.retention = retention
+        self.chunk_size = max(chunk_size, 1)
+        self.reset(0, 0)
+
+    def reset(self, num_chains, num_samples):
+        """
+        Clears the store, in preparation for a run of ``num_chains`` chains with
+        ``num_samples`` draws each.
+        """
+        self.num_chains = num_chains
+        self.capacity = (num_samples + self.thinning - 1) // self.thinning
+        if self.retention is not None:
+            self.capacity = min(self.capacity, self.retention)
+        self._buffers = None
+        self._chunks = [[] for _ in range(num_chains)]
+        self._num_draws = [0] * num_chains
+        self._num_retained = [0] * num_chains
+        self._moments = [{} for _ in range(num_chains)]
+
+    def _allocate(self, sample):
+        self._buffers = {}
+        for name, value in sample.items():
+            shape = (self.num_chains, self.capacity) + value.shape
+            if self.path is None:
+                self._buffers[name] = value.new_empty(shape)
+            else:
+                os.makedirs(self.path, exist_ok=True)
+                filename = os.path.join(self.path, quote(name, safe="") + ".npy")
+                dtype = value.new_empty(()).cpu().numpy().dtype
+                self._buffers[name] = np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=shape)
+
+    def append(self, chain_id, sample):
+        """
+        Adds a draw to the store.
+
+        :param int chain_id: the chain which generated the draw.
+        :param dict sample: dictionary of (constrained) values keyed by site name.
+        """
+        moments = self._moments[chain_id]
+        for name, value in sample.items():
+            if name not in moments:
+                moments[name] = WelfordCovariance(diagonal=True)
+            moments[name].update(value)
+        self._num_draws[chain_id] += 1
+        if (self._num_draws[chain_id] - 1) % self.thinning != 0:
+            return
+
+        if self._buffers is None:
+            self._allocate(sample)
+        if self.path is None:
+            idx = self._num_retained[chain_id] % self.capacity
+            for name, value in sample.items():
+                self._buffers[name][chain_id, idx] = value
+        else:
+            self._chunks[chain_id].append(sample)
+        self._num_retained[chain_id] += 1
+        if len(self._chunks[chain_id]) == self.chunk_size:
+            self._flush(chain_id)
+
+    def _flush(self, chain_id):
+        chunk = self._chunks[chain_id]
+        if not chunk:
+            return
+        self._chunks[chain_id] = []
+        # the positions of the chunk in the circular buffer; older draws which
+        # would be overwritten within the same chunk are dropped
+        end = self._num_retained[chain_id]
+        chunk = chunk[-self.capacity:]
+        idx = np.arange(end - len(chunk), end) % self.capacity
+        for name, buf in self._buffers.items():
+            buf[chain_id, idx] = torch.stack([s[name] for s in chunk]).detach().cpu().numpy()
+            buf.flush()
+
+    def finalize(self):
+        """
+        Writes any buffered draws to the on-disk store.
+        """
+        if self.path is not None:
+            for chain_id in range(self.num_chains):
+                self._flush(chain_id)
+
+    def get_samples(self):
+        """
+        Gets the retained draws, in the order in which they were generated.
+
+        :return: dictionary of tensors of shape ``num_chains x num_retained x site_shape``
+            keyed by site name. These are views into the store's buffers (memory-mapped
+            for the on-disk store), unless the circular buffer has wrapped around.
+        """
+        if self._buffers is None:
+            return {}
+        num_retained = min(self._num_retained)
+        size = min(num_retained, self.capacity)
+        start = num_retained % self.capacity if num_retained > self.capacity else 0
+        samples = {}
+        for name, buf in self._buffers.items():
+            if self.path is not None:
+                buf = torch.from_numpy(buf)
+            if start:
+                buf = torch.cat([buf[:, start:], buf[:, :start]], dim=1)
+            samples[name] = buf[:, :size]
+        return samples
+
+    def moments(self, group_by_chain=False):
+        """
+        Gets the online estimates of the mean and variance of each site, over all
+        the post-warmup draws.
+
+        :param bool group_by_chain: whether to return estimates for each chain
+            separately, with num_chains as the size of their leading dimension.
+        :return: dictionary of ``(mean, variance)`` tuples keyed by site name.
+        """
+        result = {}
+        for name in self._moments[0]:
+            welfords = [moments[name] for moments in self._moments]
+            n = torch.tensor([float(w.n_samples) for w in welfords])
+            mean = torch.stack([w._mean for w in welfords])
+            m2 = torch.stack([w._m2 for w in welfords])
+            n = n.reshape(n.shape + (1,) * (mean.dim() - 1)).to(mean)
+            if group_by_chain:
+                result[name] = mean, m2 / (n - 1)
+            else:
+                # pool the chains (Chan et al.'s parallel variant of Welford's scheme)
+                pooled_mean = (n * mean).sum(0) / n.sum()
+                pooled_m2 = m2.sum(0) + (n * (mean - pooled_mean) ** 2).sum(0)
+                result[name] = pooled_mean, pooled_m2 / (n.sum() - 1)
+        return result
@@ -1,4 +1,8 @@
 import functools
+import hashlib
+import numbers
+import os
+import types
 import warnings
 from collections import OrderedDict, defaultdict
 from functools import partial, reduce
@@ -160,13 +164,18 @@ class TraceEinsumEvaluator(object):
         discrete enumerable sites.
     :param int max_plate_nesting: Optional bound on max number of nested
         :func:`pyro.plate` contexts.
+    :param str batch_plate: Optional name of an outermost plate whose dimension
+        is preserved, rather than summed out, in the result of :meth:`log_prob`.
+        This is used to evaluate a batch of independent chains at once.
     """
     def __init__(self,
                  model_trace,
                  has_enumerable_sites=False,
-                 max_plate_nesting=None):
+                 max_plate_nesting=None,
+                 batch_plate=None):
         self.has_enumerable_sites = has_enumerable_sites
         self.max_plate_nesting = max_plate_nesting
+        self.batch_plate = batch_plate
         # To be populated using the model trace once.
         self._enum_dims = set()
         self.ordering = {}
@@ -209,18 +218,43 @@ class TraceEinsumEvaluator(object):
                 log_probs.setdefault(self.ordering[name], []).append(site["packed"]["log_prob"])
         return log_probs
 
+    def _batched_log_prob_sum(self, model_trace):
+        """
+        Sums the `log_prob` terms of all sites, except along the dimension
+        of ``batch_plate``.
+        """
+        model_trace.compute_log_prob()
+        result = 0.
+        for site in model_trace.nodes.values():
+            if site["type"] != "sample":
+                continue
+            log_prob = site["log_prob"]
+            dim = {f.name: f.dim for f in site["cond_indep_stack"]}.get(self.batch_plate)
+            if dim is not None and log_prob.dim() >= -dim:
+                log_prob = log_prob.reshape(log_prob.shape[:log_prob.dim() + dim + 1] + (-1,)).sum(-1)
+            else:
+                log_prob = log_prob.sum()
+            result = result + log_prob
+        return result
+
     def log_prob(self, model_trace):
         """
         Returns the log pdf of `model_trace` by appropriately handling
         enumerated log prob factors.
 
-        :return: log pdf of the trace.
+        :return: log pdf of the trace. If ``batch_plate`` is specified, this
+            has one element per slice of that plate.
         """
         if not self.has_enumerable_sites:
-            return model_trace.log_prob_sum()
+            if self.batch_plate is None:
+                return model_trace.log_prob_sum()
+            return self._batched_log_prob_sum(model_trace)
         log_probs = self._get_log_factors(model_trace)
+        target_ordinal = frozenset()
+        if self.batch_plate is not None:
+            target_ordinal = frozenset([model_trace.plate_to_symbol[self.batch_plate]])
         with shared_intermediates() as cache:
-            return contract_to_tensor(log_probs, self._enum_dims, cache=cache)
+            return contract_to_tensor(log_probs, self._enum_dims, target_ordinal, cache=cache)
 
 
 def _guess_max_plate_nesting(model, args, kwargs):
@@ -242,6 +276,89 @@ def _guess_max_plate_nesting(model, args, kwargs):
     return max_plate_nesting
 
 
+# compiled potential functions, keyed by the name of their file in the cache directory
+_JIT_CACHE = {}
+
+
+def _transform_key(t):
+    # transforms are applied within compiled potential functions, so their parameters are part of the key
+    if isinstance(t, torch.distributions.transforms.ComposeTransform):
+        return [_transform_key(part) for part in t.parts]
+    attrs = sorted((k, v.tolist() if torch.is_tensor(v) else v) for k, v in vars(t).items()
+                   if not k.startswith("_") and isinstance(v, (torch.Tensor, numbers.Number)))
+    return [type(t).__name__, attrs]
+
+
+def _value_key(value, seen):
+    # Returns a reproducible key for a value bound to a model, or None if the value cannot be keyed.
+    if value is None or isinstance(value, (bool, numbers.Number, str, torch.dtype, torch.device)):
+        return repr(value)
+    if torch.is_tensor(value):
+        data = value.detach().cpu().contiguous().numpy().tobytes()
+        return ["tensor", str(value.dtype), tuple(value.shape), hashlib.sha1(data).hexdigest()]
+    if isinstance(value, (list, tuple)):
+        keys = [_value_key(v, seen) for v in value]
+        return None if None in keys else [type(value).__name__] + keys
+    if isinstance(value, dict):
+        keys = [(repr(k), _value_key(v, seen)) for k, v in value.items()]
+        return None if any(k is None for _, k in keys) else sorted(keys)
+    if isinstance(value, types.ModuleType):
+        return ["module", value.__name__]
+    if callable(value):
+        return _model_key(value, seen)
+    return None
+
+
+def _model_key(model, seen=None):
+    """
+    Returns a key for the code of ``model`` and the values bound to it, i.e.
+    ``functools.partial`` arguments, closure cells, default arguments and
+    simple global values, or None if some bound value cannot be keyed.
+    """
+    seen = set() if seen is None else seen
+    if id(model) in seen:
+        return ["recursive", getattr(model, "__qualname__", None)]
+    seen.add(id(model))
+    if isinstance(model, functools.partial):
+        bound = _value_key((model.args, model.keywords), seen)
+        func = _model_key(model.func, seen)
+        return None if bound is None or func is None else ["partial", func, bound]
+    if isinstance(model, types.MethodType):
+        return None
+    if isinstance(model, types.FunctionType):
+        code = model.__code__
+        closure = [cell.cell_contents for cell in model.__closure__ or ()]
+        global_values = [(name, model.__globals__[name]) for name in sorted(code.co_names)
+                         if name in model.__globals__ and
+                         not isinstance(model.__globals__[name], (types.ModuleType, type))]
+        bound = _value_key((closure, model.__defaults__, model.__kwdefaults__, global_values), seen)
+        if bound is None:
+            return None
+        code_hash = hashlib.sha1(code.co_code + repr(code.co_consts).encode()).hexdigest()
+        return [model.__module__, model.__qualname__, code_hash, bound]
+    if isinstance(model, (types.BuiltinFunctionType, type)):
+        return [getattr(model, "__module__", None), model.__qualname__]
+    # Callable objects may carry arbitrary state, so they are not keyed.
+    return None
+
+
+def _tensor_args(model_args, model_kwargs):
+    """
+    Returns the tensors among `model_args` and `model_kwargs`, which are passed as
+    inputs to compiled potential functions rather than being traced as constants.
+    """
+    return tuple(arg for arg in model_args if torch.is_tensor(arg)) + \
+        tuple(model_kwargs[k] for k in sorted(model_kwargs) if torch.is_tensor(model_kwargs[k]))
+
+
+def _replace_tensor_args(model_args, model_kwargs, tensors):
+    tensors = iter(tensors)
+    model_args = tuple(next(tensors) if torch.is_tensor(arg) else arg for arg in model_args)
+    model_kwargs = {k: next(tensors) if torch.is_tensor(model_kwargs[k]) else model_kwargs[k]
+                    for k in sorted(model_kwargs)}
+    return model_args, model_kwargs
+
+
 class _PEMaker(object):
     def __init__(self, model, model_args, model_kwargs, trace_prob_evaluator, transforms):
         self.model = model
@@ -252,41 +369,106 @@ class _PEMaker(object):
         self._compiled_fn = None
 
     def _potential_fn(self, params):
+        return self._potential_fn_with_args(params, self.model_args, self.model_kwargs)
+
+    def _potential_fn_with_args(self, params, model_args, model_kwargs):
         params_constrained = {k: self.transforms[k].inv(v) for k, v in params.items()}
         cond_model = poutine.condition(self.model, params_constrained)
-        model_trace = poutine.trace(cond_model).get_trace(*self.model_args,
-                                                          **self.model_kwargs)
+        model_trace = poutine.trace(cond_model).get_trace(*model_args, **model_kwargs)
         log_joint = self.trace_prob_evaluator.log_prob(model_trace)
         for name, t in self.transforms.items():
             log_joint = log_joint - torch.sum(
                 t.log_abs_det_jacobian(params_constrained[name], params[name]))
         return -log_joint
 
-    def _potential_fn_jit(self, skip_jit_warnings, jit_options, params):
+    def _jit_cache_file(self, jit_cache_key, jit_options, names, vals, tensor_args):
+        key = [jit_cache_key, repr(sorted(jit_options.items())), torch.__version__, pyro.__version__]
+        key += [(name, tuple(v.shape), str(v.dtype), str(v.device)) for name, v in zip(names, vals)]
+        key += [(tuple(v.shape), str(v.dtype), str(v.device)) for v in tensor_args]
+        return "potential_fn_{}.pt".format(hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def _potential_fn_jit(self, skip_jit_warnings, jit_options, jit_cache_dir, jit_cache_key, params):
         if not params:
             return self._potential_fn(params)
         names, vals = zip(*sorted(params.items()))
+        # model args which are tensors are inputs of the compiled function, so that it
+        # can be reused for new data of the same shape
+        tensor_args = _tensor_args(self.model_args, self.model_kwargs)
 
         if self._compiled_fn:
-            return self._compiled_fn(*vals)
+            return self._compiled_fn(*(vals + tensor_args))
+
+        if jit_cache_dir is not None:
+            filename = self._jit_cache_file(jit_cache_key, jit_options, names, vals, tensor_args)
+            path = os.path.join(jit_cache_dir, filename)
+            if filename in _JIT_CACHE:
+                self._compiled_fn = _JIT_CACHE[filename]
+            elif os.path.exists(path):
+                self._compiled_fn = _JIT_CACHE[filename] = torch.jit.load(path)
+            if self._compiled_fn:
+                return self._compiled_fn(*(vals + tensor_args))
 
         with pyro.validation_enabled(False):
             def _pe_jit(*zi):
-                params = dict(zip(names, zi))
-                return self._potential_fn(params)
+                params = dict(zip(names, zi[:len(names)]))
+                model_args, model_kwargs = _replace_tensor_args(self.model_args, self.model_kwargs,
+                                                                zi[len(names):])
+                return self._potential_fn_with_args(params, model_args, model_kwargs)
 
             if skip_jit_warnings:
                 _pe_jit = ignore_jit_warnings()(_pe_jit)
-            self._compiled_fn = torch.jit.trace(_pe_jit, vals, **jit_options)
-            return self._compiled_fn(*vals)
-
-    def get_potential_fn(self, jit_compile=False, skip_jit_warnings=True, jit_options=None):
+            self._compiled_fn = torch.jit.trace(_pe_jit, vals + tensor_args, **jit_options)
+            if jit_cache_dir is not None:
+                if not os.path.exists(jit_cache_dir):
+                    os.makedirs(jit_cache_dir)
+                torch.jit.save(self._compiled_fn, path)
+                _JIT_CACHE[filename] = self._compiled_fn
+            return self._compiled_fn(*(vals + tensor_args))
+
+    def get_potential_fn(self, jit_compile=False, skip_jit_warnings=True, jit_options=None,
+                         jit_cache_dir=None, jit_cache_key=None):
         if jit_compile:
             jit_options = {"check_trace": False} if jit_options is None else jit_options
-            return partial(self._potential_fn_jit, skip_jit_warnings, jit_options)
+            return partial(self._potential_fn_jit, skip_jit_warnings, jit_options, jit_cache_dir, jit_cache_key)
         return self._potential_fn
 
 
+class _VectorizedPEMaker(_PEMaker):
+    """
+    Makes a potential function which evaluates a batch of independent chains
+    at once. Parameters have a leading dimension of size ``num_chains``, which
+    is moved to the dimension of the plate that ``model`` is wrapped in.
+    """
+    def __init__(self, model, model_args, model_kwargs, trace_prob_evaluator, transforms,
+                 num_chains, site_shapes):
+        super(_VectorizedPEMaker, self).__init__(model, model_args, model_kwargs,
+                                                 trace_prob_evaluator, transforms)
+        self.num_chains = num_chains
+        self.site_shapes = site_shapes
+
+    def _potential_fn_with_args(self, params, model_args, model_kwargs):
+        params_constrained = {k: self.transforms[k].inv(v) for k, v in params.items()}
+        cond_model = poutine.condition(self.model, {k: v.reshape((self.num_chains,) + self.site_shapes[k])
+                                                    for k, v in params_constrained.items()})
+        model_trace = poutine.trace(cond_model).get_trace(*model_args, **model_kwargs)
+        log_joint = self.trace_prob_evaluator.log_prob(model_trace)
+        for name, t in self.transforms.items():
+            log_abs_det_jacobian = t.log_abs_det_jacobian(params_constrained[name], params[name])
+            log_joint = log_joint - log_abs_det_jacobian.reshape(self.num_chains, -1).sum(-1)
+        return -log_joint
+
+
+def _vectorize_chains(model, num_chains, dim):
+    """
+    Runs ``model`` inside an outermost plate over ``num_chains`` chains.
+    """
+    def vectorized_model(*args, **kwargs):
+        with pyro.plate("_num_chains", num_chains, dim=dim):
+            return model(*args, **kwargs)
+
+    return vectorized_model
+
+
 # TODO: expose init_strategy using separate functions.
 def _get_init_params(model, model_args, model_kwargs, transforms, potential_fn, prototype_params,
                      max_tries_initial_params=100, num_chains=1, strategy="uniform"):
@@ -321,7 +503,8 @@ def _get_init_params(model, model_args, model_kwargs, transforms, potential_fn,
 
 
 def initialize_model(model, model_args=(), model_kwargs={}, transforms=None, max_plate_nesting=None,
-                     jit_compile=False, jit_options=None, skip_jit_warnings=False, num_chains=1):
+                     jit_compile=False, jit_options=None, skip_jit_warnings=False, num_chains=1,
+                     vectorize_chains=False, jit_cache_dir=None):
     """
     Given a Python callable with Pyro primitives, generates the following model-specific
     properties needed for inference using HMC/NUTS kernels:
@@ -352,6 +535,20 @@ def initialize_model(model, model_args=(), model_kwargs={}, transforms=None, max
         tracer when ``jit_compile=True``. Default is False.
     :param int num_chains: Number of parallel chains. If `num_chains > 1`,
         the returned `initial_params` will be a list with `num_chains` elements.
+    :param bool vectorize_chains: Whether the returned `potential_fn` evaluates
+        all `num_chains` chains at once. In that case, it takes in parameters with
+        a leading dimension of size `num_chains` and returns a potential energy
+        for each chain. This runs `model` inside an outermost :class:`~pyro.plate`,
+        so requires that `model` broadcasts correctly over an additional leftmost
+        batch dimension.
+    :param str jit_cache_dir: Optional directory in which to persist the compiled
+        potential function when ``jit_compile=True``, via :func:`torch.jit.save`.
+        A compiled function is reused, within and across processes, for the same
+        model code, sample site shapes and dtypes, shapes and dtypes of tensor
+        arguments, non-tensor arguments and transforms. Tensor arguments of the
+        model (e.g. data) are inputs to the compiled function, so their values
+        may change. Note that changes to functions called by the model are not
+        detected, in which case the cache directory should be cleared.
     :returns: a tuple of (`initial_params`, `potential_fn`, `transforms`, `prototype_trace`)
     """
     # XXX `transforms` domains are sites' supports
@@ -365,6 +562,7 @@ def initialize_model(model, model_args=(), model_kwargs={}, transforms=None, max
         max_plate_nesting = _guess_max_plate_nesting(model, model_args, model_kwargs)
     # Wrap model in `poutine.enum` to enumerate over discrete latent sites.
     # No-op if model does not have any discrete latents.
+    base_model = model
     model = poutine.enum(config_enumerate(model),
                          first_available_dim=-1 - max_plate_nesting)
     model_trace = poutine.trace(model).get_trace(*model_args, **model_kwargs)
@@ -394,10 +592,58 @@ def initialize_model(model, model_args=(), model_kwargs={}, transforms=None, max
     # enable potential_fn to be picklable (a torch._C.Function cannot be pickled).
     init_params = _get_init_params(model, model_args, model_kwargs, transforms,
                                    pe_maker.get_potential_fn(), prototype_params, num_chains=num_chains)
-    potential_fn = pe_maker.get_potential_fn(jit_compile, skip_jit_warnings, jit_options)
+
+    if vectorize_chains:
+        # The chains plate is placed just outside of the model's plates, so
+        # enumerated dims are allocated to the left of it.
+        vectorized_model = poutine.enum(
+            config_enumerate(_vectorize_chains(base_model, num_chains, -1 - max_plate_nesting)),
+            first_available_dim=-2 - max_plate_nesting)
+        vectorized_trace = poutine.trace(vectorized_model).get_trace(*model_args, **model_kwargs)
+        trace_prob_evaluator = TraceEinsumEvaluator(vectorized_trace,
+                                                    has_enumerable_sites,
+                                                    max_plate_nesting + 1,
+                                                    batch_plate="_num_chains")
+        site_shapes = {}
+        for name, value in prototype_samples.items():
+            event_dim = model_trace.nodes[name]["fn"].event_dim
+            batch_dim = max(max_plate_nesting - value.dim() + event_dim, 0)
+            site_shapes[name] = (1,) * batch_dim + value.shape
+        pe_maker = _VectorizedPEMaker(vectorized_model, model_args, model_kwargs, trace_prob_evaluator,
+                                      transforms, num_chains, site_shapes)
+
+    jit_cache_key = None
+    if jit_compile and jit_cache_dir is not None:
+        model_key = _model_key(base_model)
+        non_tensor_args = _value_key(([arg for arg in model_args if not torch.is_tensor(arg)],
+                                      {k: v for k, v in model_kwargs.items() if not torch.is_tensor(v)}),
+                                     set())
+        if model_key is None or non_tensor_args is None:
+            warnings.warn("Cannot reliably key the compiled potential function of this model and "
+                          "its arguments, so it will not be cached in jit_cache_dir.", RuntimeWarning)
+            jit_cache_dir = None
+        else:
+            jit_cache_key = repr([model_key, non_tensor_args,
+                                  sorted((k, _transform_key(t)) for k, t in transforms.items()),
+                                  max_plate_nesting, num_chains if vectorize_chains else None])
+    potential_fn = pe_maker.get_potential_fn(jit_compile, skip_jit_warnings, jit_options,
+                                             jit_cache_dir, jit_cache_key)
     return init_params, potential_fn, transforms, model_trace
 
 
+def _where(cond, x, y):
+    """
+    Selects, for each chain, the values from dict ``x`` where ``cond`` is true
+    and from dict ``y`` otherwise. The leading dimensions of the values in
+    ``x`` and ``y`` index chains, and match the shape of ``cond``.
+    """
+    result = {}
+    for name, value in x.items():
+        mask = cond.reshape(cond.shape + (1,) * (value.dim() - cond.dim()))
+        result[name] = torch.where(mask, value, y[name])
+    return result
+
+
 def _safe(fn):
     """
     Safe version of utilities in the :mod:`pyro.ops.stats` module. Wrapped
@@ -418,7 +664,7 @@ def _safe(fn):
     return wrapped
 
 
-def diagnostics(samples, group_by_chain=True):
+def diagnostics(samples, group_by_chain=True, batch_size=None):
     """
     Gets diagnostics statistics such as effective sample size and
     split Gelman-Rubin using the samples drawn from the posterior
@@ -429,6 +675,8 @@ def diagnostics(samples, group_by_chain=True):
         will be treated as having shape `num_chains x num_samples x sample_shape`.
         Otherwise, the corresponding shape will be `num_samples x sample_shape`
         (i.e. without chain dimension).
+    :param int batch_size: if not `None`, the statistics of each site are
+        computed for ``batch_size`` elements of `sample_shape` at a time.
     :return: dictionary of diagnostic stats for each sample site.
     """
     diagnostics = {}
@@ -436,13 +684,13 @@ def diagnostics(samples, group_by_chain=True):
         if not group_by_chain:
             support = support.unsqueeze(0)
         site_stats = OrderedDict()
-        site_stats["n_eff"] = _safe(stats.effective_sample_size)(support)
-        site_stats["r_hat"] = stats.split_gelman_rubin(support)
+        site_stats["n_eff"] = _safe(stats.effective_sample_size)(support, batch_size=batch_size)
+        site_stats["r_hat"] = stats.split_gelman_rubin(support, batch_size=batch_size)
         diagnostics[site] = site_stats
     return diagnostics
 
 
-def summary(samples, prob=0.9, group_by_chain=True):
+def summary(samples, prob=0.9, group_by_chain=True, batch_size=None, moments=None):
     """
     Prints a summary table displaying diagnostics of ``samples`` from the
     posterior. The diagnostics displayed are mean, standard deviation, median,
@@ -455,7 +703,14 @@ def summary(samples, prob=0.9, group_by_chain=True):
         will be treated as having shape `num_chains x num_samples x sample_shape`.
         Otherwise, the corresponding shape will be `num_samples x sample_shape`
         (i.e. without chain dimension).
+    :param int batch_size: if not `None`, the effective sample size and split
+        Gelman-Rubin of each site are computed for ``batch_size`` elements of
+        `sample_shape` at a time.
+    :param dict moments: optional dictionary of precomputed ``(mean, std)`` tuples
+        keyed by site name (e.g. online estimates over all the draws of an MCMC run),
+        which are displayed in place of those computed from ``samples``.
     """
+    moments = {} if moments is None else moments
     if not group_by_chain:
         samples = {k: v.unsqueeze(0) for k, v in samples.items()}
 
@@ -472,12 +727,15 @@ def summary(samples, prob=0.9, group_by_chain=True):
     row_format = name_format + ' {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'
     for name, value in samples.items():
         value_flat = torch.reshape(value, (-1,) + value.shape[2:])
-        mean = value_flat.mean(dim=0)
-        sd = value_flat.std(dim=0)
+        if name in moments:
+            mean, sd = moments[name]
+        else:
+            mean = value_flat.mean(dim=0)
+            sd = value_flat.std(dim=0)
         median = value_flat.median(dim=0)[0]
         hpd = stats.hpdi(value_flat, prob=prob)
-        n_eff = _safe(stats.effective_sample_size)(value)
-        r_hat = stats.split_gelman_rubin(value)
+        n_eff = _safe(stats.effective_sample_size)(value, batch_size=batch_size)
+        r_hat = stats.split_gelman_rubin(value, batch_size=batch_size)
         shape = value_flat.shape[1:]
         if len(shape) == 0:
             print(row_format.format(name, mean, sd, median, hpd[0], hpd[1], n_eff, r_hat))
@@ -6,7 +6,7 @@ import torch
 from pyro.distributions.util import is_identically_zero
 from pyro.infer.elbo import ELBO
 from pyro.infer.enum import get_importance_trace
-from pyro.infer.util import is_validation_enabled, torch_item
+from pyro.infer.util import is_validation_enabled
 from pyro.util import check_if_enumerated, warn_if_nan
 
 
@@ -80,92 +80,46 @@ class RenyiELBO(ELBO):
             check_if_enumerated(guide_trace)
         return model_trace, guide_trace
 
-    def loss(self, model, guide, *args, **kwargs):
-        """
-        :returns: returns an estimate of the ELBO
-        :rtype: float
-
-        Evaluates the ELBO with an estimator that uses num_particles many samples/particles.
-        """
-        elbo_particles = []
-        is_vectorized = self.vectorize_particles and self.num_particles > 1
-
-        # grab a vectorized trace from the generator
-        for model_trace, guide_trace in self._get_traces(model, guide, *args, **kwargs):
-            elbo_particle = 0.
-
-            # compute elbo
-            for name, site in model_trace.nodes.items():
-                if site["type"] == "sample":
-                    if is_vectorized:
-                        log_prob_sum = site["log_prob"].detach().reshape(self.num_particles, -1).sum(-1)
-                    else:
-                        log_prob_sum = torch_item(site["log_prob_sum"])
-
-                    elbo_particle = elbo_particle + log_prob_sum
-
-            for name, site in guide_trace.nodes.items():
-                if site["type"] == "sample":
-                    log_prob, score_function_term, entropy_term = site["score_parts"]
-                    if is_vectorized:
-                        log_prob_sum = log_prob.detach().reshape(self.num_particles, -1).sum(-1)
-                    else:
-                        log_prob_sum = torch_item(site["log_prob_sum"])
-
-                    elbo_particle = elbo_particle - log_prob_sum
-
-            elbo_particles.append(elbo_particle)
-
-        if is_vectorized:
-            elbo_particles = elbo_particles[0]
-        else:
-            elbo_particles = torch.tensor(elbo_particles)  # no need to use .new*() here
-
-        log_weights = (1. - self.alpha) * elbo_particles
-        log_mean_weight = torch.logsumexp(log_weights, dim=0) - math.log(self.num_particles)
-        elbo = log_mean_weight.sum().item() / (1. - self.alpha)
-
-        loss = -elbo
-        warn_if_nan(loss, "loss")
-        return loss
-
-    def loss_and_grads(self, model, guide, *args, **kwargs):
+    def _get_particle_elbos(self, traces, compute_surrogate):
         """
-        :returns: returns an estimate of the ELBO
-        :rtype: float
-
-        Computes the ELBO as well as the surrogate ELBO that is used to form the gradient estimator.
-        Performs backward on the latter. Num_particle many samples are used to form the estimators.
+        Returns a tuple ``(elbo_particles, surrogate_elbo_particles,
+        trainable_params)``, where the first two are tensors of shape
+        ``(num_particles,)``, or ``None`` if there are no sample sites. A
+        vectorized trace is reduced per particle without looping over
+        particles, and particles of sequential traces are stacked without
+        synchronizing on each site.
         """
         elbo_particles = []
         surrogate_elbo_particles = []
+        trainable_params = False
         is_vectorized = self.vectorize_particles and self.num_particles > 1
-        tensor_holder = None
 
-        # grab a vectorized trace from the generator
-        for model_trace, guide_trace in self._get_traces(model, guide, *args, **kwargs):
-            elbo_particle = 0
-            surrogate_elbo_particle = 0
+        for model_trace, guide_trace in traces:
+            elbo_particle = 0.
+            surrogate_elbo_particle = 0.
 
             # compute elbo and surrogate elbo
             for name, site in model_trace.nodes.items():
                 if site["type"] == "sample":
                     if is_vectorized:
-                        log_prob_sum = site["log_prob"].reshape(self.num_particles, -1).sum(-1)
+                        log_prob_sum = self._sum_particle_log_prob(site["log_prob"])
                     else:
                         log_prob_sum = site["log_prob_sum"]
                     elbo_particle = elbo_particle + log_prob_sum.detach()
-                    surrogate_elbo_particle = surrogate_elbo_particle + log_prob_sum
+                    if compute_surrogate:
+                        surrogate_elbo_particle = surrogate_elbo_particle + log_prob_sum
 
             for name, site in guide_trace.nodes.items():
                 if site["type"] == "sample":
                     log_prob, score_function_term, entropy_term = site["score_parts"]
                     if is_vectorized:
-                        log_prob_sum = log_prob.reshape(self.num_particles, -1).sum(-1)
+                        log_prob_sum = self._sum_particle_log_prob(log_prob)
                     else:
                         log_prob_sum = site["log_prob_sum"]
 
                     elbo_particle = elbo_particle - log_prob_sum.detach()
+                    if not compute_surrogate:
+                        continue
 
                     if not is_identically_zero(entropy_term):
                         surrogate_elbo_particle = surrogate_elbo_particle - log_prob_sum
@@ -178,39 +132,62 @@ class RenyiELBO(ELBO):
                         surrogate_elbo_particle = (surrogate_elbo_particle +
                                                    (self.alpha / (1. - self.alpha)) * log_prob_sum)
 
-            if is_identically_zero(elbo_particle):
-                if tensor_holder is not None:
-                    elbo_particle = torch.zeros_like(tensor_holder)
-                    surrogate_elbo_particle = torch.zeros_like(tensor_holder)
-            else:  # elbo_particle is not None
-                if tensor_holder is None:
-                    tensor_holder = torch.zeros_like(elbo_particle)
-                    # change types of previous `elbo_particle`s
-                    for i in range(len(elbo_particles)):
-                        elbo_particles[i] = torch.zeros_like(tensor_holder)
-                        surrogate_elbo_particles[i] = torch.zeros_like(tensor_holder)
-
             elbo_particles.append(elbo_particle)
             surrogate_elbo_particles.append(surrogate_elbo_particle)
+            trainable_params = trainable_params or any(site["type"] == "param"
+                                                       for trace in (model_trace, guide_trace)
+                                                       for site in trace.nodes.values())
 
+        tensor_holder = next((x for x in elbo_particles if isinstance(x, torch.Tensor)), None)
         if tensor_holder is None:
-            return 0.
-
+            return None, None, trainable_params
         if is_vectorized:
-            elbo_particles = elbo_particles[0]
-            surrogate_elbo_particles = surrogate_elbo_particles[0]
-        else:
-            elbo_particles = torch.stack(elbo_particles)
-            surrogate_elbo_particles = torch.stack(surrogate_elbo_particles)
+            return elbo_particles[0], surrogate_elbo_particles[0], trainable_params
+
+        # change types of particles without sample sites
+        zero = torch.zeros_like(tensor_holder)
+        elbo_particles = torch.stack([x if isinstance(x, torch.Tensor) else zero
+                                      for x in elbo_particles])
+        surrogate_elbo_particles = torch.stack([x if isinstance(x, torch.Tensor) else zero
+                                                for x in surrogate_elbo_particles])
+        return elbo_particles, surrogate_elbo_particles, trainable_params
+
+    def loss(self, model, guide, *args, **kwargs):
+        """
+        :returns: returns an estimate of the ELBO
+        :rtype: float
+
+        Evaluates the ELBO with an estimator that uses num_particles many samples/particles.
+        """
+        elbo_particles, _, _ = self._get_particle_elbos(
+            self._get_traces(model, guide, *args, **kwargs), compute_surrogate=False)
+        if elbo_particles is None:
+            return 0.
 
         log_weights = (1. - self.alpha) * elbo_particles
         log_mean_weight = torch.logsumexp(log_weights, dim=0) - math.log(self.num_particles)
         elbo = log_mean_weight.sum().item() / (1. - self.alpha)
 
-        # collect parameters to train from model and guide
-        trainable_params = any(site["type"] == "param"
-                               for trace in (model_trace, guide_trace)
-                               for site in trace.nodes.values())
+        loss = -elbo
+        warn_if_nan(loss, "loss")
+        return loss
+
+    def loss_and_grads(self, model, guide, *args, **kwargs):
+        """
+        :returns: returns an estimate of the ELBO
+        :rtype: float
+
+        Computes the ELBO as well as the surrogate ELBO that is used to form the gradient estimator.
+        Performs backward on the latter. Num_particle many samples are used to form the estimators.
+        """
+        elbo_particles, surrogate_elbo_particles, trainable_params = self._get_particle_elbos(
+            self._get_traces(model, guide, *args, **kwargs), compute_surrogate=True)
+        if elbo_particles is None:
+            return 0.
+
+        log_weights = (1. - self.alpha) * elbo_particles
+        log_mean_weight = torch.logsumexp(log_weights, dim=0) - math.log(self.num_particles)
+        elbo = log_mean_weight.sum().item() / (1. - self.alpha)
 
         if trainable_params and getattr(surrogate_elbo_particles, 'requires_grad', False):
             normalized_weights = (log_weights - log_mean_weight).exp()
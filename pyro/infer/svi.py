@@ -1,4 +1,9 @@
+import itertools
+import queue
+import threading
+
 import torch
+import torch.distributed
 
 import pyro
 import pyro.optim
@@ -6,6 +11,58 @@ import pyro.poutine as poutine
 from pyro.infer.abstract_infer import TracePosterior
 from pyro.infer.elbo import ELBO
 from pyro.infer.util import torch_item
+from pyro.poutine.scale_messenger import ScaleMessenger
+
+
+def _to_device(x, device):
+    if isinstance(x, torch.Tensor):
+        return x.to(device, non_blocking=True)
+    if isinstance(x, (tuple, list)):
+        return type(x)(_to_device(v, device) for v in x)
+    if isinstance(x, dict):
+        return type(x)((k, _to_device(v, device)) for k, v in x.items())
+    return x
+
+
+def _prefetch(iterable, num_prefetch, fn):
+    """
+    Iterates over ``fn(x) for x in iterable``, evaluating up to
+    ``num_prefetch`` items ahead of the consumer in a background thread.
+    """
+    buffer = queue.Queue(maxsize=num_prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for x in iterable:
+                if not put((fn(x), None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
 
 
 class SVI(TracePosterior):
@@ -93,6 +150,73 @@ class SVI(TracePosterior):
         generated under the hood by `loss_and_grads`).
         Any args or kwargs are passed to the model and guide
         """
+        return torch_item(self._step(*args, **kwargs))
+
+    def run_stream(self, data, num_steps=None, num_prefetch=1, collate_fn=None, device=None,
+                   loss_read_interval=1, **kwargs):
+        """
+        :returns: estimates of the loss, one per step
+        :rtype: list
+
+        Takes a gradient step on each minibatch of an iterable ``data``, while
+        the next ``num_prefetch`` minibatches are collated and moved to
+        ``device`` in a background thread, overlapping data loading with
+        computation. Each minibatch is passed to the model and guide as
+        positional args if it is a tuple, and as a single arg otherwise. Any
+        additional kwargs are passed to the model and guide.
+
+        Losses that are returned as tensors, e.g. by custom loss functions,
+        are read in batches every ``loss_read_interval`` steps rather than
+        synchronizing on each step.
+
+        :param data: an iterable of minibatches.
+        :param int num_steps: an optional maximum number of steps.
+        :param int num_prefetch: the number of minibatches to prepare ahead.
+        :param callable collate_fn: an optional function applied to each
+            minibatch in the background thread.
+        :param device: an optional device to move tensors of each minibatch
+            to, using non-blocking copies.
+        :param int loss_read_interval: the number of steps between reads of
+            tensor losses.
+        """
+        if num_prefetch < 1:
+            raise ValueError("Expected num_prefetch >= 1, but got {}".format(num_prefetch))
+        if loss_read_interval < 1:
+            raise ValueError("Expected loss_read_interval >= 1, but got {}".format(loss_read_interval))
+
+        def prepare(batch):
+            if collate_fn is not None:
+                batch = collate_fn(batch)
+            if device is not None:
+                batch = _to_device(batch, device)
+            return batch
+
+        losses = []
+        pending = []
+
+        def read_losses():
+            tensors = [loss for loss in pending if isinstance(loss, torch.Tensor)]
+            values = iter(torch.stack(tensors).tolist() if tensors else [])
+            losses.extend(next(values) if isinstance(loss, torch.Tensor) else loss for loss in pending)
+            del pending[:]
+
+        if num_steps is not None:
+            # Stop before pulling minibatches that would never be stepped on.
+            data = itertools.islice(data, num_steps)
+        batches = _prefetch(data, num_prefetch, prepare)
+        try:
+            for batch in batches:
+                args = batch if isinstance(batch, tuple) else (batch,)
+                loss = self._step(*args, **kwargs)
+                pending.append(loss.detach() if isinstance(loss, torch.Tensor) else loss)
+                if len(pending) >= loss_read_interval:
+                    read_losses()
+        finally:
+            batches.close()
+        read_losses()
+        return losses
+
+    def _step(self, *args, **kwargs):
         # get loss and compute gradients
         with poutine.trace(param_only=True) as param_capture:
             loss = self.loss_and_grads(self.model, self.guide, *args, **kwargs)
@@ -107,4 +231,120 @@ class SVI(TracePosterior):
         # zero gradients
         pyro.infer.util.zero_grads(params)
 
-        return torch_item(loss)
+        return loss
+
+
+class _PlateScaleMessenger(ScaleMessenger):
+    """
+    Rescales only the sites inside the plate named ``name``.
+    """
+    def __init__(self, name, scale):
+        super(_PlateScaleMessenger, self).__init__(scale)
+        self.name = name
+
+    def _process_message(self, msg):
+        if any(frame.name == self.name for frame in msg["cond_indep_stack"]):
+            super(_PlateScaleMessenger, self)._process_message(msg)
+
+
+class DataParallelSVI(SVI):
+    """
+    :param model: the model (callable containing Pyro primitives)
+    :param guide: the guide (callable containing Pyro primitives)
+    :param optim: a wrapper a for a PyTorch optimizer
+    :type optim: pyro.optim.PyroOptim
+    :param loss: an instance of a subclass of :class:`~pyro.infer.elbo.ELBO`.
+    :param str plate: the name of the data plate that is sharded across
+        workers.
+    :param group: an optional :mod:`torch.distributed` process group.
+        Defaults to the default group.
+
+    Data-parallel stochastic variational inference. Each of the workers of an
+    initialized :mod:`torch.distributed` process group (e.g. with the
+    ``"gloo"`` backend on localhost) runs ``loss_and_grads`` on its own shard
+    of the data, where the model's ``plate`` ranges over the shard rather
+    than the full dataset. Sites inside ``plate`` are rescaled by the number
+    of workers, gradients of all params are averaged across workers with a
+    single all-reduce, and every worker takes the same optimizer step.
+    Params are broadcast from rank 0 when first seen, before gradients are
+    taken, so workers stay in lockstep. Every worker must create the same
+    params at each step.
+
+    Example::
+
+        def worker(rank, world_size, data):
+            torch.set_num_threads(1)
+            torch.distributed.init_process_group(
+                "gloo", init_method="tcp://127.0.0.1:29500",
+                rank=rank, world_size=world_size)
+            svi = DataParallelSVI(model, guide, optim, Trace_ELBO(), plate="data")
+            shard = svi.shard(data)
+            for step in range(1000):
+                svi.step(shard)
+
+        torch.multiprocessing.spawn(worker, args=(world_size, data), nprocs=world_size)
+    """
+    def __init__(self, model, guide, optim, loss, plate, group=None, **kwargs):
+        if not torch.distributed.is_initialized():
+            raise ValueError("DataParallelSVI requires an initialized torch.distributed process group")
+        group = torch.distributed.group.WORLD if group is None else group
+        self.group = group
+        self.rank = torch.distributed.get_rank(group)
+        self.world_size = torch.distributed.get_world_size(group)
+        self.plate = plate
+        self._synced_params = set()
+        scale = _PlateScaleMessenger(plate, float(self.world_size))
+        super(DataParallelSVI, self).__init__(scale(model), scale(guide), optim, loss, **kwargs)
+
+    def shard(self, data, dim=0):
+        """
+        :param torch.Tensor data: a tensor of the full dataset.
+        :param int dim: the dimension of ``data`` along which to shard.
+        :returns: this worker's shard of ``data``.
+        :rtype: torch.Tensor
+        """
+        index = torch.arange(self.rank, data.size(dim), self.world_size, device=data.device)
+        return data.index_select(dim, index)
+
+    def _step(self, *args, **kwargs):
+        while True:
+            # get loss and compute gradients
+            with poutine.trace(param_only=True) as param_capture:
+                loss = self.loss_and_grads(self.model, self.guide, *args, **kwargs)
+
+            # sort by name so that all workers agree on the order of params
+            params = [param_capture.trace.nodes[name]["value"].unconstrained()
+                      for name in sorted(param_capture.trace.nodes)]
+            new_params = [p for p in params if p not in self._synced_params]
+            if not new_params:
+                break
+
+            # Gradients were computed at each worker's own initial values of
+            # new params, so broadcast the values from rank 0 and recompute.
+            for p in new_params:
+                torch.distributed.broadcast(p.data, 0, group=self.group)
+                self._synced_params.add(p)
+            pyro.infer.util.zero_grads(set(params))
+
+        # average the loss and gradients across workers in a single all-reduce
+        flat = [torch.zeros(p.numel(), dtype=torch.double) if p.grad is None
+                else p.grad.detach().reshape(-1).double() for p in params]
+        flat.append(torch.tensor([torch_item(loss)], dtype=torch.double))
+        flat = torch.cat(flat)
+        torch.distributed.all_reduce(flat, group=self.group)
+        flat /= self.world_size
+        flat = flat.split([p.numel() for p in params] + [1])
+        for p, grad in zip(params, flat):
+            grad = grad.reshape(p.shape).to(p.dtype)
+            if p.grad is None:
+                p.grad = grad
+            else:
+                p.grad.copy_(grad)
+
+        # actually perform gradient steps
+        self.optim(set(params))
+
+        # zero gradients
+        pyro.infer.util.zero_grads(set(params))
+
+        return flat[-1].item()
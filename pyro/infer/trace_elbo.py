@@ -9,9 +9,10 @@ from pyro.infer.util import MultiFrameTensor, get_plate_stacks, is_validation_en
 from pyro.util import check_if_enumerated, warn_if_nan
 
 
-def _compute_log_r(model_trace, guide_trace):
+def _compute_log_r(model_trace, guide_trace, stacks=None):
     log_r = MultiFrameTensor()
-    stacks = get_plate_stacks(model_trace)
+    if stacks is None:
+        stacks = get_plate_stacks(model_trace)
     for name, model_site in model_trace.nodes.items():
         if model_site["type"] == "sample":
             log_r_term = model_site["log_prob"]
@@ -47,7 +48,8 @@ class Trace_ELBO(ELBO):
         against it.
         """
         model_trace, guide_trace = get_importance_trace(
-            "flat", self.max_plate_nesting, model, guide, *args, **kwargs)
+            "flat", self.max_plate_nesting, model, guide, *args,
+            structure_cache=self._structure_cache, **kwargs)
         if is_validation_enabled():
             check_if_enumerated(guide_trace)
         return model_trace, guide_trace
@@ -90,7 +92,8 @@ class Trace_ELBO(ELBO):
 
                 if not is_identically_zero(score_function_term):
                     if log_r is None:
-                        log_r = _compute_log_r(model_trace, guide_trace)
+                        stacks = self._structure_cache.get_plate_stacks(model_trace)
+                        log_r = _compute_log_r(model_trace, guide_trace, stacks)
                     site = log_r.sum_to(site["cond_indep_stack"])
                     surrogate_elbo_particle = surrogate_elbo_particle + (site * score_function_term).sum()
 
@@ -187,7 +190,8 @@ class JitTrace_ELBO(Trace_ELBO):
 
                             if not is_identically_zero(score_function_term):
                                 if log_r is None:
-                                    log_r = _compute_log_r(model_trace, guide_trace)
+                                    stacks = self._structure_cache.get_plate_stacks(model_trace)
+                                    log_r = _compute_log_r(model_trace, guide_trace, stacks)
                                 site = log_r.sum_to(site["cond_indep_stack"])
                                 surrogate_elbo_particle = surrogate_elbo_particle + (site * score_function_term).sum()
 
@@ -48,12 +48,12 @@ class TraceTailAdaptive_ELBO(Trace_ELBO):
 
         for name, site in model_trace.nodes.items():
             if site["type"] == "sample":
-                site_log_p = site["log_prob"].reshape(self.num_particles, -1).sum(-1)
+                site_log_p = self._sum_particle_log_prob(site["log_prob"])
                 log_p = log_p + site_log_p
 
         for name, site in guide_trace.nodes.items():
             if site["type"] == "sample":
-                site_log_q = site["log_prob"].reshape(self.num_particles, -1).sum(-1)
+                site_log_q = self._sum_particle_log_prob(site["log_prob"])
                 log_q = log_q + site_log_q
                 if is_validation_enabled():
                     check_fully_reparameterized(site)
@@ -18,6 +18,7 @@ from pyro.ops import packed
 from pyro.ops.contract import contract_tensor_tree, contract_to_tensor
 from pyro.ops.rings import SampleRing
 from pyro.poutine.enumerate_messenger import EnumerateMessenger
+from pyro.poutine.subsample_messenger import _Subsample
 from pyro.util import check_traceenum_requirements, ignore_jit_warnings, warn_if_nan
 
 
@@ -56,6 +57,42 @@ def _find_ordinal(trace, site):
                      if f.vectorized)
 
 
+def _find_markov_dims(trace, dim_to_size=None):
+    """
+    Collects the previous and current state dims of chains in
+    :class:`~pyro.vectorized_markov` plates, optionally recording the sizes
+    of those plates in ``dim_to_size``.
+
+    :returns: a dict mapping each markov plate dim to a pair
+        ``(prev_dims, curr_dims)`` of aligned strings of enumerated dims.
+    :rtype: dict
+    """
+    markov_dims = {}
+    for name, site in trace.nodes.items():
+        if site["type"] != "sample" or "_markov_plate" not in site["infer"]:
+            continue
+        prev_name = site["infer"]["markov_prev"]
+        prev_site = trace.nodes.get(prev_name)
+        if prev_site is None or prev_site["type"] != "sample":
+            raise ValueError("Site '{}' declares missing markov_prev site '{}'".format(name, prev_name))
+        plate_name = site["infer"]["_markov_plate"]
+        for other in (site, prev_site):
+            if "_enumerate_symbol" not in other["infer"]:
+                raise ValueError("Expected site '{}' in the markov chain of plate('{}') to be enumerated "
+                                 "in the model".format(other["name"], plate_name))
+        frame, = (f for f in site["cond_indep_stack"] if f.name == plate_name)
+        if any(f.name == plate_name for f in prev_site["cond_indep_stack"]):
+            raise ValueError("Expected markov_prev site '{}' to be outside of plate('{}')"
+                             .format(prev_name, plate_name))
+        symbol = trace.plate_to_symbol[plate_name]
+        prev_dims, curr_dims = markov_dims.get(symbol, ('', ''))
+        markov_dims[symbol] = (prev_dims + prev_site["infer"]["_enumerate_symbol"],
+                               curr_dims + site["infer"]["_enumerate_symbol"])
+        if dim_to_size is not None:
+            dim_to_size.setdefault(symbol, frame.size)
+    return markov_dims
+
+
 # TODO move this logic into a poutine
 def _compute_model_factors(model_trace, guide_trace):
     # y depends on x iff ordering[x] <= ordering[y]
@@ -136,9 +173,10 @@ def _compute_dice_elbo(model_trace, guide_trace):
         # contract_to_tensor() with a RaggedTensor -> Tensor contraction operation, but
         # replace contract_tensor_tree() with a RaggedTensor -> RaggedTensor contraction
         # that preserves some dependency structure.
+        markov_dims = _find_markov_dims(model_trace, dim_to_size)
         with shared_intermediates() as cache:
             ring = SampleRing(cache=cache, dim_to_size=dim_to_size)
-            log_factors = contract_tensor_tree(log_factors, sum_dims, ring=ring)
+            log_factors = contract_tensor_tree(log_factors, sum_dims, ring=ring, markov_dims=markov_dims)
             model_trace._sharing_cache = cache  # For TraceEnumSample_ELBO.
         for t, log_factors_t in log_factors.items():
             marginal_costs_t = marginal_costs.setdefault(t, [])
@@ -167,6 +205,7 @@ def _compute_marginals(model_trace, guide_trace):
     args = _compute_model_factors(model_trace, guide_trace)
     marginal_costs, log_factors, ordering, sum_dims, scale = args
 
+    markov_dims = _find_markov_dims(model_trace)
     marginal_dists = OrderedDict()
     with shared_intermediates() as cache:
         for name, site in model_trace.nodes.items():
@@ -180,7 +219,7 @@ def _compute_marginals(model_trace, guide_trace):
             ordinal = _find_ordinal(model_trace, site)
             logits = contract_to_tensor(log_factors, sum_dims,
                                         target_ordinal=ordinal, target_dims={enum_symbol},
-                                        cache=cache)
+                                        cache=cache, markov_dims=markov_dims)
             logits = packed.unpack(logits, model_trace.symbol_to_dim)
             logits = logits.unsqueeze(-1).transpose(-1, enum_dim - 1)
             while logits.shape[0] == 1:
@@ -199,6 +238,7 @@ class BackwardSampleMessenger(pyro.poutine.messenger.Messenger):
         args = _compute_model_factors(enum_trace, guide_trace)
         self.log_factors = args[1]
         self.sum_dims = args[3]
+        self.markov_dims = _find_markov_dims(enum_trace)
 
     def __enter__(self):
         self.cache = {}
@@ -221,7 +261,7 @@ class BackwardSampleMessenger(pyro.poutine.messenger.Messenger):
             ordinal = _find_ordinal(self.enum_trace, msg)
             logits = contract_to_tensor(self.log_factors, self.sum_dims,
                                         target_ordinal=ordinal, target_dims={enum_symbol},
-                                        cache=self.cache)
+                                        cache=self.cache, markov_dims=self.markov_dims)
             logits = packed.unpack(logits, self.enum_trace.symbol_to_dim)
             logits = logits.unsqueeze(-1).transpose(-1, enum_dim - 1)
             while logits.shape[0] == 1:
@@ -244,6 +284,37 @@ class BackwardSampleMessenger(pyro.poutine.messenger.Messenger):
         self.sum_dims.remove(enum_symbol)
 
 
+class _PlateChunkMessenger(pyro.poutine.messenger.Messenger):
+    """
+    Restricts a :class:`~pyro.plate` to the contiguous chunk of its indices
+    starting at ``self.start``, so that summing over all chunks recovers the
+    full plate exactly: sites in the plate are rescaled to undo subsampling,
+    and sites outside the plate are counted only in the first chunk.
+    """
+    def __init__(self, name, chunk_size):
+        super(_PlateChunkMessenger, self).__init__()
+        self.name = name
+        self.chunk_size = chunk_size
+        self.start = 0
+        self.size = None
+
+    def _pyro_sample(self, msg):
+        if msg["name"] == self.name and isinstance(msg["fn"], _Subsample):
+            self.size = msg["fn"].size
+            stop = min(self.start + self.chunk_size, self.size)
+            msg["value"] = torch.arange(self.start, stop, device=msg["fn"].device)
+            msg["done"] = True
+            return
+        frame = next((f for f in msg["cond_indep_stack"] if f.name == self.name), None)
+        if frame is not None:
+            if self.size is None:
+                raise ValueError("Expected plate('{}') to be subsampled by pyro.plate, but it was created "
+                                 "with an explicit subsample".format(self.name))
+            msg["scale"] = msg["scale"] * frame.size / self.size
+        elif self.start > 0:
+            msg["scale"] = msg["scale"] * 0.
+
+
 class TraceEnum_ELBO(ELBO):
     """
     A trace implementation of ELBO-based SVI that supports
@@ -260,7 +331,29 @@ class TraceEnum_ELBO(ELBO):
     This assumes restricted dependency structure on the model and guide:
     variables outside of an :class:`~pyro.plate` can never depend on
     variables inside that :class:`~pyro.plate`.
+
+    To bound peak memory when enumerating inside a large plate, set
+    ``chunk_plate`` to the name of a :class:`~pyro.plate` and ``chunk_size``
+    to a number of indices. The model and guide are then run once per chunk
+    of the plate's indices, with the plate subsampled to that chunk, and the
+    ELBO and its gradients are accumulated across chunks. Sample sites outside
+    of the chunked plate are sampled once (in the first chunk) and replayed in
+    later chunks, so the result matches the full-batch ELBO exactly. The plate
+    must not be subsampled by the user, and enumerated sites must all lie
+    inside the chunked plate.
+
+    :param str chunk_plate: Optional name of a plate to process in chunks.
+    :param int chunk_size: Number of plate indices per chunk; required iff
+        ``chunk_plate`` is set.
     """
+    def __init__(self, *args, chunk_plate=None, chunk_size=None, **kwargs):
+        if (chunk_plate is None) != (chunk_size is None):
+            raise ValueError("Expected both or neither of chunk_plate and chunk_size")
+        if chunk_size is not None and not (isinstance(chunk_size, int) and chunk_size > 0):
+            raise ValueError("Expected chunk_size to be a positive integer, but got {}".format(repr(chunk_size)))
+        super(TraceEnum_ELBO, self).__init__(*args, **kwargs)
+        self.chunk_plate = chunk_plate
+        self.chunk_size = chunk_size
 
     def _get_trace(self, model, guide, *args, **kwargs):
         """
@@ -312,9 +405,43 @@ class TraceEnum_ELBO(ELBO):
                               escape_fn=iter_discrete_escape,
                               extend_fn=iter_discrete_extend)
         for i in range(1 if self.vectorize_particles else self.num_particles):
+            if self.chunk_plate is None:
+                q.put(poutine.Trace())
+                while not q.empty():
+                    yield self._get_trace(model, guide, *args, **kwargs)
+            else:
+                yield from self._get_chunked_traces(model, guide, q, *args, **kwargs)
+
+    def _get_chunked_traces(self, model, guide, q, *args, **kwargs):
+        """
+        Runs the guide and model once per chunk of ``self.chunk_plate``,
+        replaying sites outside of that plate from the first chunk.
+        """
+        chunk = _PlateChunkMessenger(self.chunk_plate, self.chunk_size)
+        global_trace = poutine.Trace()
+        model = chunk(model)
+        guide = chunk(poutine.replay(guide, trace=global_trace))
+        while chunk.size is None or chunk.start < chunk.size:
             q.put(poutine.Trace())
             while not q.empty():
-                yield self._get_trace(model, guide, *args, **kwargs)
+                model_trace, guide_trace = self._get_trace(model, guide, *args, **kwargs)
+                if chunk.size is None:
+                    raise ValueError("Found no plate('{}') to process in chunks".format(self.chunk_plate))
+                if chunk.start == 0:
+                    for trace in (model_trace, guide_trace):
+                        for name, site in trace.nodes.items():
+                            if site["type"] != "sample" or name == self.chunk_plate:
+                                continue
+                            if any(f.name == self.chunk_plate for f in site["cond_indep_stack"]):
+                                continue
+                            if site["infer"].get("enumerate"):
+                                raise NotImplementedError(
+                                    "TraceEnum_ELBO cannot process plate('{}') in chunks, because "
+                                    "enumerated site '{}' is outside of that plate".format(self.chunk_plate, name))
+                            if trace is guide_trace and not site["is_observed"] and name not in global_trace:
+                                global_trace.add_node(name, **site)
+                yield model_trace, guide_trace
+            chunk.start += self.chunk_size
 
     def loss(self, model, guide, *args, **kwargs):
         """
@@ -401,6 +528,9 @@ class TraceEnum_ELBO(ELBO):
         if self.num_particles != 1:
             raise NotImplementedError("TraceEnum_ELBO.compute_marginals() is not "
                                       "compatible with multiple particles.")
+        if self.chunk_plate is not None:
+            raise NotImplementedError("TraceEnum_ELBO.compute_marginals() is not "
+                                      "compatible with chunk_plate.")
         model_trace, guide_trace = next(self._get_traces(model, guide, *args, **kwargs))
         for site in guide_trace.nodes.values():
             if site["type"] == "sample":
@@ -416,6 +546,9 @@ class TraceEnum_ELBO(ELBO):
         if self.num_particles != 1:
             raise NotImplementedError("TraceEnum_ELBO.sample_posterior() is not "
                                       "compatible with multiple particles.")
+        if self.chunk_plate is not None:
+            raise NotImplementedError("TraceEnum_ELBO.sample_posterior() is not "
+                                      "compatible with chunk_plate.")
         with poutine.block(), warnings.catch_warnings():
             warnings.filterwarnings("ignore", "Found vars in model but not guide")
             model_trace, guide_trace = next(self._get_traces(model, guide, *args, **kwargs))
@@ -1,5 +1,4 @@
 import weakref
-from operator import itemgetter
 
 import torch
 
@@ -8,7 +7,7 @@ import pyro.ops.jit
 from pyro.distributions.util import is_identically_zero
 from pyro.infer import ELBO
 from pyro.infer.enum import get_importance_trace
-from pyro.infer.util import (MultiFrameTensor, detach_iterable, get_plate_stacks,
+from pyro.infer.util import (detach_iterable, get_plate_stacks,
                              is_validation_enabled, torch_backward, torch_item)
 from pyro.util import check_if_enumerated, warn_if_nan
 
@@ -47,12 +46,17 @@ def _construct_baseline(node, guide_site, downstream_cost):
     assert(not (use_nn_baseline and use_baseline_value)), \
         "cannot use baseline_value and nn_baseline simultaneously"
     if use_decaying_avg_baseline:
-        dc_shape = downstream_cost.shape
+        # share the average among vectorized particles, updating it with their mean cost
+        avg_downstream_cost = downstream_cost
+        for f in guide_site["cond_indep_stack"]:
+            if f.name == "num_particles_vectorized" and downstream_cost.dim() >= -f.dim:
+                avg_downstream_cost = downstream_cost.mean(f.dim, True)
+        dc_shape = avg_downstream_cost.shape
         param_name = "__baseline_avg_downstream_cost_" + node
         with torch.no_grad():
             avg_downstream_cost_old = pyro.param(param_name,
                                                  torch.zeros(dc_shape, device=guide_site['value'].device))
-            avg_downstream_cost_new = (1 - baseline_beta) * downstream_cost + \
+            avg_downstream_cost_new = (1 - baseline_beta) * avg_downstream_cost + \
                 baseline_beta * avg_downstream_cost_old
         pyro.get_param_store()[param_name] = avg_downstream_cost_new
         baseline += avg_downstream_cost_old
@@ -67,6 +71,8 @@ def _construct_baseline(node, guide_site, downstream_cost):
         baseline_loss += torch.pow(downstream_cost.detach() - baseline, 2.0).sum()
 
     if use_baseline:
+        if use_decaying_avg_baseline and not (use_nn_baseline or use_baseline_value):
+            baseline = baseline.expand(downstream_cost.shape)
         if downstream_cost.shape != baseline.shape:
             raise ValueError("Expected baseline at site {} to be {} instead got {}".format(
                 node, downstream_cost.shape, baseline.shape))
@@ -74,49 +80,37 @@ def _construct_baseline(node, guide_site, downstream_cost):
     return use_baseline, baseline_loss, baseline
 
 
-def _compute_downstream_costs(model_trace, guide_trace,  #
-                              non_reparam_nodes):
-    # recursively compute downstream cost nodes for all sample sites in model and guide
-    # (even though ultimately just need for non-reparameterizable sample sites)
+def _compute_downstream_cost_structure(model_trace, guide_trace, non_reparam_nodes):
+    """
+    Computes which cost terms are downstream of each guide sample site. This
+    depends only on the structure of the traces, so it can be reused across
+    steps; see :meth:`~pyro.infer.util.TraceStructureCache.get`.
+
+    :returns: a pair ``(downstream_guide_cost_nodes, groups)`` where
+        ``downstream_guide_cost_nodes`` maps each guide sample site to the
+        names of its downstream sites, and ``groups`` is a list of tuples
+        ``(target_frames, sites, columns, index)`` batching the
+        non-reparametrizable ``sites`` that share a plate stack. Each column
+        is a pair ``(name, is_guide_cost)`` and each row of the
+        ``torch.LongTensor`` ``index`` lists the columns downstream of a site,
+        padded with ``len(columns)``.
+    :rtype: tuple
+    """
     # 1. downstream costs used for rao-blackwellization
     # 2. model observe sites (as well as terms that arise from the model and guide having different
     # dependency structures) are taken care of via 'children_in_model' below
-    topo_sort_guide_nodes = guide_trace.topological_sort(reverse=True)
-    topo_sort_guide_nodes = [x for x in topo_sort_guide_nodes
+    topo_sort_guide_nodes = [x for x in guide_trace.topological_sort(reverse=True)
                              if guide_trace.nodes[x]["type"] == "sample"]
-    ordered_guide_nodes_dict = {n: i for i, n in enumerate(topo_sort_guide_nodes)}
-
     downstream_guide_cost_nodes = {}
-    downstream_costs = {}
-    stacks = get_plate_stacks(model_trace)
-
     for node in topo_sort_guide_nodes:
-        downstream_costs[node] = MultiFrameTensor((stacks[node],
-                                                   model_trace.nodes[node]['log_prob'] -
-                                                   guide_trace.nodes[node]['log_prob']))
-        nodes_included_in_sum = set([node])
         downstream_guide_cost_nodes[node] = set([node])
-        # make more efficient by ordering children appropriately (higher children first)
-        children = [(k, -ordered_guide_nodes_dict[k]) for k in guide_trace.successors(node)]
-        sorted_children = sorted(children, key=itemgetter(1))
-        for child, _ in sorted_children:
-            child_cost_nodes = downstream_guide_cost_nodes[child]
-            downstream_guide_cost_nodes[node].update(child_cost_nodes)
-            if nodes_included_in_sum.isdisjoint(child_cost_nodes):  # avoid duplicates
-                downstream_costs[node].add(*downstream_costs[child].items())
-                # XXX nodes_included_in_sum logic could be more fine-grained, possibly leading
-                # to speed-ups in case there are many duplicates
-                nodes_included_in_sum.update(child_cost_nodes)
-        missing_downstream_costs = downstream_guide_cost_nodes[node] - nodes_included_in_sum
-        # include terms we missed because we had to avoid duplicates
-        for missing_node in missing_downstream_costs:
-            downstream_costs[node].add((stacks[missing_node],
-                                        model_trace.nodes[missing_node]['log_prob'] -
-                                        guide_trace.nodes[missing_node]['log_prob']))
-
-    # finish assembling complete downstream costs
-    # (the above computation may be missing terms from model)
-    for site in non_reparam_nodes:
+        for child in guide_trace.successors(node):
+            downstream_guide_cost_nodes[node].update(downstream_guide_cost_nodes[child])
+
+    groups = {}
+    for site in topo_sort_guide_nodes[::-1]:
+        if site not in non_reparam_nodes:
+            continue
         children_in_model = set()
         for node in downstream_guide_cost_nodes[site]:
             children_in_model.update(model_trace.successors(node))
@@ -124,12 +118,54 @@ def _compute_downstream_costs(model_trace, guide_trace,  #
         children_in_model.difference_update(downstream_guide_cost_nodes[site])
         for child in children_in_model:
             assert (model_trace.nodes[child]["type"] == "sample")
-            downstream_costs[site].add((stacks[child],
-                                        model_trace.nodes[child]['log_prob']))
-            downstream_guide_cost_nodes[site].update([child])
+        columns = ([(node, True) for node in sorted(downstream_guide_cost_nodes[site])] +
+                   [(child, False) for child in sorted(children_in_model)])
+        downstream_guide_cost_nodes[site].update(children_in_model)
+
+        target_frames = frozenset(f for f in guide_trace.nodes[site]["cond_indep_stack"] if f.vectorized)
+        group_sites, group_columns = groups.setdefault(target_frames, ([], {}))
+        group_sites.append((site, [group_columns.setdefault(c, len(group_columns)) for c in columns]))
+
+    batched_groups = []
+    for target_frames, (group_sites, group_columns) in groups.items():
+        width = max(len(row) for _, row in group_sites)
+        index = torch.tensor([row + [len(group_columns)] * (width - len(row)) for _, row in group_sites])
+        batched_groups.append((target_frames, [site for site, _ in group_sites], list(group_columns), index))
+    return downstream_guide_cost_nodes, batched_groups
 
-    for k in non_reparam_nodes:
-        downstream_costs[k] = downstream_costs[k].sum_to(guide_trace.nodes[k]["cond_indep_stack"])
+
+def _compute_downstream_costs(model_trace, guide_trace,  #
+                              non_reparam_nodes, stacks=None, structure=None):
+    # compute downstream costs of all non-reparameterizable sample sites, batching the
+    # sums of the sites that share a plate stack into a single gather and sum.
+    # Downstream costs are only used as constants in the surrogate elbo, so we detach them.
+    if stacks is None:
+        stacks = get_plate_stacks(model_trace)
+    if structure is None:
+        structure = _compute_downstream_cost_structure(model_trace, guide_trace, non_reparam_nodes)
+    downstream_guide_cost_nodes, groups = structure
+
+    costs = {}
+    downstream_costs = {}
+    for target_frames, sites, columns, index in groups:
+        terms = []
+        for name, is_guide_cost in columns:
+            cost = costs.get((name, is_guide_cost))
+            if cost is None:
+                cost = model_trace.nodes[name]['log_prob'].detach()
+                if is_guide_cost:
+                    cost = cost - guide_trace.nodes[name]['log_prob'].detach()
+                costs[name, is_guide_cost] = cost
+            for f in stacks[name]:
+                if f not in target_frames and cost.shape[f.dim] != 1:
+                    cost = cost.sum(f.dim, True)
+            terms.append(cost)
+        terms = torch.broadcast_tensors(*terms)
+        terms = torch.stack(terms + (terms[0].new_zeros(terms[0].shape),))
+        for site, value in zip(sites, terms[index.to(terms.device)].sum(1)):
+            while value.shape and value.shape[0] == 1:
+                value = value.squeeze(0)
+            downstream_costs[site] = value
 
     return downstream_costs, downstream_guide_cost_nodes
 
@@ -219,7 +255,8 @@ class TraceGraph_ELBO(ELBO):
         against it.
         """
         model_trace, guide_trace = get_importance_trace(
-            "dense", self.max_plate_nesting, model, guide, *args, **kwargs)
+            "dense", self.max_plate_nesting, model, guide, *args,
+            structure_cache=self._structure_cache, **kwargs)
         if is_validation_enabled():
             check_if_enumerated(guide_trace)
         return model_trace, guide_trace
@@ -281,9 +318,13 @@ class TraceGraph_ELBO(ELBO):
         baseline_loss = 0.0
 
         # the following computations are only necessary if we have non-reparameterizable nodes
-        non_reparam_nodes = set(guide_trace.nonreparam_stochastic_nodes)
+        non_reparam_nodes = self._structure_cache.get_nonreparam_nodes(guide_trace)
         if non_reparam_nodes:
-            downstream_costs, _ = _compute_downstream_costs(model_trace, guide_trace, non_reparam_nodes)
+            stacks = self._structure_cache.get_plate_stacks(model_trace)
+            structure = self._structure_cache.get("downstream_cost_structure", _compute_downstream_cost_structure,
+                                                  model_trace, guide_trace, non_reparam_nodes)
+            downstream_costs, _ = _compute_downstream_costs(model_trace, guide_trace, non_reparam_nodes,
+                                                            stacks, structure)
             surrogate_elbo_term, baseline_loss = _compute_elbo_non_reparam(guide_trace,
                                                                            non_reparam_nodes,
                                                                            downstream_costs)
@@ -80,6 +80,106 @@ def get_plate_stacks(trace):
             if node["type"] == "sample" and not site_is_subsample(node)}
 
 
+def get_trace_fingerprint(*traces):
+    """
+    Computes a hashable fingerprint of the structure of the sample sites of
+    one or more traces, namely their names, distribution types, shapes and
+    reparametrizability, observation status, enumeration settings and plate
+    stacks. Traces with equal fingerprints agree on all metadata derived from
+    their structure.
+    """
+    fingerprint = []
+    for trace in traces:
+        for name, site in trace.nodes.items():
+            if site["type"] != "sample":
+                continue
+            fn = site["fn"]
+            fingerprint.append((name,
+                                site["is_observed"],
+                                type(fn),
+                                getattr(fn, "batch_shape", None),
+                                getattr(fn, "event_shape", None),
+                                getattr(fn, "has_rsample", None),
+                                getattr(site["value"], "shape", None),
+                                getattr(site["mask"], "shape", None),
+                                getattr(site["scale"], "shape", None),
+                                site["infer"].get("enumerate"),
+                                site["infer"].get("is_auxiliary"),
+                                site["cond_indep_stack"]))
+        fingerprint.append(None)  # separates traces
+    return tuple(fingerprint)
+
+
+class TraceStructureCache(object):
+    """
+    A cache of metadata derived from the structure of model and guide traces,
+    which is reused across inference steps as long as that structure does not
+    change.
+
+    Used by ELBO implementations to skip validation of the model and guide, and
+    to avoid recomputing plate stacks and reparametrization flags, on each step.
+
+    Example::
+
+        cache = TraceStructureCache()
+        fingerprint = get_trace_fingerprint(model_trace, guide_trace)
+        if not cache.is_validated(fingerprint):
+            check_model_guide_match(model_trace, guide_trace)
+        cache.update(fingerprint, validated=True)
+        stacks = cache.get_plate_stacks(model_trace)
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._fingerprint = None
+        self._validated = False
+        self._metadata = {}
+
+    def is_validated(self, fingerprint):
+        """
+        :returns: whether traces with the given fingerprint have been validated.
+        :rtype: bool
+        """
+        return self._validated and fingerprint == self._fingerprint
+
+    def update(self, fingerprint, validated=False):
+        """
+        Records the fingerprint of the current traces, clearing the cached
+        metadata if it differs from the previous fingerprint.
+
+        :param tuple fingerprint: the result of :func:`get_trace_fingerprint`.
+        :param bool validated: whether the current traces have been validated.
+        """
+        if fingerprint != self._fingerprint:
+            self.clear()
+            self._fingerprint = fingerprint
+        self._validated = self._validated or validated
+
+    def get(self, key, fn, *args):
+        """
+        Returns the metadata cached under ``key``, computing it as
+        ``fn(*args)`` if it is missing.
+        """
+        try:
+            return self._metadata[key]
+        except KeyError:
+            value = self._metadata[key] = fn(*args)
+            return value
+
+    def get_plate_stacks(self, model_trace):
+        """
+        Cached version of :func:`get_plate_stacks`.
+        """
+        return self.get("plate_stacks", get_plate_stacks, model_trace)
+
+    def get_nonreparam_nodes(self, guide_trace):
+        """
+        Cached set of names of the non-reparametrizable sample sites of a guide trace.
+        """
+        return self.get("nonreparam_nodes", lambda: frozenset(guide_trace.nonreparam_stochastic_nodes))
+
+
 class MultiFrameTensor(dict):
     """
     A container for sums of Tensors among different :class:`plate` contexts.
@@ -1,3 +1,4 @@
+import functools
 import itertools
 import warnings
 from collections import OrderedDict, defaultdict
@@ -33,16 +34,34 @@ def _partition_terms(ring, terms, dims):
     up into sets that must be contracted together. By separating these
     components we avoid broadcasting.
 
-    This function should be deterministic and free of side effects.
+    The partition depends only on the ``._pyro_dims`` of the terms and on
+    ``dims``, so it is planned once per such structure and reused on later calls.
+
+    This function should be deterministic. Its only side effect is to update
+    the bounded LRU cache of :func:`_plan_partition`.
+    """
+    plan = _plan_partition(tuple(term._pyro_dims for term in terms), frozenset(dims))
+    return [([terms[i] for i in component_terms], set(component_dims))
+            for component_terms, component_dims in plan]
+
+
+@functools.lru_cache(maxsize=1024)
+def _plan_partition(term_dims, dims):
+    """
+    Partitions terms symbolically, given the ``._pyro_dims`` of each term.
+
+    :returns: a list of pairs ``(term_indices, component_dims)``.
     """
     # Construct a bipartite graph between terms and the dims in which they
-    # are enumerated. This conflates terms and dims (tensors and ints).
-    neighbors = OrderedDict([(t, []) for t in terms] + [(d, []) for d in sorted(dims)])
-    for term in terms:
-        for dim in term._pyro_dims:
+    # are enumerated. Terms are represented by their position and dims by
+    # singleton tuples, so that the two kinds of vertices cannot collide.
+    neighbors = OrderedDict([(i, []) for i in range(len(term_dims))] +
+                            [((d,), []) for d in sorted(dims)])
+    for i, pyro_dims in enumerate(term_dims):
+        for dim in pyro_dims:
             if dim in dims:
-                neighbors[term].append(dim)
-                neighbors[dim].append(term)
+                neighbors[i].append((dim,))
+                neighbors[(dim,)].append(i)
 
     # Partition the bipartite graph into connected components for contraction.
     components = []
@@ -58,15 +77,15 @@ def _partition_terms(ring, terms, dims):
                     component[v] = None
                     pending.append(v)
 
-        # Split this connected component into tensors and dims.
-        component_terms = [v for v in component if isinstance(v, torch.Tensor)]
+        # Split this connected component into terms and dims.
+        component_terms = tuple(v for v in component if not isinstance(v, tuple))
         if component_terms:
-            component_dims = set(v for v in component if not isinstance(v, torch.Tensor))
+            component_dims = frozenset(v[0] for v in component if isinstance(v, tuple))
             components.append((component_terms, component_dims))
-    return components
+    return tuple(components)
 
 
-def _contract_component(ring, tensor_tree, sum_dims, target_dims):
+def _contract_component(ring, tensor_tree, sum_dims, target_dims, markov_dims=None):
     """
     Contract out ``sum_dims - target_dims`` in a tree of tensors in-place, via
     message passing. This reduces all tensors down to a single tensor in the
@@ -84,9 +103,16 @@ def _contract_component(ring, tensor_tree, sum_dims, target_dims):
         dimensions from product-contraction dimensions.
     :param set target_dims: An subset of ``sum_dims`` that should be preserved
         in the result.
+    :param dict markov_dims: An optional dict mapping each markov plate dim to
+        a pair ``(prev_dims, curr_dims)`` of aligned strings of sum dims. These
+        plates are product-contracted via
+        :meth:`~pyro.ops.rings.Ring.markov_product`.
     :return: a pair ``(ordinal, tensor)``
     :rtype: tuple of frozenset and torch.Tensor
     """
+    if markov_dims is None:
+        markov_dims = {}
+
     # Group sum dims by ordinal.
     dim_to_ordinal = {}
     for t, terms in tensor_tree.items():
@@ -108,11 +134,18 @@ def _contract_component(ring, tensor_tree, sum_dims, target_dims):
         leaf_terms = tensor_tree.pop(leaf)
         leaf_dims = dims_tree.pop(leaf, set())
 
+        # Terms in a markov plate are coupled through previous states, and
+        # current states are eliminated only after the markov product.
+        leaf_markov_dims = [markov_dims[d] for d in sorted(leaf) if d in markov_dims]
+        prev_dims = set(''.join(prev for prev, curr in leaf_markov_dims))
+        curr_dims = set(''.join(curr for prev, curr in leaf_markov_dims)) & leaf_dims
+
         # Split terms at the current ordinal into connected components.
-        for terms, dims in _partition_terms(ring, leaf_terms, leaf_dims):
+        for terms, dims in _partition_terms(ring, leaf_terms, leaf_dims | prev_dims):
+            dims &= leaf_dims
 
             # Eliminate sum dims via a sumproduct contraction.
-            term = ring.sumproduct(terms, dims - local_dims)
+            term = ring.sumproduct(terms, dims - local_dims - curr_dims)
 
             # Eliminate extra plate dims via product contractions.
             if leaf == min_ordinal:
@@ -123,13 +156,25 @@ def _contract_component(ring, tensor_tree, sum_dims, target_dims):
                 _check_tree_structure(parent, leaf)
                 contract_frames = leaf - parent
                 contract_dims = dims & local_dims
+                for dim in sorted(contract_frames.intersection(markov_dims)):
+                    prev, curr = markov_dims[dim]
+                    if set(prev + curr).isdisjoint(term._pyro_dims):
+                        continue
+                    if contract_dims or not target_dims.isdisjoint(curr):
+                        raise NotImplementedError("Cannot preserve sum dims of sites in a markov plate")
+                    term = ring.markov_product(term, dim, prev, curr)
+                    term = ring.sumproduct([term], set(curr))
+                    contract_frames = contract_frames - {dim}
                 if contract_dims:
                     term, local_term = ring.global_local(term, contract_dims, contract_frames)
                     local_terms.append(local_term)
                     local_dims |= sum_dims.intersection(local_term._pyro_dims)
                     local_ordinal |= leaf
-                else:
+                elif contract_frames:
                     term = ring.product(term, contract_frames)
+            if not curr_dims.isdisjoint(term._pyro_dims):
+                raise NotImplementedError("Expected each markov plate to be nested in the plates of "
+                                          "its previous states")
             tensor_tree.setdefault(parent, []).append(term)
 
     # Extract single tensor at root ordinal.
@@ -147,12 +192,13 @@ def _contract_component(ring, tensor_tree, sum_dims, target_dims):
     return ordinal, term
 
 
-def contract_tensor_tree(tensor_tree, sum_dims, cache=None, ring=None):
+def contract_tensor_tree(tensor_tree, sum_dims, cache=None, ring=None, markov_dims=None):
     """
     Contract out ``sum_dims`` in a tree of tensors via message passing.
     This partially contracts out plate dimensions.
 
-    This function should be deterministic and free of side effects.
+    This function should be deterministic. Apart from caching partition plans
+    in a bounded LRU cache, it is free of side effects.
 
     :param OrderedDict tensor_tree: a dictionary mapping ordinals to lists of
         tensors. An ordinal is a frozenset of ``CondIndepStack`` frames.
@@ -163,6 +209,8 @@ def contract_tensor_tree(tensor_tree, sum_dims, cache=None, ring=None):
         cache.
     :param pyro.ops.rings.Ring ring: an optional algebraic ring defining tensor
         operations.
+    :param dict markov_dims: an optional dict mapping each markov plate dim to
+        a pair ``(prev_dims, curr_dims)`` of aligned strings of sum dims.
     :returns: A contracted version of ``tensor_tree``
     :rtype: OrderedDict
     """
@@ -183,21 +231,22 @@ def contract_tensor_tree(tensor_tree, sum_dims, cache=None, ring=None):
             component.setdefault(ordinals[term], []).append(term)
 
         # Contract this connected component down to a single tensor.
-        ordinal, term = _contract_component(ring, component, dims, set())
+        ordinal, term = _contract_component(ring, component, dims, set(), markov_dims)
         contracted_tree.setdefault(ordinal, []).append(term)
 
     return contracted_tree
 
 
 def contract_to_tensor(tensor_tree, sum_dims, target_ordinal=None, target_dims=None,
-                       cache=None, ring=None):
+                       cache=None, ring=None, markov_dims=None):
     """
     Contract out ``sum_dims`` in a tree of tensors, via message
     passing. This reduces all terms down to a single tensor in the plate
     context specified by ``target_ordinal``, optionally preserving sum
     dimensions ``target_dims``.
 
-    This function should be deterministic and free of side effects.
+    This function should be deterministic. Apart from caching partition plans
+    in a bounded LRU cache, it is free of side effects.
 
     :param OrderedDict tensor_tree: a dictionary mapping ordinals to lists of
         tensors. An ordinal is a frozenset of ``CondIndepStack`` frames.
@@ -212,6 +261,8 @@ def contract_to_tensor(tensor_tree, sum_dims, target_ordinal=None, target_dims=N
         cache.
     :param pyro.ops.rings.Ring ring: an optional algebraic ring defining tensor
         operations.
+    :param dict markov_dims: an optional dict mapping each markov plate dim to
+        a pair ``(prev_dims, curr_dims)`` of aligned strings of sum dims.
     :returns: a single tensor
     :rtype: torch.Tensor
     """
@@ -240,7 +291,7 @@ def contract_to_tensor(tensor_tree, sum_dims, target_ordinal=None, target_dims=N
             component.setdefault(ordinals[term], []).append(term)
 
         # Contract this connected component down to a single tensor.
-        ordinal, term = _contract_component(ring, component, dims, target_dims & dims)
+        ordinal, term = _contract_component(ring, component, dims, target_dims & dims, markov_dims)
         _check_plates_are_sensible(target_dims.intersection(term._pyro_dims),
                                    ordinal - target_ordinal)
 
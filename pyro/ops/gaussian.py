@@ -207,6 +207,222 @@ class Gaussian:
                 chol_P.diagonal(dim1=-2, dim2=-1).log().sum(-1))
 
 
+class SqrtGaussian:
+    """
+    Non-normalized Gaussian distribution in square root information form.
+
+    This represents the same family of semidefinite quadratic functions as
+    :class:`Gaussian`, but stores a factor ``prec_sqrt`` of the precision
+    matrix rather than the precision matrix itself::
+
+        precision = prec_sqrt @ prec_sqrt.T
+        info_vec = prec_sqrt @ white_vec
+
+    so that the log density is::
+
+        log_normalizer - 0.5 * ||value @ prec_sqrt - white_vec||^2
+
+    Conditioning is a cheap substitution and contraction uses a QR
+    decomposition in place of a Cholesky decomposition. This roughly halves
+    the dynamic range of intermediate quantities, so contractions remain
+    accurate in single precision where :class:`Gaussian` contractions can fail
+    to be positive definite.
+
+    :param torch.Tensor log_normalizer: a normalization constant, which is mainly used to keep
+        track of normalization terms during contractions.
+    :param torch.Tensor white_vec: a whitened information vector of shape ``(rank,)``.
+    :param torch.Tensor prec_sqrt: a square root of the precision matrix, of shape
+        ``(dim, rank)``. ``rank`` may differ from ``dim``.
+    """
+    def __init__(self, log_normalizer, white_vec, prec_sqrt):
+        assert white_vec.dim() >= 1
+        assert prec_sqrt.dim() >= 2
+        assert prec_sqrt.shape[-1:] == white_vec.shape[-1:]
+        self.log_normalizer = log_normalizer
+        self.white_vec = white_vec
+        self.prec_sqrt = prec_sqrt
+
+    def dim(self):
+        return self.prec_sqrt.size(-2)
+
+    def rank(self):
+        return self.prec_sqrt.size(-1)
+
+    @lazy_property
+    def batch_shape(self):
+        return broadcast_shape(self.log_normalizer.shape,
+                               self.white_vec.shape[:-1],
+                               self.prec_sqrt.shape[:-2])
+
+    def expand(self, batch_shape):
+        n, m = self.prec_sqrt.shape[-2:]
+        log_normalizer = self.log_normalizer.expand(batch_shape)
+        white_vec = self.white_vec.expand(batch_shape + (m,))
+        prec_sqrt = self.prec_sqrt.expand(batch_shape + (n, m))
+        return SqrtGaussian(log_normalizer, white_vec, prec_sqrt)
+
+    def reshape(self, batch_shape):
+        n, m = self.prec_sqrt.shape[-2:]
+        log_normalizer = self.log_normalizer.reshape(batch_shape)
+        white_vec = self.white_vec.reshape(batch_shape + (m,))
+        prec_sqrt = self.prec_sqrt.reshape(batch_shape + (n, m))
+        return SqrtGaussian(log_normalizer, white_vec, prec_sqrt)
+
+    def __getitem__(self, index):
+        """
+        Index into the batch_shape of a SqrtGaussian.
+        """
+        assert isinstance(index, tuple)
+        log_normalizer = self.log_normalizer[index]
+        white_vec = self.white_vec[index + (slice(None),)]
+        prec_sqrt = self.prec_sqrt[index + (slice(None), slice(None))]
+        return SqrtGaussian(log_normalizer, white_vec, prec_sqrt)
+
+    @staticmethod
+    def cat(parts, dim=0):
+        """
+        Concatenate a list of SqrtGaussians along a given batch dimension.
+        Parts of lower rank are padded with zeros.
+        """
+        if dim < 0:
+            dim += len(parts[0].batch_shape)
+        rank = max(g.rank() for g in parts)
+        log_normalizer = torch.cat([g.log_normalizer for g in parts], dim=dim)
+        white_vec = torch.cat([pad(g.white_vec, (0, rank - g.rank())) for g in parts], dim=dim)
+        prec_sqrt = torch.cat([pad(g.prec_sqrt, (0, rank - g.rank())) for g in parts], dim=dim)
+        return SqrtGaussian(log_normalizer, white_vec, prec_sqrt)
+
+    def event_pad(self, left=0, right=0):
+        """
+        Pad along event dimension.
+        """
+        prec_sqrt = pad(self.prec_sqrt, (0, 0, left, right))
+        return SqrtGaussian(self.log_normalizer, self.white_vec, prec_sqrt)
+
+    def event_permute(self, perm):
+        """
+        Permute along event dimension.
+        """
+        assert isinstance(perm, torch.Tensor)
+        assert perm.shape == (self.dim(),)
+        prec_sqrt = self.prec_sqrt[..., perm, :]
+        return SqrtGaussian(self.log_normalizer, self.white_vec, prec_sqrt)
+
+    def __add__(self, other):
+        """
+        Adds two SqrtGaussians in log-density space. The rank of the result
+        is the sum of the ranks of the summands.
+        """
+        assert isinstance(other, SqrtGaussian)
+        assert self.dim() == other.dim()
+        batch_shape = broadcast_shape(self.batch_shape, other.batch_shape)
+        n = self.dim()
+        white_vec = torch.cat([self.white_vec.expand(batch_shape + (self.rank(),)),
+                               other.white_vec.expand(batch_shape + (other.rank(),))], -1)
+        prec_sqrt = torch.cat([self.prec_sqrt.expand(batch_shape + (n, self.rank())),
+                               other.prec_sqrt.expand(batch_shape + (n, other.rank()))], -1)
+        return SqrtGaussian(self.log_normalizer + other.log_normalizer, white_vec, prec_sqrt)
+
+    def log_density(self, value):
+        """
+        Evaluate the log density of this SqrtGaussian at a point value::
+
+            -0.5 * ||value @ prec_sqrt - white_vec||^2 + log_normalizer
+
+        This is mainly used for testing.
+        """
+        diff = value.unsqueeze(-2).matmul(self.prec_sqrt).squeeze(-2) - self.white_vec
+        return self.log_normalizer - 0.5 * diff.pow(2).sum(-1)
+
+    def condition(self, value):
+        """
+        Condition this SqrtGaussian on a trailing subset of its state.
+        This should satisfy::
+
+            g.condition(y).dim() == g.dim() - y.size(-1)
+
+        Note that since this is a non-normalized Gaussian, we include the
+        density of ``y`` in the result. Thus :meth:`condition` is similar to a
+        ``functools.partial`` binding of arguments::
+
+            left = x[..., :n]
+            right = x[..., n:]
+            g.log_density(x) == g.condition(right).log_density(left)
+        """
+        assert isinstance(value, torch.Tensor)
+        assert value.size(-1) <= self.dim()
+
+        n = self.dim() - value.size(-1)
+        P_b = self.prec_sqrt[..., n:, :]
+        white_vec = self.white_vec - value.unsqueeze(-2).matmul(P_b).squeeze(-2)
+        prec_sqrt = self.prec_sqrt[..., :n, :]
+        return SqrtGaussian(self.log_normalizer, white_vec, prec_sqrt)
+
+    def marginalize(self, left=0, right=0):
+        """
+        Marginalizing out variables on either side of the event dimension::
+
+            g.marginalize(left=n).event_logsumexp() = g.logsumexp()
+            g.marginalize(right=n).event_logsumexp() = g.logsumexp()
+
+        and for data ``x``:
+
+            g.condition(x).event_logsumexp()
+              = g.marginalize(left=g.dim() - x.size(-1)).log_density(x)
+        """
+        if left == 0 and right == 0:
+            return self
+        if left > 0 and right > 0:
+            raise NotImplementedError
+        n = self.dim()
+        a = slice(left, n - right)  # preserved
+        b = slice(None, left) if left else slice(n - right, None)
+        return self._eliminate(self.prec_sqrt[..., b, :], self.prec_sqrt[..., a, :])
+
+    def _eliminate(self, P_b, P_a):
+        # Triangularize the factor of (b, a) so that b appears only in the
+        # leading rows, which then integrate to a constant:
+        #   [P_b; P_a].T = Q @ [[R_bb, R_ba], [0, R_aa]]
+        n_b = P_b.size(-2)
+        white_vec = self.white_vec
+        if white_vec.size(-1) < n_b:
+            # Pad to a full rank factor of b so that R_bb is square. If b is
+            # not integrable, R_bb is then singular and the result is infinite.
+            rank_pad = (0, n_b - white_vec.size(-1))
+            P_b, P_a, white_vec = pad(P_b, rank_pad), pad(P_a, rank_pad), pad(white_vec, rank_pad)
+        batch_shape = broadcast_shape(self.white_vec.shape[:-1], self.prec_sqrt.shape[:-2])
+        M = torch.cat([P_b, P_a], -2).transpose(-1, -2)
+        Q, R = torch.qr(M.expand(batch_shape + M.shape[-2:]))
+        white_proj = Q.transpose(-1, -2).matmul(white_vec.unsqueeze(-1))
+        residual = white_vec - Q.matmul(white_proj).squeeze(-1)
+        white_proj = white_proj.squeeze(-1)
+
+        prec_sqrt = R[..., n_b:, n_b:].transpose(-1, -2)
+        log_normalizer = (self.log_normalizer +
+                          0.5 * n_b * math.log(2 * math.pi) -
+                          R[..., :n_b, :n_b].diagonal(dim1=-2, dim2=-1).abs().log().sum(-1) -
+                          0.5 * residual.pow(2).sum(-1))
+        return SqrtGaussian(log_normalizer, white_proj[..., n_b:], prec_sqrt)
+
+    def event_logsumexp(self):
+        """
+        Integrates out all latent state (i.e. operating on event dimensions).
+        """
+        result = self.marginalize(left=self.dim())
+        return result.log_normalizer - 0.5 * result.white_vec.pow(2).sum(-1)
+
+    def to_gaussian(self):
+        """
+        Converts to an equivalent :class:`Gaussian`.
+
+        :rtype: ~pyro.ops.gaussian.Gaussian
+        """
+        info_vec = self.prec_sqrt.matmul(self.white_vec.unsqueeze(-1)).squeeze(-1)
+        precision = self.prec_sqrt.matmul(self.prec_sqrt.transpose(-1, -2))
+        log_normalizer = self.log_normalizer - 0.5 * self.white_vec.pow(2).sum(-1)
+        return Gaussian(log_normalizer, info_vec, precision)
+
+
 class AffineNormal:
     """
     Represents a conditional diagonal normal distribution over a random
@@ -312,6 +528,70 @@ def matrix_and_mvn_to_gaussian(matrix, mvn):
     return result
 
 
+def mvn_to_sqrt_gaussian(mvn):
+    """
+    Convert a MultivaiateNormal distribution to a SqrtGaussian.
+
+    :param ~torch.distributions.MultivariateNormal mvn: A multivariate normal distribution.
+    :return: An equivalent SqrtGaussian object.
+    :rtype: ~pyro.ops.gaussian.SqrtGaussian
+    """
+    assert isinstance(mvn, torch.distributions.MultivariateNormal)
+    n = mvn.loc.size(-1)
+    scale_tril = mvn.scale_tril
+    eye = torch.eye(n, dtype=scale_tril.dtype, device=scale_tril.device)
+    prec_sqrt = eye.triangular_solve(scale_tril, upper=False).solution.transpose(-1, -2)
+    white_vec = mvn.loc.unsqueeze(-1).triangular_solve(scale_tril, upper=False).solution.squeeze(-1)
+    log_normalizer = (-0.5 * n * math.log(2 * math.pi) -
+                      scale_tril.diagonal(dim1=-2, dim2=-1).log().sum(-1))
+    return SqrtGaussian(log_normalizer, white_vec, prec_sqrt)
+
+
+def matrix_and_mvn_to_sqrt_gaussian(matrix, mvn):
+    """
+    Convert a noisy affine function to a SqrtGaussian. The noisy affine function is defined as::
+
+        y = x @ matrix + mvn.sample()
+
+    Unlike :func:`matrix_and_mvn_to_gaussian`, diagonal normal noise also
+    results in a SqrtGaussian, whose conditioning is equally cheap.
+
+    :param ~torch.Tensor matrix: A matrix with rightmost shape ``(x_dim, y_dim)``.
+    :param mvn: A multivariate normal distribution.
+    :type mvn: ~torch.distributions.MultivariateNormal or
+        ~torch.distributions.Independent of ~torch.distributions.Normal
+    :return: A SqrtGaussian with broadcasted batch shape and ``.dim() == x_dim + y_dim``.
+    :rtype: ~pyro.ops.gaussian.SqrtGaussian
+    """
+    assert (isinstance(mvn, torch.distributions.MultivariateNormal) or
+            (isinstance(mvn, torch.distributions.Independent) and
+             isinstance(mvn.base_dist, torch.distributions.Normal)))
+    assert isinstance(matrix, torch.Tensor)
+    x_dim, y_dim = matrix.shape[-2:]
+    assert mvn.event_shape == (y_dim,)
+    batch_shape = broadcast_shape(matrix.shape[:-2], mvn.batch_shape)
+    matrix = matrix.expand(batch_shape + (x_dim, y_dim))
+    mvn = mvn.expand(batch_shape)
+
+    if isinstance(mvn, torch.distributions.Independent):
+        loc, scale = mvn.base_dist.loc, mvn.base_dist.scale
+        P_y = scale.reciprocal().diag_embed()
+        white_vec = loc / scale
+        log_normalizer = -0.5 * y_dim * math.log(2 * math.pi) - scale.log().sum(-1)
+    else:
+        y_gaussian = mvn_to_sqrt_gaussian(mvn)
+        P_y = y_gaussian.prec_sqrt
+        white_vec = y_gaussian.white_vec
+        log_normalizer = y_gaussian.log_normalizer
+    P_x = -matrix.matmul(P_y)
+    prec_sqrt = torch.cat([P_x, P_y], -2)
+
+    result = SqrtGaussian(log_normalizer, white_vec, prec_sqrt)
+    assert result.batch_shape == batch_shape
+    assert result.dim() == x_dim + y_dim
+    return result
+
+
 def gaussian_tensordot(x, y, dims=0):
     """
     Computes the integral over two gaussians:
@@ -321,10 +601,12 @@ def gaussian_tensordot(x, y, dims=0):
     where `x` is a gaussian over variables (a,b), `y` is a gaussian over variables
     (b,c), (a,b,c) can each be sets of zero or more variables, and `dims` is the size of b.
 
-    :param x: a Gaussian instance
-    :param y: a Gaussian instance
+    :param x: a Gaussian or SqrtGaussian instance
+    :param y: a Gaussian or SqrtGaussian instance of the same type as ``x``
     :param dims: number of variables to contract
     """
+    if isinstance(x, SqrtGaussian):
+        return _sqrt_gaussian_tensordot(x, y, dims)
     assert isinstance(x, Gaussian)
     assert isinstance(y, Gaussian)
     na = x.dim() - dims
@@ -361,3 +643,21 @@ def gaussian_tensordot(x, y, dims=0):
         log_normalizer = log_normalizer + diff
 
     return Gaussian(log_normalizer, info_vec, precision)
+
+
+def _sqrt_gaussian_tensordot(x, y, dims):
+    assert isinstance(x, SqrtGaussian)
+    assert isinstance(y, SqrtGaussian)
+    na = x.dim() - dims
+    nb = dims
+    nc = y.dim() - dims
+    assert na >= 0
+    assert nb >= 0
+    assert nc >= 0
+
+    # Stack both factors with event dims ordered (b, a, c), then eliminate b.
+    Xa, Xb = x.prec_sqrt[..., :na, :], x.prec_sqrt[..., na:, :]
+    Yb, Yc = y.prec_sqrt[..., :nb, :], y.prec_sqrt[..., nb:, :]
+    x = SqrtGaussian(x.log_normalizer, x.white_vec, pad(torch.cat([Xb, Xa], -2), (0, 0, 0, nc)))
+    y = SqrtGaussian(y.log_normalizer, y.white_vec, torch.cat([Yb, pad(Yc, (0, 0, na, 0))], -2))
+    return (x + y).marginalize(left=nb)
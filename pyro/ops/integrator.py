@@ -2,7 +2,8 @@ import torch
 from torch.autograd import grad
 
 
-def velocity_verlet(z, r, potential_fn, inverse_mass_matrix, step_size, num_steps=1, z_grads=None):
+def velocity_verlet(z, r, potential_fn, inverse_mass_matrix, step_size, num_steps=1, z_grads=None,
+                    kinetic_grad=None):
     r"""
     Second order symplectic integrator that uses the velocity verlet algorithm.
 
@@ -17,9 +18,14 @@ def velocity_verlet(z, r, potential_fn, inverse_mass_matrix, step_size, num_step
     :param torch.Tensor inverse_mass_matrix: a tensor :math:`M^{-1}` which is used
         to calculate kinetic energy: :math:`E_{kinetic} = \frac{1}{2}z^T M^{-1} z`.
         Here :math:`M` can be a 1D tensor (diagonal matrix) or a 2D tensor (dense matrix).
-    :param float step_size: step size for each time step iteration.
+    :param float step_size: step size for each time step iteration. When ``z`` holds
+        a batch of independent chains, this can be a tensor of per-chain step sizes
+        whose shape matches the leading batch dimensions of each site.
     :param int num_steps: number of discrete time steps over which to integrate.
     :param torch.Tensor z_grads: optional gradients of potential energy at current ``z``.
+    :param callable kinetic_grad: optional function that takes in the momenta ``r``
+        and returns the gradient of kinetic energy w.r.t. ``r``. This overrides the
+        default computation using ``inverse_mass_matrix``.
     :return tuple (z_next, r_next, z_grads, potential_energy): next position and momenta,
         together with the potential energy and its gradient w.r.t. ``z_next``.
     """
@@ -31,11 +37,13 @@ def velocity_verlet(z, r, potential_fn, inverse_mass_matrix, step_size, num_step
                                                                         potential_fn,
                                                                         inverse_mass_matrix,
                                                                         step_size,
-                                                                        z_grads)
+                                                                        z_grads,
+                                                                        kinetic_grad)
     return z_next, r_next, z_grads, potential_energy
 
 
-def _single_step_verlet(z, r, potential_fn, inverse_mass_matrix, step_size, z_grads=None):
+def _single_step_verlet(z, r, potential_fn, inverse_mass_matrix, step_size, z_grads=None,
+                        kinetic_grad=None):
     r"""
     Single step velocity verlet that modifies the `z`, `r` dicts in place.
     """
@@ -43,19 +51,79 @@ def _single_step_verlet(z, r, potential_fn, inverse_mass_matrix, step_size, z_gr
     z_grads = potential_grad(potential_fn, z)[0] if z_grads is None else z_grads
 
     for site_name in r:
-        r[site_name] = r[site_name] + 0.5 * step_size * (-z_grads[site_name])  # r(n+1/2)
+        step = _expand_step_size(step_size, r[site_name])
+        r[site_name] = r[site_name] + 0.5 * step * (-z_grads[site_name])  # r(n+1/2)
 
-    r_grads = _kinetic_grad(inverse_mass_matrix, r)
+    if kinetic_grad is None:
+        r_grads = _kinetic_grad(inverse_mass_matrix, r)
+    else:
+        r_grads = kinetic_grad(r)
     for site_name in z:
-        z[site_name] = z[site_name] + step_size * r_grads[site_name]  # z(n+1)
+        step = _expand_step_size(step_size, z[site_name])
+        z[site_name] = z[site_name] + step * r_grads[site_name]  # z(n+1)
 
     z_grads, potential_energy = potential_grad(potential_fn, z)
     for site_name in r:
-        r[site_name] = r[site_name] + 0.5 * step_size * (-z_grads[site_name])  # r(n+1)
+        step = _expand_step_size(step_size, r[site_name])
+        r[site_name] = r[site_name] + 0.5 * step * (-z_grads[site_name])  # r(n+1)
+
+    return z, r, z_grads, potential_energy
 
+
+def velocity_verlet_packed(z, r, potential_fn, inverse_mass_matrix, step_size, num_steps=1, z_grads=None,
+                           kinetic_grad=None, potential_energy=None):
+    r"""
+    Same as :func:`velocity_verlet`, but works in place on packed positions and
+    momenta, i.e. the values of all sample sites are flattened and concatenated
+    into a single 1D tensor. This avoids allocating new dictionaries of tensors
+    at each time step.
+
+    :param torch.Tensor z: packed current values of sample sites. This is
+        updated in place.
+    :param torch.Tensor r: packed momenta of sample sites. This is updated in place.
+    :param callable potential_fn: function that returns potential energy given
+        packed ``z``.
+    :param torch.Tensor inverse_mass_matrix: a tensor :math:`M^{-1}` which is used
+        to calculate kinetic energy: :math:`E_{kinetic} = \frac{1}{2}z^T M^{-1} z`.
+        Here :math:`M` can be a 1D tensor (diagonal matrix) or a 2D tensor (dense matrix).
+    :param float step_size: step size for each time step iteration.
+    :param int num_steps: number of discrete time steps over which to integrate.
+    :param torch.Tensor z_grads: optional gradients of potential energy at current ``z``.
+        This is updated in place.
+    :param callable kinetic_grad: optional function that takes in packed momenta ``r``
+        and returns the gradient of kinetic energy w.r.t. ``r``. This overrides the
+        default computation using ``inverse_mass_matrix``.
+    :param torch.Tensor potential_energy: optional potential energy at current ``z``,
+        returned if ``num_steps=0``. This is computed if not given.
+    :return tuple (z, r, z_grads, potential_energy): next position and momenta,
+        together with the potential energy and its gradient w.r.t. ``z``.
+    """
+    if z_grads is None:
+        z_grads, potential_energy = potential_grad_packed(potential_fn, z)
+    elif potential_energy is None and num_steps == 0:
+        with torch.no_grad():
+            potential_energy = potential_fn(z)
+    for _ in range(num_steps):
+        r.add_(z_grads, alpha=-0.5 * step_size)  # r(n+1/2)
+        if kinetic_grad is not None:
+            z.add_(kinetic_grad(r), alpha=step_size)  # z(n+1)
+        elif inverse_mass_matrix.dim() == 1:
+            z.addcmul_(inverse_mass_matrix, r, value=step_size)
+        else:
+            z.add_(inverse_mass_matrix.matmul(r), alpha=step_size)
+        new_z_grads, potential_energy = potential_grad_packed(potential_fn, z)
+        z_grads.copy_(new_z_grads)
+        r.add_(z_grads, alpha=-0.5 * step_size)  # r(n+1)
     return z, r, z_grads, potential_energy
 
 
+def _expand_step_size(step_size, value):
+    # broadcast a batch of per-chain step sizes over the rightmost dims of `value`
+    if torch.is_tensor(step_size) and step_size.dim():
+        return step_size.reshape(step_size.shape + (1,) * (value.dim() - step_size.dim()))
+    return step_size
+
+
 def potential_grad(potential_fn, z):
     """
     Gradient of `potential_fn` w.r.t. parameters z.
@@ -65,7 +133,8 @@ def potential_grad(potential_fn, z):
     :param dict z: dictionary of parameter values keyed by site name.
     :return: tuple of `(z_grads, potential_energy)`, where `z_grads` is a dictionary
         with the same keys as `z` containing gradients and potential_energy is a
-        torch scalar.
+        torch scalar. If `potential_fn` returns a batch of potential energies for
+        independent chains, the gradient of each chain's energy is returned.
     """
     z_keys, z_nodes = zip(*z.items())
     for node in z_nodes:
@@ -80,7 +149,8 @@ def potential_grad(potential_fn, z):
         else:
             raise e
 
-    grads = grad(potential_energy, z_nodes)
+    # chains are independent, so the gradient of the sum gives per-chain gradients
+    grads = grad(potential_energy.sum(), z_nodes)
     for node in z_nodes:
         node.requires_grad_(False)
     return dict(zip(z_keys, grads)), potential_energy.detach()
@@ -104,3 +174,30 @@ def _kinetic_grad(inverse_mass_matrix, r):
         pos = next_pos
     assert pos == grads_flat.size(0)
     return grads
+
+
+def potential_grad_packed(potential_fn, z):
+    """
+    Same as :func:`potential_grad`, but for a potential function which takes
+    in packed parameters ``z`` (a 1D tensor), so that the gradient w.r.t. all
+    parameters is computed as a single tensor.
+
+    :param potential_fn: python callable that takes in packed parameters and
+        returns the potential energy.
+    :param torch.Tensor z: packed parameter values.
+    :return: tuple of `(z_grads, potential_energy)`.
+    """
+    z.requires_grad_(True)
+    try:
+        potential_energy = potential_fn(z)
+    # deal with singular matrices
+    except RuntimeError as e:
+        z.requires_grad_(False)
+        if "singular U" in str(e):
+            return torch.zeros_like(z), z.new_tensor(float('nan'))
+        else:
+            raise e
+
+    z_grads, = grad(potential_energy, (z,))
+    z.requires_grad_(False)
+    return z_grads, potential_energy.detach()
@@ -1,11 +1,14 @@
+import itertools
 import weakref
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 
+import opt_einsum
 import torch
 
 from pyro.ops.einsum import contract
 from pyro.ops.einsum.adjoint import SAMPLE_SYMBOL, Backward
-from pyro.util import ignore_jit_warnings
+from pyro.util import ignore_jit_warnings, jit_iter
 
 
 class Ring(object, metaclass=ABCMeta):
@@ -80,6 +83,80 @@ class Ring(object, metaclass=ABCMeta):
                 term._pyro_dims = dims
         return term
 
+    def markov_product(self, term, dim, prev_dims, curr_dims):
+        """
+        Product-contract the given ``term`` along a markov plate dimension
+        ``dim``, where slice ``t`` of ``term`` is a factor between a previous
+        state ``prev_dims`` and a current state ``curr_dims``, and the current
+        state of slice ``t`` is the previous state of slice ``t + 1``. All
+        intermediate states are sum-contracted out.
+
+        This is computed by a parallel scan whose depth is logarithmic in the
+        size of ``dim``, pairwise contracting neighboring slices at each level.
+
+        :param torch.Tensor term: the term to contract
+        :param str dim: a markov plate dim
+        :param str prev_dims: a string of previous state dims
+        :param str curr_dims: a string of current state dims, aligned with
+            ``prev_dims``
+        :return: a term relating the previous state of the first slice to the
+            current state of the last slice
+        :rtype: torch.Tensor
+        """
+        assert len(prev_dims) == len(curr_dims)
+        key = 'markov_product', self._hash_by_id(term), dim, prev_dims, curr_dims
+        if key in self._cache:
+            return self._cache[key]
+
+        # Allocate temporary dims for states shared by neighboring slices.
+        used = set(term._pyro_dims).union(self._dim_to_size)
+        mid_dims = ''.join(itertools.islice((symbol for symbol in map(opt_einsum.get_symbol, itertools.count())
+                                             if symbol not in used), len(curr_dims)))
+        renames = (dict(zip(curr_dims, mid_dims)), dict(zip(prev_dims, mid_dims)))
+
+        backward = getattr(term, '_pyro_backward', None)
+        result = self.broadcast(term, frozenset(dim))
+        if backward is not None:
+            result._pyro_backward = backward
+        while True:
+            dims = result._pyro_dims
+            pos = dims.index(dim)
+            size = result.size(pos)
+            if size == 1:
+                break
+
+            # Split into even slices, odd slices, and an optional tail slice.
+            half = size // 2
+            prefix = (slice(None),) * pos
+            parts = [result[prefix + (slice(0, 2 * half, 2),)],
+                     result[prefix + (slice(1, 2 * half, 2),)]]
+            if size % 2:
+                parts.append(result[prefix + (slice(2 * half, None),)])
+            for part, rename in itertools.zip_longest(parts, renames, fillvalue={}):
+                part._pyro_dims = ''.join(rename.get(d, d) for d in dims)
+            if backward is not None:
+                _MarkovSplit(result, parts, dim, renames)
+
+            # Contract each even slice with its following odd slice.
+            x, y = parts[:2]
+            result = self.sumproduct([x, y], mid_dims)
+            assert sorted(result._pyro_dims) == sorted(dims)
+            if size % 2:
+                tail = parts[2]
+                head = result
+                result = torch.cat([head, tail.permute(tuple(map(dims.index, head._pyro_dims)))],
+                                   dim=head._pyro_dims.index(dim))
+                result._pyro_dims = head._pyro_dims
+                if backward is not None:
+                    result._pyro_backward = _MarkovCatBackward(head, tail, dim)
+
+        term = result.squeeze(pos)
+        term._pyro_dims = dims.replace(dim, '')
+        if backward is not None:
+            term._pyro_backward = result._pyro_backward
+        self._cache[key] = term
+        return term
+
     @abstractmethod
     def inv(self, term):
         """
@@ -219,6 +296,106 @@ class LogRing(Ring):
         return result
 
 
+class _MarkovSplit(object):
+    """
+    Backward-sample implementation of the slicing in
+    :meth:`Ring.markov_product`. This collects messages from the even, odd and
+    tail slices of a term, then interleaves them into a single message.
+
+    This is agnostic to sampler implementation, and hence can be used both by
+    :class:`MapRing` and :class:`SampleRing`.
+    """
+    def __init__(self, term, parts, dim, renames):
+        self.backward = term._pyro_backward
+        self.dim = dim
+        self.renames = [{v: k for k, v in rename.items()} for rename in renames] + [{}]
+        self.sizes = [part.size(part._pyro_dims.index(dim)) for part in parts]
+        self.messages = {}
+        for i, part in enumerate(parts):
+            part._pyro_backward = _MarkovPartBackward(self, i)
+
+    def collect(self, i, message):
+        self.messages[i] = message
+        if len(self.messages) < len(self.sizes):
+            return
+        messages = [self.messages.pop(i) for i in range(len(self.sizes))]
+        yield self.backward, self._interleave(messages)
+
+    def _interleave(self, messages):
+        if all(message is None for message in messages):
+            return None
+
+        # Rename the state dims of each message back to those of the term.
+        samples = []
+        sizes = {}
+        for message, rename in zip(messages, self.renames):
+            sample = OrderedDict()
+            if message is not None:
+                for dim, index in zip(message._pyro_sample_dims, jit_iter(message)):
+                    index._pyro_dims = message._pyro_dims[1:]
+                    sample[rename.get(dim, dim)] = index
+                    sizes.update(zip(index._pyro_dims, index.shape))
+            samples.append(sample)
+        sample_dims = ''.join(samples[0])
+        assert all(set(sample) == set(sample_dims) for sample in samples)
+
+        # Interleave the even and odd slices, then append the tail slice.
+        sizes.pop(self.dim, None)
+        batch_dims = ''.join(sorted(set(sizes).union(self.dim)))
+        pos = batch_dims.index(self.dim)
+        result = []
+        for dim in sample_dims:
+            parts = []
+            for sample, size in zip(samples, self.sizes):
+                index = sample[dim]
+                index_dims = index._pyro_dims
+                shape = tuple(size if d == self.dim else sizes[d] for d in batch_dims)
+                index = index.permute(tuple(index_dims.index(d) for d in batch_dims if d in index_dims))
+                index = index.reshape(tuple(s if d in index_dims else 1 for d, s in zip(batch_dims, shape)))
+                parts.append(index.expand(shape))
+            even_odd = torch.stack(parts[:2], pos + 1)
+            shape = even_odd.shape[:pos] + (-1,) + even_odd.shape[pos + 2:]
+            result.append(torch.cat([even_odd.reshape(shape)] + parts[2:], pos))
+        result = torch.stack(result)
+        result._pyro_dims = SAMPLE_SYMBOL + batch_dims
+        result._pyro_sample_dims = sample_dims
+        assert result.dim() == len(result._pyro_dims)
+        return result
+
+
+class _MarkovPartBackward(Backward):
+    def __init__(self, split, i):
+        self.split = split
+        self.i = i
+
+    def process(self, message):
+        return self.split.collect(self.i, message)
+
+
+class _MarkovCatBackward(Backward):
+    """
+    Backward-sample implementation of concatenating a tail slice in
+    :meth:`Ring.markov_product`.
+    """
+    def __init__(self, head, tail, dim):
+        self.head = head
+        self.tail = tail
+        self.dim = dim
+
+    def process(self, message):
+        if message is None or self.dim not in message._pyro_dims:
+            yield self.head._pyro_backward, message
+            yield self.tail._pyro_backward, message
+            return
+        pos = message._pyro_dims.index(self.dim)
+        size = self.head.size(self.head._pyro_dims.index(self.dim))
+        for part, start, length in [(self.head, 0, size), (self.tail, size, 1)]:
+            part_message = message.narrow(pos, start, length)
+            part_message._pyro_dims = message._pyro_dims
+            part_message._pyro_sample_dims = message._pyro_sample_dims
+            yield part._pyro_backward, part_message
+
+
 class _SampleProductBackward(Backward):
     """
     Backward-sample implementation of product.
@@ -305,6 +482,11 @@ class MarginalRing(LogRing):
     """
     _backend = 'pyro.ops.einsum.torch_marginal'
 
+    def markov_product(self, term, dim, prev_dims, curr_dims):
+        if hasattr(term, '_pyro_backward'):
+            raise NotImplementedError('MarginalRing does not support backward passes through markov plates')
+        return super(MarginalRing, self).markov_product(term, dim, prev_dims, curr_dims)
+
     def product(self, term, ordinal):
         result = super(MarginalRing, self).product(term, ordinal)
         if hasattr(term, '_pyro_backward'):
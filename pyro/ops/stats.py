@@ -22,6 +22,21 @@ def _compute_chain_variance_stats(input):
     return var_within, var_estimator
 
 
+def _batched(fn, input, chain_dim, sample_dim, batch_size):
+    # apply the diagnostic `fn` to the flattened remaining (sample_shape) dimensions
+    # of `input`, `batch_size` elements at a time
+    sample_dim = input.dim() + sample_dim if sample_dim < 0 else sample_dim
+    chain_dim = input.dim() + chain_dim if chain_dim < 0 else chain_dim
+    assert chain_dim != sample_dim
+    other_dims = [d for d in range(input.dim()) if d not in (chain_dim, sample_dim)]
+    input = input.permute([chain_dim, sample_dim] + other_dims)
+    sample_shape = input.shape[2:]
+    input = input.reshape(input.shape[:2] + (-1,))
+    result = [fn(input[..., i:i + batch_size], chain_dim=0, sample_dim=1)
+              for i in range(0, input.size(-1), batch_size)]
+    return torch.cat(result).reshape(sample_shape)
+
+
 def gelman_rubin(input, chain_dim=0, sample_dim=1):
     """
     Computes R-hat over chains of samples. It is required that
@@ -48,7 +63,7 @@ def gelman_rubin(input, chain_dim=0, sample_dim=1):
     return rhat.squeeze(max(sample_dim, chain_dim)).squeeze(min(sample_dim, chain_dim))
 
 
-def split_gelman_rubin(input, chain_dim=0, sample_dim=1):
+def split_gelman_rubin(input, chain_dim=0, sample_dim=1, batch_size=None):
     """
     Computes R-hat over chains of samples. It is required that
     ``input.size(sample_dim) >= 4``.
@@ -56,8 +71,12 @@ def split_gelman_rubin(input, chain_dim=0, sample_dim=1):
     :param torch.Tensor input: the input tensor.
     :param int chain_dim: the chain dimension.
     :param int sample_dim: the sample dimension.
+    :param int batch_size: if not `None`, the remaining dimensions of ``input``
+        are flattened, and R-hat is computed for ``batch_size`` elements at a time.
     :returns torch.Tensor: split R-hat of ``input``.
     """
+    if batch_size is not None:
+        return _batched(split_gelman_rubin, input, chain_dim, sample_dim, batch_size)
     assert input.dim() >= 2
     assert input.size(sample_dim) >= 4
     # change input.shape to 1 x 1 x input.shape
@@ -154,17 +173,18 @@ def _cummin(input):
     :param torch.Tensor input: the input tensor.
     :returns torch.Tensor: accumulate min of `input` at dimension `dim=0`.
     """
-    # FIXME: is there a better trick to find accumulate min of a sequence?
+    # Hillis-Steele scan: log2(N) steps, each taking the min with a shifted copy,
+    # so that memory stays linear in N (rather than N x N).
+    result = input.clone()
     N = input.size(0)
-    input_tril = input.unsqueeze(0).repeat((N,) + (1,) * input.dim())
-    triu_mask = (torch.ones(N, N, dtype=input.dtype, device=input.device)
-                 .triu(diagonal=1).reshape((N, N) + (1,) * (input.dim() - 1)))
-    triu_mask = triu_mask.expand((N, N) + input.shape[1:]) > 0.5
-    input_tril.masked_fill_(triu_mask, input.max())
-    return input_tril.min(dim=1)[0]
+    shift = 1
+    while shift < N:
+        result[shift:] = torch.min(result[shift:], result[:-shift])
+        shift *= 2
+    return result
 
 
-def effective_sample_size(input, chain_dim=0, sample_dim=1):
+def effective_sample_size(input, chain_dim=0, sample_dim=1, batch_size=None):
     """
     Computes effective sample size of input.
 
@@ -179,8 +199,14 @@ def effective_sample_size(input, chain_dim=0, sample_dim=1):
     :param torch.Tensor input: the input tensor.
     :param int chain_dim: the chain dimension.
     :param int sample_dim: the sample dimension.
+    :param int batch_size: if not `None`, the remaining dimensions of ``input``
+        are flattened, and effective sample size is computed for ``batch_size``
+        elements at a time. This bounds the size of the intermediate FFT buffers,
+        and only reads a slice of ``input`` at a time, e.g. when it is memory-mapped.
     :returns torch.Tensor: effective sample size of ``input``.
     """
+    if batch_size is not None:
+        return _batched(effective_sample_size, input, chain_dim, sample_dim, batch_size)
     assert input.dim() >= 2
     assert input.size(sample_dim) >= 2
     # change input.shape to 1 x 1 x input.shape
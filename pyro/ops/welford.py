@@ -1,10 +1,9 @@
-import torch
-
-
 class WelfordCovariance(object):
     """
     Implements Welford's online scheme for estimating (co)variance (see :math:`[1]`).
-    Useful for adapting diagonal and dense mass structures for HMC.
+    Useful for adapting diagonal and dense mass structures for HMC. Samples may
+    have leading batch dimensions, in which case an independent (co)variance is
+    estimated for each batch element.
 
     **References**
 
@@ -29,7 +28,7 @@ class WelfordCovariance(object):
         if self.diagonal:
             self._m2 += delta_pre * delta_post
         else:
-            self._m2 += torch.ger(delta_post, delta_pre)
+            self._m2 += delta_post.unsqueeze(-1) * delta_pre.unsqueeze(-2)
 
     def get_covariance(self, regularize=True):
         if self.n_samples < 2:
@@ -42,6 +41,6 @@ class WelfordCovariance(object):
             if self.diagonal:
                 cov = scaled_cov + shrinkage
             else:
-                scaled_cov.view(-1)[::scaled_cov.size(0) + 1] += shrinkage
+                scaled_cov.diagonal(dim1=-2, dim2=-1).add_(shrinkage)
                 cov = scaled_cov
         return cov
@@ -1,3 +1,6 @@
+import torch
+from torch.nn.functional import one_hot
+
 from pyro.distributions.torch_distribution import TorchDistributionMixin
 from pyro.util import ignore_jit_warnings
 
@@ -5,10 +8,52 @@ from .messenger import Messenger
 from .runtime import _ENUM_ALLOCATOR
 
 
+def truncate_support(dist, topk=None, mass=None):
+    """
+    Truncates the support of a categorical distribution to its ``topk`` most
+    probable values, optionally further truncating to the fewest values that
+    cover probability ``mass`` in every batch element. The distribution is
+    renormalized to the truncated support, so that enumerating over the
+    truncated support is exact for the truncated distribution.
+
+    :param dist: a :class:`~pyro.distributions.Categorical` or
+        :class:`~pyro.distributions.OneHotCategorical` distribution.
+    :param int topk: an optional maximum number of values to keep.
+    :param float mass: an optional probability mass to cover.
+    :returns: a pair ``(value, dist)`` of the truncated support, with shape
+        ``(k,) + dist.batch_shape + dist.event_shape``, and the truncated
+        distribution.
+    :rtype: tuple
+    """
+    if not isinstance(dist, (torch.distributions.Categorical, torch.distributions.OneHotCategorical)):
+        raise NotImplementedError("Truncated enumeration is only implemented for Categorical and "
+                                  "OneHotCategorical distributions, but got {}".format(type(dist).__name__))
+    logits = dist.logits
+    size = logits.size(-1)
+    k = size if topk is None else min(topk, size)
+    if mass is not None:
+        sorted_probs = logits.detach().softmax(-1).sort(-1, descending=True)[0]
+        k = min(k, 1 + int((sorted_probs.cumsum(-1) < mass).sum(-1).max()))
+
+    index = logits.detach().topk(k, -1)[1]
+    keep = torch.zeros(logits.shape, dtype=torch.bool, device=logits.device).scatter_(-1, index, True)
+    dist = type(dist)(logits=logits.masked_fill(~keep, -float('inf')))
+    value = index.permute((-1,) + tuple(range(index.dim() - 1)))
+    if isinstance(dist, torch.distributions.OneHotCategorical):
+        value = one_hot(value, size).to(logits.dtype)
+    return value, dist
+
+
 def enumerate_site(msg):
     dist = msg["fn"]
     num_samples = msg["infer"].get("num_samples")
-    if num_samples is None:
+    topk = msg["infer"].get("topk")
+    topk_mass = msg["infer"].get("topk_mass")
+    if num_samples is None and (topk is not None or topk_mass is not None):
+        # Enumerate over a truncated support, always expanded to the batch shape.
+        value, dist = truncate_support(dist, topk, topk_mass)
+        msg["fn"] = dist
+    elif num_samples is None:
         # Enumerate over the support of the distribution.
         value = dist.enumerate_support(expand=msg["infer"].get("expand", False))
     else:
@@ -1,6 +1,6 @@
 from functools import partial
 
-from .runtime import _PYRO_STACK
+from .runtime import _PYRO_STACK, _clear_dispatch_tables
 
 
 def _context_wrap(context, fn, *args, **kwargs):
@@ -59,6 +59,7 @@ class Messenger(object):
             # if this poutine is not already installed,
             # put it on the bottom of the stack.
             _PYRO_STACK.append(self)
+            _clear_dispatch_tables()
 
             # necessary to return self because the return value of __enter__
             # is bound to VAR in with EXPR as VAR.
@@ -103,6 +104,7 @@ class Messenger(object):
             # if not, raise a ValueError because something really weird happened.
             if _PYRO_STACK[-1] == self:
                 _PYRO_STACK.pop()
+                _clear_dispatch_tables()
             else:
                 # should never get here, but just in case...
                 raise ValueError("This Messenger is not on the bottom of the stack")
@@ -115,6 +117,7 @@ class Messenger(object):
                 loc = _PYRO_STACK.index(self)
                 for i in range(loc, len(_PYRO_STACK)):
                     _PYRO_STACK.pop()
+                _clear_dispatch_tables()
 
     def _reset(self):
         pass
@@ -138,6 +141,24 @@ class Messenger(object):
             return getattr(self, method_name)(msg)
         return None
 
+    def _get_handler(self, msg_type, post=False):
+        """
+        :param str msg_type: the message type, e.g. `"sample"`
+        :param bool post: whether to get the postprocessing handler
+        :returns: the method of this messenger which handles messages of type
+            ``msg_type``, or ``None`` if it leaves them unchanged.
+
+        Used by :func:`~pyro.poutine.runtime.apply_stack` to skip messengers
+        which do not handle a message type.
+        """
+        if post:
+            if type(self)._postprocess_message is not Messenger._postprocess_message:
+                return self._postprocess_message
+            return getattr(self, "_pyro_post_" + msg_type, None)
+        if type(self)._process_message is not Messenger._process_message:
+            return self._process_message
+        return getattr(self, "_pyro_" + msg_type, None)
+
     @classmethod
     def register(cls, fn=None, type=None, post=None):
         """
@@ -164,6 +185,7 @@ class Messenger(object):
             raise ValueError("An operation type name must be provided")
 
         setattr(cls, "_pyro_" + ("post_" if post else "") + type, staticmethod(fn))
+        _clear_dispatch_tables()
         return fn
 
     @classmethod
@@ -193,4 +215,5 @@ class Messenger(object):
         except AttributeError:
             pass
 
+        _clear_dispatch_tables()
         return fn
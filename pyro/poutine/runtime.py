@@ -5,6 +5,9 @@ from pyro.params.param_store import _MODULE_NAMESPACE_DIVIDER, ParamStoreDict  #
 # the global pyro stack
 _PYRO_STACK = []
 
+# cached dispatch tables of the global pyro stack, keyed by message type
+_DISPATCH_TABLES = {}
+
 # the global ParamStore
 _PYRO_PARAM_STORE = ParamStoreDict()
 
@@ -142,6 +145,59 @@ class NonlocalExit(Exception):
                 break
 
 
+class Message(object):
+    """
+    Lightweight message passed through the effect stack at a sample site, which
+    supports the same item access as the plain ``dict`` messages of other sites,
+    while avoiding the construction of a dict with all the message fields.
+    """
+    __slots__ = ("type", "name", "fn", "is_observed", "args", "kwargs", "value", "infer",
+                 "scale", "mask", "cond_indep_stack", "done", "stop", "continuation")
+
+    def __init__(self, type, name, fn, args, kwargs, value=None, is_observed=False, infer=None):
+        self.type = type
+        self.name = name
+        self.fn = fn
+        self.is_observed = is_observed
+        self.args = args
+        self.kwargs = kwargs
+        self.value = value
+        self.infer = {} if infer is None else infer
+        self.scale = 1.0
+        self.mask = None
+        self.cond_indep_stack = ()
+        self.done = False
+        self.stop = False
+        self.continuation = None
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def copy(self):
+        """
+        :returns: a ``dict`` holding the fields of this message.
+        """
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
 def default_process_message(msg):
     """
     Default method for processing messages in inference.
@@ -159,6 +215,42 @@ def default_process_message(msg):
     msg["done"] = True
 
 
+def _clear_dispatch_tables():
+    """
+    Invalidates the cached dispatch tables of the global pyro stack. This must be
+    called whenever ``_PYRO_STACK`` is modified, or the message handlers of a
+    Messenger class are changed.
+    """
+    _DISPATCH_TABLES.clear()
+
+
+def _get_dispatch_table(msg_type):
+    """
+    Gets the frames of the global pyro stack which handle messages of type
+    ``msg_type``, skipping frames which would ignore them.
+
+    :param str msg_type: the message type, e.g. `"sample"`.
+    :returns: a pair of lists ``(process, postprocess)`` of ``(pointer, handler)``
+        pairs, where ``pointer`` is the position of the frame from the top of the
+        stack as counted by :func:`apply_stack`. ``process`` is ordered from the
+        top of the stack to the bottom, and ``postprocess`` from the bottom to the top.
+    """
+    table = _DISPATCH_TABLES.get(msg_type)
+    if table is None:
+        num_frames = len(_PYRO_STACK)
+        process, postprocess = [], []
+        for i, frame in enumerate(_PYRO_STACK):
+            handler = frame._get_handler(msg_type)
+            if handler is not None:
+                process.append((num_frames - i, handler))
+            handler = frame._get_handler(msg_type, post=True)
+            if handler is not None:
+                postprocess.append((num_frames - i, handler))
+        process.reverse()
+        table = _DISPATCH_TABLES[msg_type] = process, postprocess
+    return table
+
+
 def apply_stack(initial_msg):
     """
     Execute the effect stack at a single site according to the following scheme:
@@ -181,21 +273,30 @@ def apply_stack(initial_msg):
     # msg is used to pass information up and down the stack
     msg = initial_msg
 
-    pointer = 0
-    # go until time to stop?
-    for frame in reversed(stack):
-
-        pointer = pointer + 1
-
+    if msg["stop"] and stack:
+        # only the top frame is applied
+        frame = stack[-1]
         frame._process_message(msg)
+        default_process_message(msg)
+        frame._postprocess_message(msg)
+    else:
+        # frames which do not handle this message type are skipped,
+        # since they leave the message unchanged
+        process, postprocess = _get_dispatch_table(msg["type"])
+
+        pointer = len(stack)
+        # go until time to stop?
+        for frame_pointer, handler in process:
+            handler(msg)
+            if msg["stop"]:
+                pointer = frame_pointer
+                break
 
-        if msg["stop"]:
-            break
-
-    default_process_message(msg)
+        default_process_message(msg)
 
-    for frame in stack[-pointer:]:
-        frame._postprocess_message(msg)
+        for frame_pointer, handler in postprocess:
+            if frame_pointer <= pointer:
+                handler(msg)
 
     cont = msg["continuation"]
     if cont is not None:
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
 
 from pyro.distributions.distribution import Distribution
@@ -15,7 +17,7 @@ class _Subsample(Distribution):
     Internal use only. This should only be used by `plate`.
     """
 
-    def __init__(self, size, subsample_size, use_cuda=None, device=None):
+    def __init__(self, size, subsample_size, use_cuda=None, device=None, subsampler=None):
         """
         :param int size: the size of the range to subsample from
         :param int subsample_size: the size of the returned subsample
@@ -23,9 +25,12 @@ class _Subsample(Distribution):
             Whether to use cuda tensors.
         :param str device: device to place the `sample` and `log_prob`
             results on.
+        :param Subsampler subsampler: an optional stateful subsampler to draw
+            the subsample from.
         """
         self.size = size
         self.subsample_size = subsample_size
+        self.subsampler = subsampler
         self.use_cuda = use_cuda
         if self.use_cuda is not None:
             if self.use_cuda ^ (device != "cpu"):
@@ -43,7 +48,9 @@ class _Subsample(Distribution):
         if sample_shape:
             raise NotImplementedError
         subsample_size = self.subsample_size
-        if subsample_size is None or subsample_size >= self.size:
+        if self.subsampler is not None:
+            result = self.subsampler.sample().to(self.device)
+        elif subsample_size is None or subsample_size >= self.size:
             result = jit_compatible_arange(self.size, device=self.device)
         else:
             result = torch.multinomial(torch.ones(self.size), self.subsample_size,
@@ -57,6 +64,200 @@ class _Subsample(Distribution):
         return result.cuda() if self.use_cuda else result
 
 
+class Subsampler(object):
+    """
+    Abstract base class for stateful subsampling schemes, which can be passed
+    as the ``subsample`` argument of :class:`~pyro.plate` to draw a new
+    subsample each time the plate is entered. The same instance should be
+    passed to the plate in both the model and the guide.
+
+    Derived classes implement :meth:`_sample` to draw a subsample of indices,
+    and may override :meth:`scale` to return non-uniform per-element scales
+    under which the scaled sum over the subsample is an unbiased estimate of
+    the sum over the full plate.
+
+    :param int size: the size of the range to subsample from.
+    :param int subsample_size: the size of each subsample.
+    :param dataset: an optional dataset supporting indexing by a
+        :class:`torch.LongTensor` of indices, e.g. a :class:`torch.Tensor`.
+        If given, the rows of each subsample are gathered into
+        :attr:`data`.
+    :param bool prefetch: whether to draw the indices of the next subsample
+        as soon as the current one is drawn, and to gather its rows of
+        ``dataset`` in a background thread. Defaults to False.
+    """
+    def __init__(self, size, subsample_size, dataset=None, prefetch=False):
+        if not (isinstance(subsample_size, int) and subsample_size > 0):
+            raise ValueError("Expected subsample_size to be a positive integer, but got {}"
+                             .format(repr(subsample_size)))
+        self.size = size
+        self.subsample_size = subsample_size
+        self.dataset = dataset
+        self.prefetch = prefetch
+        self.indices = None
+        self.data = None
+        self._next = None
+        self._executor = None
+
+    def _sample(self):
+        """
+        :returns: a new subsample of ``range(self.size)``
+        :rtype: torch.LongTensor
+        """
+        raise NotImplementedError
+
+    def scale(self, indices):
+        """
+        :param torch.LongTensor indices: a subsample drawn by this subsampler.
+        :returns: the scale of each element of the subsample, either as a
+            number or as a tensor of the same shape as ``indices``.
+        """
+        return self.size / len(indices)
+
+    def _gather(self, indices):
+        return None if self.dataset is None else self.dataset[indices]
+
+    def sample(self):
+        """
+        Draws a subsample, updating :attr:`indices` and :attr:`data`.
+
+        :returns: a subsample of ``range(self.size)``
+        :rtype: torch.LongTensor
+        """
+        if self._next is None:
+            indices = self._sample()
+            data = self._gather(indices)
+        else:
+            indices, data = self._next
+            data = data.result()
+            self._next = None
+        if self.prefetch:
+            # Indices are drawn here rather than in the background, to keep the RNG state deterministic.
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            next_indices = self._sample()
+            self._next = next_indices, self._executor.submit(self._gather, next_indices)
+        self.indices, self.data = indices, data
+        return indices
+
+
+class ShuffledSubsampler(Subsampler):
+    """
+    Draws consecutive slices of a random permutation of ``range(size)``, and
+    reshuffles after each pass over the permutation, so that each epoch visits
+    every index once and each subsample costs ``O(subsample_size)``
+    (amortized). Subsamples that straddle two epochs may contain duplicates.
+
+    :param int size: the size of the range to subsample from.
+    :param int subsample_size: the size of each subsample.
+    :param dataset: see :class:`Subsampler`.
+    :param bool prefetch: see :class:`Subsampler`.
+    """
+    def __init__(self, size, subsample_size, dataset=None, prefetch=False):
+        super(ShuffledSubsampler, self).__init__(size, subsample_size, dataset, prefetch)
+        self._perm = torch.randperm(size)
+        self._pos = 0
+
+    def _sample(self):
+        parts = []
+        remaining = self.subsample_size
+        while remaining:
+            if self._pos == self.size:
+                self._perm = torch.randperm(self.size)
+                self._pos = 0
+            part = self._perm[self._pos:self._pos + remaining]
+            self._pos += len(part)
+            remaining -= len(part)
+            parts.append(part)
+        return parts[0] if len(parts) == 1 else torch.cat(parts)
+
+
+class StratifiedSubsampler(Subsampler):
+    """
+    Draws a fixed number of indices from each stratum of ``range(size)``,
+    each stratum using its own :class:`ShuffledSubsampler`, and scales each
+    element by the size of its stratum divided by the number of indices drawn
+    from that stratum.
+
+    :param torch.LongTensor strata: a tensor of shape ``(size,)`` labeling
+        each index by its stratum in ``range(num_strata)``.
+    :param subsample_size: either the total number of indices per subsample,
+        which is split among strata in proportion to their sizes (with at
+        least one index per stratum), or a sequence of the number of indices
+        per stratum.
+    :type subsample_size: int or list
+    :param dataset: see :class:`Subsampler`.
+    :param bool prefetch: see :class:`Subsampler`.
+    """
+    def __init__(self, strata, subsample_size, dataset=None, prefetch=False):
+        strata = torch.as_tensor(strata, dtype=torch.long)
+        counts = torch.bincount(strata)
+        if (counts == 0).any():
+            raise ValueError("Expected every stratum in range(strata.max() + 1) to be nonempty")
+        if isinstance(subsample_size, int):
+            if subsample_size < len(counts):
+                raise ValueError("Expected subsample_size to be at least the number of strata {}, but got {}"
+                                 .format(len(counts), subsample_size))
+            sizes = (counts.double() * (subsample_size - len(counts)) / len(strata)).floor().long() + 1
+            remainder = counts.double() * (subsample_size - len(counts)) / len(strata) + 1 - sizes.double()
+            sizes[remainder.argsort(descending=True)[:subsample_size - int(sizes.sum())]] += 1
+        else:
+            sizes = torch.as_tensor(subsample_size, dtype=torch.long)
+            if sizes.shape != counts.shape or (sizes <= 0).any():
+                raise ValueError("Expected a positive subsample size for each of {} strata, but got {}"
+                                 .format(len(counts), subsample_size))
+        super(StratifiedSubsampler, self).__init__(len(strata), int(sizes.sum()), dataset, prefetch)
+        self.strata = strata
+        members = strata.argsort()
+        self._members = members.split(counts.tolist())
+        self._streams = [ShuffledSubsampler(int(n), int(k)) for n, k in zip(counts, sizes)]
+        self._stratum_scale = counts.double() / sizes.double()
+
+    def _sample(self):
+        return torch.cat([members[stream._sample()]
+                          for members, stream in zip(self._members, self._streams)])
+
+    def scale(self, indices):
+        return self._stratum_scale[self.strata[indices]].to(torch.get_default_dtype())
+
+
+class WeightedSubsampler(Subsampler):
+    """
+    Draws indices of ``range(size)`` with replacement, with probabilities
+    proportional to ``weights``, and scales each element by its inverse
+    probability divided by ``subsample_size`` (importance subsampling). Each
+    subsample costs ``O(subsample_size * log(size))``.
+
+    :param torch.Tensor weights: a tensor of shape ``(size,)`` of positive
+        weights.
+    :param int subsample_size: the size of each subsample.
+    :param dataset: see :class:`Subsampler`.
+    :param bool prefetch: see :class:`Subsampler`.
+    """
+    def __init__(self, weights, subsample_size, dataset=None, prefetch=False):
+        weights = torch.as_tensor(weights, dtype=torch.double)
+        if weights.dim() != 1 or not (weights > 0).all():
+            raise ValueError("Expected a 1-dimensional tensor of positive weights")
+        super(WeightedSubsampler, self).__init__(len(weights), subsample_size, dataset, prefetch)
+        self.probs = weights / weights.sum()
+        self._cdf = self.probs.cumsum(0)
+
+    def _sample(self):
+        # Invert the cdf by a vectorized bisection.
+        u = torch.rand(self.subsample_size, dtype=self._cdf.dtype) * self._cdf[-1]
+        lo = torch.zeros(self.subsample_size, dtype=torch.long)
+        hi = torch.full((self.subsample_size,), self.size - 1, dtype=torch.long)
+        while (lo < hi).any():
+            mid = (lo + hi) // 2
+            right = self._cdf[mid] < u
+            lo = torch.where(right, mid + 1, lo)
+            hi = torch.where(right, hi, mid)
+        return lo
+
+    def scale(self, indices):
+        return (1. / (len(indices) * self.probs[indices])).to(torch.get_default_dtype())
+
+
 class SubsampleMessenger(IndepMessenger):
     """
     Extension of IndepMessenger that includes subsampling.
@@ -64,6 +265,16 @@ class SubsampleMessenger(IndepMessenger):
 
     def __init__(self, name, size=None, subsample_size=None, subsample=None, dim=None,
                  use_cuda=None, device=None):
+        self._subsampler = None
+        if isinstance(subsample, Subsampler):
+            self._subsampler, subsample = subsample, None
+            if size is None:
+                size = self._subsampler.size
+            elif size != self._subsampler.size:
+                raise ValueError("size does not match subsampler.size, {} vs {}."
+                                 .format(size, self._subsampler.size))
+            if subsample_size is None:
+                subsample_size = self._subsampler.subsample_size
         super(SubsampleMessenger, self).__init__(name, size, dim, device)
         self.subsample_size = subsample_size
         self._indices = subsample
@@ -72,10 +283,14 @@ class SubsampleMessenger(IndepMessenger):
 
         self.size, self.subsample_size, self._indices = self._subsample(
             self.name, self.size, self.subsample_size,
-            self._indices, self.use_cuda, self.device)
+            self._indices, self.use_cuda, self.device, self._subsampler)
+        self._subsample_scale = None
+        if self._subsampler is not None:
+            self._subsample_scale = self._subsampler.scale(self._indices)
 
     @staticmethod
-    def _subsample(name, size=None, subsample_size=None, subsample=None, use_cuda=None, device=None):
+    def _subsample(name, size=None, subsample_size=None, subsample=None, use_cuda=None, device=None,
+                   subsampler=None):
         """
         Helper function for plate. See its docstrings for details.
         """
@@ -88,7 +303,7 @@ class SubsampleMessenger(IndepMessenger):
             msg = {
                 "type": "sample",
                 "name": name,
-                "fn": _Subsample(size, subsample_size, use_cuda, device),
+                "fn": _Subsample(size, subsample_size, use_cuda, device, subsampler),
                 "is_observed": False,
                 "args": (),
                 "kwargs": {},
@@ -126,7 +341,15 @@ class SubsampleMessenger(IndepMessenger):
             if not isinstance(msg["scale"], torch.Tensor):
                 with ignore_jit_warnings():
                     msg["scale"] = torch.tensor(msg["scale"])
-        msg["scale"] = msg["scale"] * self.size / self.subsample_size
+        if self._subsample_scale is None:
+            msg["scale"] = msg["scale"] * self.size / self.subsample_size
+        elif not isinstance(self._subsample_scale, torch.Tensor):
+            msg["scale"] = msg["scale"] * self._subsample_scale
+        elif self.dim is None:
+            msg["scale"] = msg["scale"] * self._subsample_scale[self.counter - 1]
+        else:
+            scale = self._subsample_scale.to(self.device) if self.device else self._subsample_scale
+            msg["scale"] = msg["scale"] * scale.reshape((-1,) + (1,) * (-1 - self.dim))
 
     def _postprocess_message(self, msg):
         if msg["type"] == "param" and self.dim is not None:
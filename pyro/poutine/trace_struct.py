@@ -1,14 +1,80 @@
 from collections import OrderedDict
+import numbers
 import sys
 
 import opt_einsum
+import torch
 
+from pyro.distributions.distribution import Distribution
 from pyro.distributions.score_parts import ScoreParts
 from pyro.distributions.util import scale_and_mask
 from pyro.ops.packed import pack
 from pyro.poutine.util import is_validation_enabled
 from pyro.util import warn_if_inf, warn_if_nan
 
+_MEMOIZED_LOG_PROB_KEYS = ("unscaled_log_prob", "log_prob", "log_prob_sum", "score_parts")
+
+
+def _tensor_versions(x, result):
+    """
+    Collects ``(tensor, tensor._version)`` pairs of the tensors in a site
+    attribute, including those held by distributions, so that in-place
+    changes made after memoizing ``log_prob`` terms can be detected.
+    """
+    if isinstance(x, torch.Tensor):
+        result.append((x, x._version))
+    elif isinstance(x, (torch.distributions.Distribution, Distribution)):
+        for value in vars(x).values():
+            _tensor_versions(value, result)
+    elif isinstance(x, (tuple, list)):
+        for value in x:
+            _tensor_versions(value, result)
+    elif isinstance(x, dict):
+        for value in x.values():
+            _tensor_versions(value, result)
+    return result
+
+
+def _site_versions(site):
+    result = []
+    for key in ("value", "fn", "scale", "mask", "args", "kwargs"):
+        _tensor_versions(site[key], result)
+    return result
+
+
+def _is_unchanged(x, y):
+    """
+    Conservatively checks whether two site attributes are equal. Tensors are
+    equal if they are the same object, or if they have equal values and
+    neither requires grad, so that reusing terms computed from ``y`` does not
+    sever gradients to ``x``. Distributions are compared by their attributes.
+    In-place changes are detected separately by :func:`_site_versions`.
+    """
+    if x is y:
+        return True
+    if isinstance(x, torch.Tensor):
+        return (isinstance(y, torch.Tensor) and
+                not x.requires_grad and not y.requires_grad and
+                x.dtype == y.dtype and x.shape == y.shape and
+                torch.equal(x, y))
+    if isinstance(x, (torch.distributions.Distribution, Distribution)):
+        if type(x) is not type(y):
+            return False
+        # Only compare attributes present in both, since lazily computed
+        # attributes are cached on first access.
+        x_attrs, y_attrs = vars(x), vars(y)
+        return all(_is_unchanged(value, y_attrs[key])
+                   for key, value in x_attrs.items() if key in y_attrs)
+    if isinstance(x, (tuple, list)):
+        return (type(x) is type(y) and len(x) == len(y) and
+                all(_is_unchanged(a, b) for a, b in zip(x, y)))
+    if isinstance(x, dict):
+        return (isinstance(y, dict) and x.keys() == y.keys() and
+                all(_is_unchanged(value, y[key]) for key, value in x.items()))
+    if isinstance(x, (numbers.Number, str, torch.Size, torch.device, torch.dtype, type(None))):
+        return type(x) is type(y) and x == y
+    return False
+
 
 class Trace(object):
     """
@@ -72,6 +138,7 @@ class Trace(object):
             "{} not a valid graph type".format(graph_type)
         self.graph_type = graph_type
         self.nodes = OrderedDict()
+        # adjacency sets are allocated lazily, only for sites with edges
         self._succ = OrderedDict()
         self._pred = OrderedDict()
 
@@ -110,45 +177,49 @@ class Trace(object):
 
         # XXX should copy in case site gets mutated, or dont bother?
         self.nodes[site_name] = kwargs
-        self._pred[site_name] = set()
-        self._succ[site_name] = set()
 
     def add_edge(self, site1, site2):
         for site in (site1, site2):
             if site not in self.nodes:
                 self.add_node(site)
-        self._succ[site1].add(site2)
-        self._pred[site2].add(site1)
+        self._succ.setdefault(site1, set()).add(site2)
+        self._pred.setdefault(site2, set()).add(site1)
 
     def remove_node(self, site_name):
         self.nodes.pop(site_name)
-        for p in self._pred[site_name]:
+        for p in self._pred.pop(site_name, ()):
             self._succ[p].remove(site_name)
-        for s in self._succ[site_name]:
+        for s in self._succ.pop(site_name, ()):
             self._pred[s].remove(site_name)
-        self._pred.pop(site_name)
-        self._succ.pop(site_name)
 
     def predecessors(self, site_name):
-        return self._pred[site_name]
+        if site_name not in self.nodes:
+            raise KeyError(site_name)
+        return self._pred.get(site_name, set())
 
     def successors(self, site_name):
-        return self._succ[site_name]
+        if site_name not in self.nodes:
+            raise KeyError(site_name)
+        return self._succ.get(site_name, set())
 
     def copy(self):
         """
         Makes a shallow copy of self with nodes and edges preserved.
+        Node metadata is shared with self, while the edges are copied,
+        so that a ``"flat"`` trace is copied in a single pass over its nodes.
         """
         new_tr = Trace(graph_type=self.graph_type)
         new_tr.nodes.update(self.nodes)
-        new_tr._succ.update(self._succ)
-        new_tr._pred.update(self._pred)
+        for site, adj_nodes in self._succ.items():
+            new_tr._succ[site] = adj_nodes.copy()
+        for site, adj_nodes in self._pred.items():
+            new_tr._pred[site] = adj_nodes.copy()
         return new_tr
 
     def _dfs(self, site, visited):
         if site in visited:
             return
-        for s in self._succ[site]:
+        for s in self._succ.get(site, ()):
             for node in self._dfs(s, visited):
                 yield node
         visited.add(site)
@@ -163,7 +234,7 @@ class Trace(object):
         """
         visited = set()
         top_sorted = []
-        for s in self._succ:
+        for s in self.nodes:
             for node in self._dfs(s, visited):
                 top_sorted.append(node)
         return top_sorted if reverse else list(reversed(top_sorted))
@@ -193,12 +264,56 @@ class Trace(object):
                                          .format(name, exc_value, shapes)).with_traceback(traceback)
                     log_p = scale_and_mask(log_p, site["scale"], site["mask"]).sum()
                     site["log_prob_sum"] = log_p
+                    site.setdefault("tensor_versions", _site_versions(site))
                     if is_validation_enabled():
                         warn_if_nan(log_p, "log_prob_sum at site '{}'".format(name))
                         warn_if_inf(log_p, "log_prob_sum at site '{}'".format(name), allow_neginf=True)
                 result = result + log_p
         return result
 
+    def reuse_log_prob(self, trace):
+        """
+        Copies memoized ``log_prob`` terms from an earlier ``trace`` of the
+        same program at each sample site whose value, distribution, scale and
+        mask are unchanged. Subsequent calls to :meth:`compute_log_prob`,
+        :meth:`compute_score_parts` or :meth:`log_prob_sum` then recompute
+        only the changed sites. Sites downstream of a changed site are
+        recomputed too, since their distributions change.
+
+        This is useful when replaying a program many times with only a few
+        sites changed between evaluations, e.g. in Gibbs or Metropolis-Hastings
+        updates. Tensors that require grad are compared by identity, so that
+        gradients are never taken through terms of the earlier trace, and
+        tensors changed in place since the terms were computed are detected
+        by their version counters.
+
+        :param Trace trace: an earlier trace whose log_prob terms have been
+            computed.
+        :returns: the set of names of sample sites whose terms were not reused.
+        :rtype: set
+        """
+        dirty = set()
+        for name, site in self.nodes.items():
+            if site["type"] != "sample":
+                continue
+            old_site = trace.nodes.get(name)
+            if (old_site is None or old_site["type"] != "sample" or
+                    "log_prob_sum" not in old_site or "tensor_versions" not in old_site or
+                    any(t._version != v for t, v in old_site["tensor_versions"]) or
+                    not _is_unchanged(site["value"], old_site["value"]) or
+                    not _is_unchanged(site["fn"], old_site["fn"]) or
+                    not _is_unchanged(site["scale"], old_site["scale"]) or
+                    not _is_unchanged(site["mask"], old_site["mask"]) or
+                    not _is_unchanged(site["args"], old_site["args"]) or
+                    not _is_unchanged(site["kwargs"], old_site["kwargs"])):
+                dirty.add(name)
+                continue
+            for key in _MEMOIZED_LOG_PROB_KEYS:
+                if key in old_site:
+                    site[key] = old_site[key]
+            site["tensor_versions"] = _site_versions(site)
+        return dirty
+
     def compute_log_prob(self, site_filter=lambda name, site: True):
         """
         Compute the site-wise log probabilities of the trace.
@@ -220,6 +335,7 @@ class Trace(object):
                     log_p = scale_and_mask(log_p, site["scale"], site["mask"])
                     site["log_prob"] = log_p
                     site["log_prob_sum"] = log_p.sum()
+                    site.setdefault("tensor_versions", _site_versions(site))
                     if is_validation_enabled():
                         warn_if_nan(site["log_prob_sum"], "log_prob_sum at site '{}'".format(name))
                         warn_if_inf(site["log_prob_sum"], "log_prob_sum at site '{}'".format(name),
@@ -248,6 +364,7 @@ class Trace(object):
                 site["score_parts"] = value
                 site["log_prob"] = value.log_prob
                 site["log_prob_sum"] = value.log_prob.sum()
+                site.setdefault("tensor_versions", _site_versions(site))
                 if is_validation_enabled():
                     warn_if_nan(site["log_prob_sum"], "log_prob_sum at site '{}'".format(name))
                     warn_if_inf(site["log_prob_sum"], "log_prob_sum at site '{}'".format(name), allow_neginf=True)
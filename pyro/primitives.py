@@ -9,7 +9,8 @@ import pyro.infer as infer
 import pyro.poutine as poutine
 from pyro.params import param_with_module_name
 from pyro.poutine.plate_messenger import PlateMessenger
-from pyro.poutine.runtime import _MODULE_NAMESPACE_DIVIDER, _PYRO_PARAM_STORE, am_i_wrapped, apply_stack, effectful
+from pyro.poutine.runtime import (_MODULE_NAMESPACE_DIVIDER, _PYRO_PARAM_STORE, Message, am_i_wrapped, apply_stack,
+                                  effectful)
 from pyro.poutine.subsample_messenger import SubsampleMessenger
 from pyro.util import deep_getattr, set_rng_seed  # noqa: F401
 
@@ -86,26 +87,7 @@ def sample(name, fn, *args, **kwargs):
     # if stack not empty, apply everything in the stack?
     else:
         # initialize data structure to pass up/down the stack
-        msg = {
-            "type": "sample",
-            "name": name,
-            "fn": fn,
-            "is_observed": False,
-            "args": args,
-            "kwargs": kwargs,
-            "value": None,
-            "infer": infer,
-            "scale": 1.0,
-            "mask": None,
-            "cond_indep_stack": (),
-            "done": False,
-            "stop": False,
-            "continuation": None
-        }
-        # handle observation
-        if obs is not None:
-            msg["value"] = obs
-            msg["is_observed"] = True
+        msg = Message("sample", name, fn, args, kwargs, value=obs, is_observed=obs is not None, infer=infer)
         # apply the stack and return its return value
         apply_stack(msg)
         return msg["value"]
@@ -170,8 +152,13 @@ class plate(PlateMessenger):
         Defaults to `size`.
     :param subsample: Optional custom subsample for user-defined subsampling
         schemes. If specified, then `subsample_size` will be set to
-        `len(subsample)`.
-    :type subsample: Anything supporting `len()`.
+        `len(subsample)`. Alternatively a stateful
+        :class:`~pyro.poutine.subsample_messenger.Subsampler` that draws a new
+        subsample each time the plate is entered and sets the scale of each
+        element, in which case `size` and `subsample_size` default to those
+        of the subsampler.
+    :type subsample: Anything supporting `len()`, or a
+        :class:`~pyro.poutine.subsample_messenger.Subsampler`.
     :param int dim: An optional dimension to use for this independence index.
         If specified, ``dim`` should be negative, i.e. should index from the
         right. If not specified, ``dim`` is set to the rightmost dim that is
@@ -193,6 +180,7 @@ class plate(PlateMessenger):
            >>> loc, scale = torch.tensor(0.), torch.tensor(1.)
            >>> data = torch.randn(100)
            >>> z = dist.Bernoulli(0.5).sample((100,))
+           >>> from pyro.poutine.subsample_messenger import ShuffledSubsampler
 
         >>> # This version declares sequential independence and subsamples data:
         >>> for i in plate('data', 100, subsample_size=10):
@@ -212,6 +200,11 @@ class plate(PlateMessenger):
         >>> with plate('data', 100, subsample=ind):
         ...     obs = sample('obs', dist.Normal(loc, scale), obs=data[ind])
 
+        >>> # This draws epoch-style shuffled minibatches, scaling elements by 100/10:
+        >>> subsampler = ShuffledSubsampler(100, 10)
+        >>> with plate('data', subsample=subsampler) as ind:
+        ...     obs = sample('obs', dist.Normal(loc, scale), obs=data[ind])
+
         >>> # This reuses two different independence contexts.
         >>> x_axis = plate('outer', 320, dim=-1)
         >>> y_axis = plate('inner', 200, dim=-2)
@@ -231,6 +224,46 @@ class plate(PlateMessenger):
     pass
 
 
+class vectorized_markov(plate):
+    """
+    Construct for markov chains whose time steps are vectorized along a plate
+    dimension.
+
+    This behaves like a vectorized :class:`plate`, but additionally informs
+    enumeration-based inference algorithms that each slice of a sample site
+    depends on the previous slice of that site. The site must declare the site
+    that holds its state before the first slice, via
+    ``infer={"markov_prev": name}``, and must use the (enumerated) value of
+    that site as a proxy for its own value at the previous time step. Both
+    sites must be enumerated. Inference algorithms such as
+    :class:`~pyro.infer.traceenum_elbo.TraceEnum_ELBO` and
+    :func:`~pyro.infer.discrete.infer_discrete` then contract the chain via a
+    parallel scan whose depth is logarithmic in ``size``, rather than via a
+    sequential :func:`~pyro.poutine.markov` loop of length ``size``.
+
+    Example::
+
+        x = pyro.sample("x_init", dist.Categorical(init_probs))
+        with pyro.vectorized_markov("time", len(data), dim=-1):
+            x = pyro.sample("x", dist.Categorical(trans_probs[x]),
+                            infer={"enumerate": "parallel", "markov_prev": "x_init"})
+            pyro.sample("y", dist.Normal(locs[x], 1.), obs=data)
+
+    .. warning:: Sites inside this context that declare no ``markov_prev``
+        are treated as conditionally independent across time steps, given the
+        chain. Marginals of sites in the chain are not supported.
+
+    :param str name: A unique name of the markov chain.
+    :param int size: The number of time steps.
+    :param int dim: An optional dimension to use for this plate. If specified,
+        ``dim`` should be negative, i.e. should index from the right.
+    """
+    def _process_message(self, msg):
+        super(vectorized_markov, self)._process_message(msg)
+        if msg["type"] == "sample" and "markov_prev" in msg["infer"]:
+            msg["infer"].setdefault("_markov_plate", self.name)
+
+
 class iarange(plate):
     def __init__(self, *args, **kwargs):
         warnings.warn("pyro.iarange is deprecated; use pyro.plate instead", DeprecationWarning)
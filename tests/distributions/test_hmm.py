@@ -1,3 +1,4 @@
+import itertools
 import operator
 from functools import reduce
 
@@ -270,8 +271,9 @@ def test_gaussian_hmm_shape(diag, init_shape, trans_mat_shape, trans_mvn_shape,
 @pytest.mark.parameterize('obs_dim', [1, 2])
 @pytest.mark.parameterize('hidden_dim', [1, 2])
 @pytest.mark.parameterize('num_steps', [1, 2, 3, 4])
+@pytest.mark.parameterize('square_root', [False, True], ids=['dense', 'sqrt'])
 @pytest.mark.parameterize("diag", [False, True], ids=["full", "diag"])
-def test_gaussian_hmm_log_prob(diag, sample_shape, batch_shape, num_steps, hidden_dim, obs_dim):
+def test_gaussian_hmm_log_prob(diag, sample_shape, batch_shape, num_steps, hidden_dim, obs_dim, square_root):
     init_dist = random_mvn(batch_shape, hidden_dim)
     trans_mat = torch.randn(batch_shape + (num_steps, hidden_dim, hidden_dim))
     trans_dist = random_mvn(batch_shape + (num_steps,), hidden_dim)
@@ -280,7 +282,7 @@ def test_gaussian_hmm_log_prob(diag, sample_shape, batch_shape, num_steps, hidde
     if diag:
         scale = obs_dist.scale_tril.diagonal(dim1=-2, dim2=-1)
         obs_dist = dist.Normal(obs_dist.loc, scale).to_event(1)
-    d = dist.GaussianHMM(init_dist, trans_mat, trans_dist, obs_mat, obs_dist)
+    d = dist.GaussianHMM(init_dist, trans_mat, trans_dist, obs_mat, obs_dist, square_root=square_root)
     if diag:
         obs_mvn = dist.MultivariateNormal(obs_dist.base_dist.loc,
                                           scale_tril=obs_dist.base_dist.scale.diag_embed())
@@ -326,6 +328,182 @@ def test_gaussian_hmm_log_prob(diag, sample_shape, batch_shape, num_steps, hidde
     assert_close(actual_log_prob, expected_log_prob)
 
 
+@pytest.mark.parameterize('homogeneous', [False, True], ids=['hetero', 'homo'])
+@pytest.mark.parameterize('batch_shape', [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize('state_dim', [2, 3])
+def test_discrete_hmm_online_filter(batch_shape, state_dim, homogeneous):
+    num_steps = 5
+    time_shape = (1,) if homogeneous else (num_steps,)
+    init_logits = torch.randn(batch_shape + (state_dim,))
+    trans_logits = torch.randn(batch_shape + time_shape + (state_dim, state_dim))
+    obs_loc = torch.randn(batch_shape + time_shape + (state_dim,))
+    d = dist.DiscreteHMM(init_logits, trans_logits, dist.Normal(obs_loc, 1.))
+    data = torch.randn(batch_shape + (num_steps,))
+
+    def truncated_hmm(t):
+        if homogeneous:
+            return d
+        return dist.DiscreteHMM(init_logits, trans_logits[..., :t, :, :], dist.Normal(obs_loc[..., :t, :], 1.))
+
+    f = d.online_filter()
+    log_prob = 0.
+    for t in range(num_steps):
+        # Forecasting one step ahead applies the transition at the next step.
+        trans = d.transition_logits[..., t if not homogeneous else 0, :, :]
+        expected_logits = (f.posterior.logits.unsqueeze(-1) + trans).logsumexp(-2)
+        assert_close(f.predict().probs, expected_logits.softmax(-1))
+
+        log_prob = log_prob + f.update(data[..., t])
+        expected = truncated_hmm(t + 1).filter(data[..., :t + 1])
+        assert_close(f.posterior.probs, expected.probs)
+    assert_close(log_prob, d.log_prob(data))
+
+    if homogeneous:
+        assert f.predict(3).probs.shape == batch_shape + (state_dim,)
+    else:
+        with pytest.raises(ValueError):
+            f.predict()
+
+
+@pytest.mark.parameterize('num_steps', [1, 2, 3, 5])
+@pytest.mark.parameterize('homogeneous', [False, True], ids=['hetero', 'homo'])
+def test_discrete_hmm_posterior(num_steps, homogeneous):
+    state_dim = 3
+    time_shape = (1,) if homogeneous else (num_steps,)
+    init_logits = torch.randn(state_dim)
+    trans_logits = torch.randn(time_shape + (state_dim, state_dim))
+    obs_dist = dist.Normal(torch.randn(time_shape + (state_dim,)), 1.)
+    d = dist.DiscreteHMM(init_logits, trans_logits, obs_dist)
+    data = torch.randn(num_steps)
+
+    # Compute the posterior over trajectories by brute force.
+    init_logits = d.initial_logits
+    trans_logits = d.transition_logits.expand((num_steps, state_dim, state_dim))
+    obs_logits = obs_dist.log_prob(data.unsqueeze(-1)).expand(num_steps, state_dim)
+    paths = list(itertools.product(range(state_dim), repeat=num_steps + 1))
+    log_weights = torch.stack([
+        init_logits[path[0]] + sum(trans_logits[t, path[t], path[t + 1]] + obs_logits[t, path[t + 1]]
+                                   for t in range(num_steps))
+        for path in paths])
+    probs = (log_weights - log_weights.logsumexp(0)).exp()
+    paths = torch.tensor(paths)[:, 1:]
+
+    expected_marginals = torch.stack([
+        torch.zeros(state_dim).index_add(0, paths[:, t], probs) for t in range(num_steps)])
+    assert_close(d.smoothed_marginals(data).probs, expected_marginals)
+
+    expected_map = paths[probs.argmax()]
+    assert (d.map_states(data) == expected_map).all()
+
+    num_samples = 20000
+    samples = d.expand((num_samples,)).sample_posterior(data)
+    assert samples.shape == (num_samples, num_steps)
+    for t in range(num_steps):
+        actual = torch.zeros(state_dim).index_add(0, samples[:, t], torch.ones(num_samples)) / num_samples
+        assert_close(actual, expected_marginals[t], atol=0.03)
+    # Check pairwise statistics, which depend on the backward sampling pass.
+    if num_steps > 1:
+        expected = (probs * (paths[:, 0] == paths[:, 1]).float()).sum()
+        actual = (samples[:, 0] == samples[:, 1]).float().mean()
+        assert_close(actual, expected, atol=0.03)
+
+
+@pytest.mark.parameterize('batch_shape', [(), (4,)], ids=str)
+@pytest.mark.parameterize('num_steps', [1, 2, 3])
+@pytest.mark.parameterize('square_root', [False, True], ids=['dense', 'sqrt'])
+@pytest.mark.parameterize("diag", [False, True], ids=["full", "diag"])
+def test_gaussian_hmm_map_states(diag, num_steps, batch_shape, square_root):
+    hidden_dim, obs_dim = 2, 3
+    init_dist = random_mvn(batch_shape, hidden_dim)
+    trans_mat = torch.randn(batch_shape + (num_steps, hidden_dim, hidden_dim))
+    trans_dist = random_mvn(batch_shape + (num_steps,), hidden_dim)
+    obs_mat = torch.randn(batch_shape + (num_steps, hidden_dim, obs_dim))
+    obs_mvn = random_mvn(batch_shape + (num_steps,), obs_dim)
+    obs_dist = obs_mvn
+    if diag:
+        scale = obs_mvn.scale_tril.diagonal(dim1=-2, dim2=-1)
+        obs_dist = dist.Normal(obs_mvn.loc, scale).to_event(1)
+        obs_mvn = dist.MultivariateNormal(obs_mvn.loc, scale_tril=scale.diag_embed())
+    d = dist.GaussianHMM(init_dist, trans_mat, trans_dist, obs_mat, obs_dist, square_root=square_root)
+    data = obs_dist.sample()
+    actual = d.map_states(data)
+    assert actual.shape == batch_shape + (num_steps, hidden_dim)
+
+    # Compute the posterior mean of the unrolled joint gaussian.
+    T = num_steps
+    init = mvn_to_gaussian(init_dist)
+    trans = matrix_and_mvn_to_gaussian(trans_mat, trans_dist)
+    obs = matrix_and_mvn_to_gaussian(obs_mat, obs_mvn)
+    unrolled_trans = reduce(operator.add, [
+        trans[..., t].event_pad(left=t * hidden_dim, right=(T - t - 1) * hidden_dim)
+        for t in range(T)
+    ])
+    unrolled_obs = reduce(operator.add, [
+        obs[..., t].condition(data[..., t, :]).event_pad(left=t * hidden_dim, right=(T - t - 1) * hidden_dim)
+        for t in range(T)
+    ])
+    logp = gaussian_tensordot(init, unrolled_trans, hidden_dim) + unrolled_obs
+    expected = logp.info_vec.unsqueeze(-1).cholesky_solve(logp.precision.cholesky()).squeeze(-1)
+    assert_close(actual, expected.reshape(batch_shape + (T, hidden_dim)))
+
+
+@pytest.mark.parameterize('homogeneous', [False, True], ids=['hetero', 'homo'])
+@pytest.mark.parameterize('batch_shape', [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize('square_root', [False, True], ids=['dense', 'sqrt'])
+@pytest.mark.parameterize("diag", [False, True], ids=["full", "diag"])
+def test_gaussian_hmm_online_filter(diag, batch_shape, homogeneous, square_root):
+    hidden_dim, obs_dim, num_steps = 2, 3, 4
+    time_shape = (1,) if homogeneous else (num_steps,)
+    init_dist = random_mvn(batch_shape, hidden_dim)
+    trans_mat = torch.randn(batch_shape + time_shape + (hidden_dim, hidden_dim))
+    trans_dist = random_mvn(batch_shape + time_shape, hidden_dim)
+    obs_mat = torch.randn(batch_shape + time_shape + (hidden_dim, obs_dim))
+    obs_dist = random_mvn(batch_shape + time_shape, obs_dim)
+    if diag:
+        scale = obs_dist.scale_tril.diagonal(dim1=-2, dim2=-1)
+        obs_dist = dist.Normal(obs_dist.loc, scale).to_event(1)
+    d = dist.GaussianHMM(init_dist, trans_mat, trans_dist, obs_mat, obs_dist, square_root=square_root)
+    data = torch.randn(batch_shape + (num_steps, obs_dim))
+
+    def truncated_hmm(t):
+        if homogeneous:
+            return d
+        if diag:
+            obs_dist_t = dist.Normal(obs_dist.base_dist.loc[..., :t, :],
+                                     obs_dist.base_dist.scale[..., :t, :]).to_event(1)
+        else:
+            obs_dist_t = dist.MultivariateNormal(obs_dist.loc[..., :t, :],
+                                                 scale_tril=obs_dist.scale_tril[..., :t, :, :])
+        trans_dist_t = dist.MultivariateNormal(trans_dist.loc[..., :t, :],
+                                               scale_tril=trans_dist.scale_tril[..., :t, :, :])
+        return dist.GaussianHMM(init_dist, trans_mat[..., :t, :, :], trans_dist_t,
+                                obs_mat[..., :t, :, :], obs_dist_t)
+
+    f = d.online_filter()
+    log_prob = 0.
+    for t in range(num_steps):
+        log_prob = log_prob + f.update(data[..., t, :])
+        expected = truncated_hmm(t + 1).filter(data[..., :t + 1, :])
+        assert_close(f.posterior.loc, expected.loc)
+        assert_close(f.posterior.covariance_matrix, expected.covariance_matrix)
+    assert_close(log_prob, d.log_prob(data))
+
+    if homogeneous:
+        # Forecasting two steps ahead equals applying the transition twice.
+        z = f.predict(2)
+        loc = f.posterior.loc
+        cov = f.posterior.covariance_matrix
+        for _ in range(2):
+            loc = loc.unsqueeze(-2).matmul(trans_mat[..., 0, :, :]).squeeze(-2) + trans_dist.loc[..., 0, :]
+            cov = (trans_mat[..., 0, :, :].transpose(-1, -2).matmul(cov).matmul(trans_mat[..., 0, :, :]) +
+                   trans_dist.covariance_matrix[..., 0, :, :])
+        assert_close(z.loc, loc)
+        assert_close(z.covariance_matrix, cov)
+    else:
+        with pytest.raises(ValueError):
+            f.update(data[..., 0, :])
+
+
 @pytest.mark.parameterize('obs_dim', [1, 2, 3])
 @pytest.mark.parameterize('hidden_dim', [1, 2, 3])
 @pytest.mark.parameterize('init_shape,trans_shape,obs_shape', [
@@ -366,11 +544,12 @@ def test_gaussian_mrf_shape(init_shape, trans_shape, obs_shape, hidden_dim, obs_
 @pytest.mark.parameterize('obs_dim', [1, 2])
 @pytest.mark.parameterize('hidden_dim', [1, 2])
 @pytest.mark.parameterize('num_steps', [1, 2, 3, 4])
-def test_gaussian_mrf_log_prob(sample_shape, batch_shape, num_steps, hidden_dim, obs_dim):
+@pytest.mark.parameterize('square_root', [False, True], ids=['dense', 'sqrt'])
+def test_gaussian_mrf_log_prob(square_root, sample_shape, batch_shape, num_steps, hidden_dim, obs_dim):
     init_dist = random_mvn(batch_shape, hidden_dim)
     trans_dist = random_mvn(batch_shape + (num_steps,), hidden_dim + hidden_dim)
     obs_dist = random_mvn(batch_shape + (num_steps,), hidden_dim + obs_dim)
-    d = dist.GaussianMRF(init_dist, trans_dist, obs_dist)
+    d = dist.GaussianMRF(init_dist, trans_dist, obs_dist, square_root=square_root)
     data = obs_dist.sample(sample_shape)[..., hidden_dim:]
     assert data.shape == sample_shape + d.shape()
     actual_log_prob = d.log_prob(data)
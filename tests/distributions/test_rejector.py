@@ -3,6 +3,7 @@ import torch
 from torch.autograd import grad
 
 from pyro.distributions import Exponential, Gamma
+from pyro.distributions.rejector import Rejector, rejection_sample
 from pyro.distributions.testing.rejection_exponential import RejectionExponential
 from pyro.distributions.testing.rejection_gamma import (RejectionGamma, RejectionStandardGamma, ShapeAugmentedBeta,
                                                         ShapeAugmentedGamma)
@@ -30,6 +31,45 @@ def test_rejection_exponential_sample_shape(sample_shape, batch_shape):
     assert x.shape == sample_shape + batch_shape
 
 
+@pytest.mark.parameterize('sample_shape', SIZES)
+@pytest.mark.parameterize('batch_shape', SIZES)
+@pytest.mark.parameterize('event_shape', [(), (2,)], ids=str)
+@pytest.mark.parameterize('rate', [0.01, 0.5, 1.0])
+def test_rejection_sample(sample_shape, batch_shape, event_shape, rate):
+    loc = torch.zeros(batch_shape + event_shape, requires_grad=True)
+    num_calls = [0]
+
+    def propose(sample_shape):
+        num_calls[0] += 1
+        u = torch.rand(sample_shape + batch_shape)
+        x = loc + u.reshape(u.shape + (1,) * len(event_shape))
+        return x, u < rate
+
+    x = rejection_sample(propose, sample_shape)
+    assert x.shape == sample_shape + batch_shape + event_shape
+    assert (x < rate).all()
+    assert num_calls[0] < 20
+    x.sum().backward()
+    assert_equal(loc.grad, torch.full_like(loc, sample_shape.numel()))
+
+
+@pytest.mark.parameterize('sample_shape', SIZES)
+def test_rejector_propose_without_sample_shape(sample_shape):
+    rates = torch.ones(3)
+    factors = torch.ones(3) * 0.5
+    proposal = Exponential(factors * rates)
+
+    def propose():
+        return proposal.rsample()
+
+    def log_prob_accept(x):
+        return (factors - 1) * rates * x
+
+    dist = Rejector(propose, log_prob_accept, factors.log())
+    x = dist.rsample(sample_shape)
+    assert x.shape == sample_shape + rates.shape
+
+
 def compute_elbo_grad(model, guide, variables):
     x = guide.rsample()
     model_log_prob = model.log_prob(x)
@@ -159,3 +159,65 @@ def test_sample_tree_gof(method, backend, num_edges, pattern):
         assert gof >= 0.0001
     else:
         assert gof >= 0.005
+
+
+@pytest.mark.filterwarnings("always")
+@pytest.mark.parameterize('sample_shape', [(), (1,), (5,), (2, 3)], ids=str)
+@pytest.mark.parameterize('num_edges', [1, 3, 10, 30])
+@pytest.mark.parameterize('backend', ["python", "cpp"])
+def test_sample_shape_smoke(backend, num_edges, sample_shape):
+    pyro.set_rng_seed(num_edges)
+    E = num_edges
+    V = 1 + E
+    K = V * (V - 1) // 2
+    d = SpanningTree(torch.rand(K), sampler_options={"backend": backend})
+    edges = d.sample(sample_shape)
+    assert edges.shape == sample_shape + d.event_shape
+    d.validate_edges(edges)
+
+    # Chains started from given edges are independent.
+    edges = sample_tree(d.edge_logits, edges[..., :1, :, :] if sample_shape else edges,
+                        backend=backend, sample_shape=(4,) + sample_shape)
+    assert edges.shape == (4,) + sample_shape + d.event_shape
+    d.validate_edges(edges)
+
+
+@pytest.mark.parameterize('pattern', ["uniform", "random", "sparse"])
+@pytest.mark.parameterize('num_edges', [1, 2, 3])
+def test_sample_shape_distribution(num_edges, pattern):
+    pyro.set_rng_seed(2 ** 32 - num_edges)
+    E = num_edges
+    V = 1 + E
+    K = V * (V - 1) // 2
+    edge_logits = torch.zeros(K) if pattern == "uniform" else torch.rand(K)
+    if pattern == "sparse":
+        for v2 in range(V):
+            for v1 in range(v2):
+                if v1 + 1 < v2:
+                    edge_logits[v1 + v2 * (v2 - 1) // 2] = -float('inf')
+    d = SpanningTree(edge_logits, sampler_options={"mcmc_steps": 5})
+    num_samples = 20000
+    samples = d.sample((num_samples,))
+
+    support = d.enumerate_support()
+    matches = (samples.unsqueeze(1) == support).all(-1).all(-1)
+    assert (matches.sum(-1) == 1).all()
+    actual = matches.sum(0).double() / num_samples
+    expected = d.log_prob(support).exp().double()
+    assert_equal(actual, expected, prec=0.02)
+
+
+def test_log_partition_function_cache():
+    edge_logits = torch.randn(6)
+    expected = SpanningTree(edge_logits).log_partition_function
+    assert SpanningTree(edge_logits).log_partition_function is not expected
+    assert_equal(SpanningTree(edge_logits).log_partition_function, expected)
+
+    # The cache is invalidated by in-place modification.
+    edge_logits += 1
+    assert_equal(SpanningTree(edge_logits).log_partition_function, expected + 3)
+
+    # Differentiable results are not cached.
+    edge_logits.requires_grad_()
+    SpanningTree(edge_logits).log_partition_function.backward()
+    SpanningTree(edge_logits).log_partition_function.backward()
@@ -24,12 +24,16 @@ def _fit_params_from_samples(samples, n_iter):
     # Estimating kappa of von Mises distribution, URL (version: 2015-06-12):
     # https://stats.stackexchange.com/q/156692
     kappa = (samples_r * 2 - samples_r ** 3) / (1 - samples_r ** 2)
+    # Optimize log(kappa) so that the fit cannot diverge to negative kappa
+    # for tiny concentrations.
+    log_kappa = kappa.log()
     lr = 1e-2
-    kappa.requires_grad = True
-    bfgs = optim.LBFGS([kappa], lr=lr)
+    log_kappa.requires_grad = True
+    bfgs = optim.LBFGS([log_kappa], lr=lr)
 
     def bfgs_closure():
         bfgs.zero_grad()
+        kappa = log_kappa.exp()
         obj = (_log_modified_bessel_fn(kappa, order=1)
                - _log_modified_bessel_fn(kappa, order=0))
         obj = (obj - samples_r.log()).abs()
@@ -38,7 +42,7 @@ def _fit_params_from_samples(samples, n_iter):
 
     for i in range(n_iter):
         bfgs.step(bfgs_closure)
-    return mu, kappa.detach()
+    return mu, log_kappa.detach().exp()
 
 
 @pytest.mark.parameterize('loc', [-math.pi/2.0, 0.0, math.pi/2.0])
@@ -49,8 +53,15 @@ def test_sample(loc, concentration, n_samples=int(1e6), n_iter=50):
     prob = VonMises(loc, concentration)
     samples = prob.sample((n_samples,))
     mu, kappa = _fit_params_from_samples(samples, n_iter=n_iter)
-    assert abs(loc - mu) < 0.1
-    assert abs(concentration - kappa) < concentration * 0.1
+    # For tiny concentrations the estimates are dominated by sampling noise,
+    # so allow four standard errors, computed from the Fisher information.
+    concentration = torch.tensor(concentration)
+    a = (_log_modified_bessel_fn(concentration, order=1)
+         - _log_modified_bessel_fn(concentration, order=0)).exp()
+    loc_stderr = (n_samples * concentration * a).rsqrt()
+    concentration_stderr = (n_samples * (1 - a / concentration - a ** 2)).rsqrt()
+    assert abs(loc - mu) < max(0.1, 4 * loc_stderr)
+    assert abs(concentration - kappa) < max(concentration * 0.1, 4 * concentration_stderr)
 
 
 @pytest.mark.parameterize('concentration', [0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, 30.0, 100.0])
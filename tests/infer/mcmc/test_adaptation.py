@@ -1,8 +1,10 @@
 import pytest
 import torch
 
-from pyro.infer.mcmc.adaptation import WarmupAdapter, adapt_window
-from tests.common import assert_equal
+import pyro.distributions as dist
+
+from pyro.infer.mcmc.adaptation import WarmupAdapter, adapt_window, low_rank_matrix
+from tests.common import assert_close, assert_equal
 
 
 @pytest.mark.parameterize("adapt_step_size, adapt_mass, warmup_steps, expected", [
@@ -20,3 +22,77 @@ def test_adaptation_schedule(adapt_step_size, adapt_mass, warmup_steps, expected
     adapter.configure(warmup_steps, inv_mass_matrix=torch.eye(5, 5))
     expected_schedule = [adapt_window(i, j) for i, j in expected]
     assert_equal(adapter.adaptation_schedule, expected_schedule, prec=0)
+
+
+def _random_blocks(batch_shape, sizes):
+    blocks = []
+    for size in sizes:
+        x = torch.randn(batch_shape + (size, 2 * size))
+        blocks.append(x.matmul(x.transpose(-1, -2)) / size + torch.eye(size))
+    return blocks
+
+
+def _block_diag(blocks):
+    size = sum(block.size(-1) for block in blocks)
+    matrix = blocks[0].new_zeros(blocks[0].shape[:-2] + (size, size))
+    pos = 0
+    for block in blocks:
+        next_pos = pos + block.size(-1)
+        matrix[..., pos:next_pos, pos:next_pos] = block
+        pos = next_pos
+    return matrix
+
+
+def _random_low_rank(batch_shape, size, rank):
+    scale = torch.rand(batch_shape + (size,)) + 0.5
+    vectors = torch.randn(batch_shape + (size, rank)).qr()[0]
+    values = torch.rand(batch_shape + (rank,)) * 3 - 0.5
+    matrix = low_rank_matrix(scale, vectors, values)
+    dense = torch.eye(size) + vectors.matmul(values.unsqueeze(-1) * vectors.transpose(-1, -2))
+    dense = scale.unsqueeze(-1) * dense * scale.unsqueeze(-2)
+    return matrix, dense
+
+
+@pytest.mark.parameterize("batch_shape", [(), (3,)])
+@pytest.mark.parameterize("mass_structure", ["block", "low_rank"])
+def test_structured_mass_matrix(mass_structure, batch_shape):
+    size = 5
+    if mass_structure == "block":
+        matrix = _random_blocks(batch_shape, [1, 3, 1])
+        dense = _block_diag(matrix)
+    else:
+        matrix, dense = _random_low_rank(batch_shape, size, 2)
+    adapter = WarmupAdapter(0.1, mass_structure=mass_structure)
+    adapter.configure(100, inv_mass_matrix=matrix)
+
+    r = torch.randn(batch_shape + (size,))
+    assert_close(adapter.inverse_mass_matvec(r), dense.matmul(r.unsqueeze(-1)).squeeze(-1))
+
+    # momentum is distributed with covariance the mass matrix
+    num_samples = 20000
+    r = torch.stack([adapter.sample_r("r") for _ in range(num_samples)])
+    r = r - r.mean(0)
+    cov = (r.unsqueeze(-1) * r.unsqueeze(-2)).mean(0)
+    assert_close(cov.matmul(dense), torch.eye(size).expand(batch_shape + (size, size)), atol=0.1)
+
+
+@pytest.mark.parameterize("mass_structure", ["block", "low_rank"])
+def test_structured_mass_matrix_adaptation(mass_structure):
+    size, warmup_steps = 4, 300
+    cov = _block_diag(_random_blocks((), [2, 2]))
+    samples = dist.MultivariateNormal(torch.zeros(size), cov).sample((warmup_steps,))
+    adapter = WarmupAdapter(0.1, adapt_mass_matrix=True, mass_structure=mass_structure, mass_rank=size)
+    if mass_structure == "block":
+        inv_mass_matrix = [torch.eye(2), torch.eye(2)]
+    else:
+        inv_mass_matrix = low_rank_matrix(torch.ones(size), torch.zeros(size, 0), torch.zeros(0))
+    adapter.configure(warmup_steps, inv_mass_matrix=inv_mass_matrix)
+    for t, x in enumerate(samples):
+        adapter.step(t, {"x": x}, torch.tensor(0.8))
+
+    # the adapted mass matrix is estimated from the samples of the last window
+    window = adapter.adaptation_schedule[-2]
+    expected = samples[window.start:window.end + 1]
+    expected = (expected.unsqueeze(-1) * expected.unsqueeze(-2)).mean(0)
+    actual = adapter.inverse_mass_matvec(torch.eye(size))
+    assert_close(actual, expected, rtol=0.2, atol=0.2)
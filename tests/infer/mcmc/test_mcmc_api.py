@@ -7,9 +7,11 @@ import torch
 import pyro
 import pyro.distributions as dist
 from pyro import poutine
+from pyro.infer import config_enumerate
 from pyro.infer.mcmc import HMC, NUTS
-from pyro.infer.mcmc.api import MCMC, _UnarySampler, _MultiSampler
+from pyro.infer.mcmc.api import MCMC, _MultiSampler, _UnarySampler, _VectorizedSampler
 from pyro.infer.mcmc.mcmc_kernel import MCMCKernel
+from pyro.infer.mcmc.sample_store import SampleStore
 from pyro.infer.mcmc.util import initialize_model
 from pyro.util import optional
 from tests.common import skipif_param, assert_close
@@ -129,6 +131,82 @@ def test_num_chains(num_chains, cpu_count, default_init_params,
         assert isinstance(mcmc.sampler, _MultiSampler)
 
 
+class CounterKernel(PriorKernel):
+    """
+    Increments the value of each param by one at every step.
+    """
+    def sample(self, params):
+        return {k: v + 1 for k, v in params.items()}
+
+
+@pytest.mark.parameterize("num_samples", [1, 150, 450])
+def test_multi_sampler_blocks(num_samples, monkeypatch):
+    monkeypatch.setattr(torch.multiprocessing, 'cpu_count', lambda: 3)
+    num_chains, warmup_steps = 2, 10
+    data = torch.tensor([1.0])
+    initial_params = {'y': torch.tensor([[0.], [1000.]])}
+    mp_context = "spawn" if "CUDA_TEST" in os.environ else None
+    mcmc = MCMC(CounterKernel(normal_normal_model), num_samples=num_samples, warmup_steps=warmup_steps,
+                num_chains=num_chains, initial_params=initial_params, transforms={},
+                mp_context=mp_context, disable_progbar=True)
+    mcmc.run(data)
+    assert isinstance(mcmc.sampler, _MultiSampler)
+    samples = mcmc.get_samples(group_by_chain=True)['y']
+    expected = torch.arange(1., num_samples + 1) + warmup_steps
+    assert_close(samples[0, :, 0], expected)
+    assert_close(samples[1, :, 0], expected + 1000)
+
+
+@pytest.mark.parameterize("on_disk", [False, True])
+@pytest.mark.parameterize("thinning, retention, chunk_size", [
+    (1, None, 7),
+    (3, None, 7),
+    (2, 10, 4),
+    (1, 5, 7),
+])
+def test_sample_store(thinning, retention, chunk_size, on_disk, tmpdir):
+    num_samples, warmup_steps = 50, 10
+    data = torch.tensor([1.0, 2.0])
+    initial_params = {'y': torch.zeros(2)}
+    store = SampleStore(path=str(tmpdir) if on_disk else None, thinning=thinning,
+                        retention=retention, chunk_size=chunk_size)
+    mcmc = MCMC(CounterKernel(normal_normal_model), num_samples=num_samples, warmup_steps=warmup_steps,
+                initial_params=initial_params, transforms={}, disable_progbar=True, sample_store=store)
+    mcmc.run(data)
+    if on_disk:
+        assert os.path.exists(os.path.join(str(tmpdir), "y.npy"))
+
+    draws = torch.arange(1., num_samples + 1) + warmup_steps
+    expected = draws[::thinning]
+    if retention is not None:
+        expected = expected[-retention:]
+    samples = mcmc.get_samples(group_by_chain=True)['y']
+    assert samples.shape == (1, len(expected), 2)
+    assert_close(samples[0, :, 0], expected)
+    assert_close(samples[0, :, 1], expected)
+
+    # online moments are computed over all the draws
+    mean, var = store.moments()['y']
+    assert_close(mean, draws.mean().expand(2))
+    assert_close(var, draws.var().expand(2))
+
+
+def test_sample_store_moments_pooled():
+    store = SampleStore()
+    store.reset(num_chains=3, num_samples=20)
+    x = torch.randn(3, 20, 2)
+    for i in range(20):
+        for chain_id in range(3):
+            store.append(chain_id, {'x': x[chain_id, i]})
+    mean, var = store.moments()['x']
+    assert_close(mean, x.reshape(-1, 2).mean(0))
+    assert_close(var, x.reshape(-1, 2).var(0))
+    mean, var = store.moments(group_by_chain=True)['x']
+    assert_close(mean, x.mean(1))
+    assert_close(var, x.var(1))
+    assert_close(store.get_samples()['x'], x)
+
+
 def _empty_model():
     return torch.tensor(1)
 
@@ -188,3 +266,68 @@ def test_mcmc_diagnostics(num_chains):
     assert diagnostics["y"]["r_hat"].shape == data.shape
     assert diagnostics["dummy_key"] == {'chain {}'.format(i): 'dummy_value'
                                         for i in range(num_chains)}
+
+
+def _normal_model(data):
+    loc = pyro.sample('loc', dist.Normal(torch.zeros(2), 1.).to_event(1))
+    scale = pyro.sample('scale', dist.LogNormal(0., 1.))
+    with pyro.plate('data', data.shape[0]):
+        pyro.sample('obs', dist.Normal(loc, scale.unsqueeze(-1)).to_event(1), obs=data)
+
+
+@pytest.mark.parameterize("kernel, kwargs", [
+    (HMC, {"trajectory_length": 1.}),
+    (HMC, {"trajectory_length": 1., "full_mass": True}),
+    (NUTS, {}),
+    (NUTS, {"full_mass": True}),
+    (NUTS, {"full_mass": "block"}),
+    (NUTS, {"full_mass": "low_rank", "mass_rank": 1}),
+    (NUTS, {"use_multinomial_sampling": False}),
+])
+@pytest.mark.parameterize("jit", [False, True])
+def test_vectorized_chains(kernel, kwargs, jit):
+    num_chains, num_samples = 3, 100
+    data = torch.tensor([[1.0, -1.0], [1.5, -0.5], [0.5, -1.5]])
+    kern = kernel(_normal_model, jit_compile=jit, ignore_jit_warnings=True, **kwargs)
+    mcmc = MCMC(kern, num_samples=num_samples, warmup_steps=100, num_chains=num_chains,
+                chain_method="vectorized", disable_progbar=True)
+    mcmc.run(data)
+    assert isinstance(mcmc.sampler, _VectorizedSampler)
+    assert kern.step_size.shape == (num_chains,)
+
+    samples = mcmc.get_samples(group_by_chain=True)
+    assert samples['loc'].shape == (num_chains, num_samples, 2)
+    assert samples['scale'].shape == (num_chains, num_samples)
+    assert (samples['scale'] > 0).all()
+    assert_close(samples['loc'].mean(1), data.mean(0).expand(num_chains, 2), atol=0.5)
+    for i in range(num_chains):
+        diagnostics = mcmc._diagnostics[i]
+        assert isinstance(diagnostics["divergences"], list)
+        assert 0 < diagnostics["acceptance rate"] <= 1
+
+
+def test_vectorized_chains_enum():
+    num_chains = 2
+    data = torch.tensor([-2.0, -1.5, 1.5, 2.0])
+
+    @config_enumerate
+    def model(data):
+        loc0 = pyro.sample('loc0', dist.Normal(-2., 1.))
+        loc1 = pyro.sample('loc1', dist.Normal(2., 1.))
+        with pyro.plate('data', data.shape[0]):
+            z = pyro.sample('z', dist.Bernoulli(0.5))
+            pyro.sample('obs', dist.Normal(torch.where(z.bool(), loc1, loc0), 0.5), obs=data)
+
+    kern = NUTS(model, max_plate_nesting=1)
+    mcmc = MCMC(kern, num_samples=50, warmup_steps=50, num_chains=num_chains,
+                chain_method="vectorized", disable_progbar=True)
+    mcmc.run(data)
+    samples = mcmc.get_samples(group_by_chain=True)
+    assert set(samples) == {'loc0', 'loc1'}
+    assert samples['loc0'].shape == (num_chains, 50)
+    assert samples['loc1'].shape == (num_chains, 50)
+
+
+def test_vectorized_chains_invalid_kernel():
+    with pytest.raises(ValueError):
+        MCMC(PriorKernel(normal_normal_model), num_samples=10, num_chains=2, chain_method="vectorized")
@@ -1,3 +1,6 @@
+import os
+from functools import partial
+
 import pytest
 import torch
 
@@ -5,7 +8,7 @@ import pyro
 import pyro.distributions as dist
 from pyro.infer.mcmc import NUTS
 from pyro.infer.mcmc.api import MCMC
-from pyro.infer.mcmc.util import initialize_model, predictive
+from pyro.infer.mcmc.util import _JIT_CACHE, initialize_model, predictive
 from pyro.util import ignore_experimental_warning, optional
 from tests.common import assert_close
 
@@ -50,3 +53,79 @@ def test_predictive(num_samples, parallel):
 
     # check sample mean
     assert_close(predictive_samples["obs"].reshape([-1, 5]).mean(0), true_probs, rtol=0.1)
+
+
+def test_jit_cache(tmpdir, monkeypatch):
+    def model(data):
+        loc = pyro.sample("loc", dist.Normal(0., 1.))
+        scale = pyro.sample("scale", dist.LogNormal(0., 1.))
+        with pyro.plate("data", data.shape[0]):
+            pyro.sample("obs", dist.Normal(loc, scale), obs=data)
+
+    cache_dir = str(tmpdir)
+    params = {"loc": torch.tensor(0.5), "scale": torch.tensor(-0.2)}
+    data = torch.randn(10)
+    _, potential_fn, _, _ = initialize_model(model, model_args=(data,), jit_compile=True,
+                                             jit_cache_dir=cache_dir)
+    potential_fn(params)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # reuse the compiled potential_fn from disk for new data of the same shape
+    _JIT_CACHE.clear()
+    monkeypatch.setattr(torch.jit, "trace", None)
+    new_data = torch.randn(10)
+    _, potential_fn, _, _ = initialize_model(model, model_args=(new_data,), jit_compile=True,
+                                             jit_cache_dir=cache_dir)
+    _, expected_potential_fn, _, _ = initialize_model(model, model_args=(new_data,))
+    assert_close(potential_fn(params), expected_potential_fn(params))
+    monkeypatch.undo()
+
+    # recompile for data of a different shape
+    _, potential_fn, _, _ = initialize_model(model, model_args=(torch.randn(5),), jit_compile=True,
+                                             jit_cache_dir=cache_dir)
+    potential_fn(params)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def _scaled_model(scale, data):
+    loc = pyro.sample("loc", dist.Normal(0., scale))
+    with pyro.plate("data", data.shape[0]):
+        pyro.sample("obs", dist.Normal(loc, 1.), obs=data)
+
+
+def _closure_model(scale):
+    def model(data):
+        _scaled_model(scale, data)
+    return model
+
+
+@pytest.mark.parameterize("make_model", [partial(partial, _scaled_model), _closure_model])
+def test_jit_cache_bound_values(tmpdir, make_model):
+    cache_dir = str(tmpdir)
+    params = {"loc": torch.tensor(0.5)}
+    data = torch.randn(10)
+    for scale in [1., 100.]:
+        model = make_model(scale)
+        _, potential_fn, _, _ = initialize_model(model, model_args=(data,), jit_compile=True,
+                                                 jit_cache_dir=cache_dir)
+        _, expected_potential_fn, _, _ = initialize_model(model, model_args=(data,))
+        assert_close(potential_fn(params), expected_potential_fn(params))
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_jit_cache_unkeyable_model(tmpdir):
+    class Model:
+        def __init__(self, scale):
+            self.scale = scale
+
+        def __call__(self, data):
+            _scaled_model(self.scale, data)
+
+    cache_dir = str(tmpdir)
+    params = {"loc": torch.tensor(0.5)}
+    data = torch.randn(10)
+    with pytest.warns(RuntimeWarning, match="will not be cached"):
+        _, potential_fn, _, _ = initialize_model(Model(2.), model_args=(data,), jit_compile=True,
+                                                 jit_cache_dir=cache_dir)
+    potential_fn(params)
+    assert not os.listdir(cache_dir)
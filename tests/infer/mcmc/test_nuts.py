@@ -162,6 +162,8 @@ def test_logistic_regression(jit, use_multinomial_sampling):
         (None, True, False, False),
         (None, True, True, False),
         (None, True, True, True),
+        (None, True, True, "block"),
+        (None, True, True, "low_rank"),
     ]
 )
 def test_beta_bernoulli(step_size, adapt_step_size, adapt_mass_matrix, full_mass):
@@ -292,6 +292,38 @@ def test_hmm_smoke(infer, temperature, length):
     logger.info("inferred states: {}".format(list(map(int, inferred_states))))
 
 
+@pytest.mark.parameterize('length', [1, 2, 3, 10])
+def test_hmm_vectorized_markov_map(length):
+    hidden_dim = 3
+    init = torch.randn(hidden_dim).softmax(-1)
+    transition = torch.randn(hidden_dim, hidden_dim).softmax(-1)
+    means = torch.randn(hidden_dim)
+    data = torch.randn(length)
+
+    @config_enumerate
+    def expected_hmm(data):
+        states = [pyro.sample("states_init", dist.Categorical(init))]
+        for t in pyro.markov(range(len(data))):
+            states.append(pyro.sample("states_{}".format(t),
+                                      dist.Categorical(transition[states[-1]])))
+            pyro.sample("obs_{}".format(t), dist.Normal(means[states[-1]], 1.), obs=data[t])
+        return states
+
+    @config_enumerate
+    def actual_hmm(data):
+        states_init = pyro.sample("states_init", dist.Categorical(init))
+        with pyro.vectorized_markov("time", len(data), dim=-1):
+            states = pyro.sample("states", dist.Categorical(transition[states_init]),
+                                 infer={"markov_prev": "states_init"})
+            pyro.sample("obs", dist.Normal(means[states], 1.), obs=data)
+        return states_init, states
+
+    expected_states = infer_discrete(expected_hmm, first_available_dim=-1, temperature=0)(data)
+    actual_init, actual_states = infer_discrete(actual_hmm, first_available_dim=-2, temperature=0)(data)
+    assert_equal(actual_init, expected_states[0])
+    assert_equal(actual_states.reshape(-1), torch.stack(expected_states[1:]))
+
+
 @pytest.mark.xfail(reason='infer_discrete log_prob is incorrect')
 @pytest.mark.parameterize('nderivs', [0, 1], ids=['value', 'grad'])
 def test_prob(nderivs):
@@ -528,6 +528,166 @@ def test_elbo_categoricals(enumerate1, enumerate2, enumerate3, max_plate_nesting
         ]))
 
 
+@pytest.mark.parameterize("one_hot", [False, True])
+@pytest.mark.parameterize("topk,topk_mass", [
+    (None, 0.5),
+    (1, None),
+    (3, None),
+    (3, 0.9),
+    (10, None),
+])
+def test_elbo_categorical_topk(topk, topk_mass, one_hot):
+    pyro.clear_param_store()
+    num_data = 4
+    probs = torch.tensor([0.02, 0.03, 0.05, 0.3, 0.1, 0.25, 0.05, 0.04, 0.06, 0.1])
+    locs = torch.arange(10.)
+    data = torch.tensor([3.5, 5., 0.2, 4.4])
+    d = dist.OneHotCategorical(probs) if one_hot else dist.Categorical(probs)
+
+    @config_enumerate(topk=topk, topk_mass=topk_mass)
+    def model():
+        with pyro.plate("data", num_data):
+            z = pyro.sample("z", d)
+            if one_hot:
+                z = z.max(-1)[1]
+            pyro.sample("x", dist.Normal(locs[z], 1.), obs=data)
+
+    elbo = TraceEnum_ELBO(max_plate_nesting=1)
+    actual_loss = elbo.loss(model, lambda: None)
+
+    # Enumerate the truncated support by hand.
+    k = len(probs) if topk is None else topk
+    if topk_mass is not None:
+        k = min(k, 1 + int((probs.sort(descending=True)[0].cumsum(0) < topk_mass).sum()))
+    support = probs.topk(k)[1]
+    log_probs = (probs[support] / probs[support].sum()).log()
+    log_likelihood = dist.Normal(locs[support], 1.).log_prob(data.unsqueeze(-1))
+    expected_loss = -(log_probs + log_likelihood).logsumexp(-1).sum().item()
+    assert_equal(actual_loss, expected_loss, prec=1e-4, msg="".join([
+        "\nexpected loss = {}".format(expected_loss),
+        "\n  actual loss = {}".format(actual_loss),
+    ]))
+
+
+def test_elbo_categorical_topk_bernoulli():
+    pyro.clear_param_store()
+    probs = torch.tensor([0.02, 0.03, 0.05, 0.3, 0.1, 0.25, 0.05, 0.04, 0.06, 0.1])
+    locs = torch.arange(10.)
+    data = torch.tensor([3.5, 5., 0.2, 4.4])
+
+    @config_enumerate(topk=3)
+    def model():
+        b = pyro.sample("b", dist.Bernoulli(0.3))
+        with pyro.plate("data", len(data)):
+            z = pyro.sample("z", dist.Categorical(probs))
+            pyro.sample("x", dist.Normal(locs[z] + 10. * b, 1.), obs=data)
+
+    elbo = TraceEnum_ELBO(max_plate_nesting=1)
+    actual_loss = elbo.loss(model, lambda: None)
+
+    # The Bernoulli site is fully enumerated, the Categorical site is truncated.
+    support = probs.topk(3)[1]
+    log_probs = (probs[support] / probs[support].sum()).log()
+    terms = []
+    for b, b_prob in [(0., 0.7), (1., 0.3)]:
+        log_likelihood = dist.Normal(locs[support] + 10. * b, 1.).log_prob(data.unsqueeze(-1))
+        terms.append(math.log(b_prob) + (log_probs + log_likelihood).logsumexp(-1).sum())
+    expected_loss = -torch.stack(terms).logsumexp(0).item()
+    assert_equal(actual_loss, expected_loss, prec=1e-4, msg="".join([
+        "\nexpected loss = {}".format(expected_loss),
+        "\n  actual loss = {}".format(actual_loss),
+    ]))
+
+
+def test_elbo_categorical_topk_guide():
+    pyro.clear_param_store()
+    p = torch.tensor([0.1, 0.2, 0.3, 0.4])
+    q = pyro.param("q", torch.tensor([0.4, 0.3, 0.2, 0.1], requires_grad=True))
+
+    def model():
+        pyro.sample("x", dist.Categorical(p))
+
+    @config_enumerate(topk=2)
+    def guide():
+        pyro.sample("x", dist.Categorical(pyro.param("q")))
+
+    # The guide is renormalized to its two most probable values.
+    q2 = q * torch.tensor([1., 1., 0., 0.])
+    q2 = q2 / q2.sum()
+    kl = (q2[:2] * (q2[:2].log() - p[:2].log())).sum()
+    expected_loss = kl.item()
+    expected_grad = grad(kl, [q])[0]
+
+    elbo = TraceEnum_ELBO(max_plate_nesting=0)
+    actual_loss = elbo.loss_and_grads(model, guide)
+    assert_equal(actual_loss, expected_loss, prec=1e-5)
+    assert_equal(q.grad, expected_grad, prec=1e-5)
+
+
+@pytest.mark.parameterize("chunk_size", [1, 3, 10, 20])
+def test_elbo_chunk_plate(chunk_size):
+    num_data = 10
+    data = torch.randn(num_data)
+
+    def model():
+        locs = pyro.sample("locs", dist.Normal(0., 3.).expand([3]).to_event(1))
+        b = pyro.sample("b", dist.Bernoulli(0.3))
+        with pyro.plate("data", num_data) as ind:
+            z = pyro.sample("z", dist.Categorical(torch.ones(3) / 3), infer={"enumerate": "parallel"})
+            w = pyro.sample("w", dist.Bernoulli(0.5))
+            pyro.sample("x", dist.Normal(locs[z] + w + b, 1.), obs=data[ind])
+
+    def guide():
+        loc = pyro.param("loc", torch.zeros(3))
+        pyro.sample("locs", dist.Normal(loc, 1.).to_event(1))
+        pb = pyro.param("pb", torch.tensor(0.4), constraint=constraints.unit_interval)
+        pyro.sample("b", dist.Bernoulli(pb))
+        pw = pyro.param("pw", torch.full((num_data,), 0.4), constraint=constraints.unit_interval)
+        with pyro.plate("data", num_data) as ind:
+            pyro.sample("w", dist.Bernoulli(pw[ind]), infer={"enumerate": "parallel"})
+
+    results = []
+    for elbo in [TraceEnum_ELBO(max_plate_nesting=1),
+                 TraceEnum_ELBO(max_plate_nesting=1, chunk_plate="data", chunk_size=chunk_size)]:
+        pyro.clear_param_store()
+        pyro.set_rng_seed(0)
+        loss = elbo.loss_and_grads(model, guide)
+        params = pyro.get_param_store()
+        results.append((loss, [params.get_param(name).unconstrained().grad for name in ["loc", "pb", "pw"]]))
+    (expected_loss, expected_grads), (actual_loss, actual_grads) = results
+
+    assert_equal(actual_loss, expected_loss, prec=1e-5)
+    for actual_grad, expected_grad in zip(actual_grads, expected_grads):
+        assert_equal(actual_grad, expected_grad, prec=1e-5)
+
+
+def test_elbo_chunk_plate_enumerated_global_error():
+    pyro.clear_param_store()
+
+    @config_enumerate
+    def model():
+        z = pyro.sample("z", dist.Bernoulli(0.5))
+        with pyro.plate("data", 10) as ind:
+            pyro.sample("x", dist.Normal(z, 1.), obs=torch.zeros(10)[ind])
+
+    elbo = TraceEnum_ELBO(max_plate_nesting=1, chunk_plate="data", chunk_size=3)
+    with pytest.raises(NotImplementedError):
+        elbo.loss(model, lambda: None)
+
+
+@pytest.mark.parameterize("kwargs", [
+    {"topk": 0},
+    {"topk": 1.5},
+    {"topk_mass": 0.},
+    {"topk_mass": 1.5},
+    {"topk": 2, "num_samples": 10},
+    {"topk": 2, "default": "sequential"},
+])
+def test_config_enumerate_topk_error(kwargs):
+    with pytest.raises(ValueError):
+        config_enumerate(**kwargs)
+
+
 @pytest.mark.parameterize("enumerate1", [None, "parallel"])
 @pytest.mark.parameterize("enumerate2", [None, "parallel"])
 @pytest.mark.parameterize("enumerate3", [None, "parallel"])
@@ -1259,6 +1419,41 @@ def test_hmm_enumerate_model_and_guide(num_steps):
     elbo.differentiable_loss(model, guide, data)
 
 
+@pytest.mark.parameterize('num_steps', [1, 2, 3, 4, 5, 10, 20])
+def test_hmm_enumerate_vectorized_markov(num_steps):
+    data = dist.Categorical(torch.tensor([0.5, 0.5])).sample((2, num_steps))
+    transition_probs = pyro.param("transition_probs",
+                                  torch.tensor([[0.75, 0.25], [0.25, 0.75]]),
+                                  constraint=constraints.simplex)
+    emission_probs = pyro.param("emission_probs",
+                                torch.tensor([[0.75, 0.25], [0.25, 0.75]]),
+                                constraint=constraints.simplex)
+
+    @config_enumerate
+    def expected_model(data):
+        with pyro.plate("sequences", len(data), dim=-1):
+            x = pyro.sample("x", dist.Categorical(torch.tensor([0.5, 0.5])))
+            for t in pyro.markov(range(num_steps)):
+                x = pyro.sample("x_{}".format(t), dist.Categorical(transition_probs[x]))
+                pyro.sample("y_{}".format(t), dist.Categorical(emission_probs[x]), obs=data[:, t])
+
+    @config_enumerate
+    def actual_model(data):
+        with pyro.plate("sequences", len(data), dim=-2):
+            x = pyro.sample("x", dist.Categorical(torch.tensor([0.5, 0.5])))
+            with pyro.vectorized_markov("time", num_steps, dim=-1):
+                x = pyro.sample("x_t", dist.Categorical(transition_probs[x]),
+                                infer={"markov_prev": "x"})
+                pyro.sample("y_t", dist.Categorical(emission_probs[x]), obs=data)
+
+    def guide(data):
+        pass
+
+    expected_loss = TraceEnum_ELBO(max_plate_nesting=1).differentiable_loss(expected_model, guide, data)
+    actual_loss = TraceEnum_ELBO(max_plate_nesting=2).differentiable_loss(actual_model, guide, data)
+    _check_loss_and_grads(expected_loss, actual_loss)
+
+
 def _check_loss_and_grads(expected_loss, actual_loss):
     assert_equal(actual_loss, expected_loss,
                  msg='Expected:\n{}\nActual:\n{}'.format(expected_loss.detach().cpu().numpy(),
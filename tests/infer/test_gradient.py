@@ -9,8 +9,8 @@ import pyro
 import pyro.distributions as dist
 import pyro.poutine as poutine
 from pyro.distributions.testing import fakes
-from pyro.infer import (SVI, JitTrace_ELBO, JitTraceEnum_ELBO, JitTraceGraph_ELBO, JitTraceMeanField_ELBO, Trace_ELBO,
-                        TraceEnum_ELBO, TraceGraph_ELBO, TraceMeanField_ELBO, config_enumerate)
+from pyro.infer import (SVI, JitTrace_ELBO, JitTraceEnum_ELBO, JitTraceGraph_ELBO, JitTraceMeanField_ELBO, RenyiELBO,
+                        Trace_ELBO, TraceEnum_ELBO, TraceGraph_ELBO, TraceMeanField_ELBO, config_enumerate)
 from pyro.optim import Adam
 from tests.common import assert_equal, xfail_if_not_implemented, xfail_param
 
@@ -177,6 +177,70 @@ def test_plate_elbo_vectorized_particles(Elbo, reparameterized):
     assert_equal(actual_grads, expected_grads, prec=precision)
 
 
+def test_decaying_avg_baseline_vectorized_particles():
+    pyro.clear_param_store()
+    data = torch.tensor([-0.5, 2.0])
+    num_particles = 200000
+    precision = 0.06
+
+    def model():
+        with pyro.plate("data", len(data)):
+            z = pyro.sample("z", fakes.NonreparameterizedNormal(0, 1))
+            pyro.sample("x", dist.Normal(z, 1), obs=data)
+
+    def guide():
+        loc = pyro.param("loc", torch.zeros(len(data)))
+        scale = pyro.param("scale", torch.tensor([1.]))
+        with pyro.plate("data", len(data)):
+            pyro.sample("z", fakes.NonreparameterizedNormal(loc, scale),
+                        infer=dict(baseline={"use_decaying_avg_baseline": True, "baseline_beta": 0.5}))
+
+    elbo = TraceGraph_ELBO(num_particles=num_particles, vectorize_particles=True)
+    for step in range(2):
+        for param in pyro.get_param_store().values():
+            param.grad = None
+        elbo.loss_and_grads(model, guide)
+
+    # the baseline is shared among particles
+    baseline = pyro.param("__baseline_avg_downstream_cost_z")
+    assert baseline.shape == (1, len(data))
+
+    params = dict(pyro.get_param_store().named_parameters())
+    actual_grads = {name: params[name].grad.detach().cpu().numpy() for name in ["loc", "scale"]}
+    expected_grads = {'loc': np.array([0.5, -2.0]), 'scale': np.array([2.0])}
+    assert_equal(actual_grads, expected_grads, prec=precision)
+
+
+@pytest.mark.parameterize("alpha", [0., 0.5])
+def test_renyi_elbo_vectorized_particles(alpha):
+    data = torch.tensor([-0.5, 2.0, 1.0])
+
+    def model():
+        w = pyro.sample("w", dist.Normal(0., 1.))
+        with pyro.plate("data", len(data)):
+            z = pyro.sample("z", dist.Normal(w, 1.))
+            pyro.sample("x", dist.Normal(z, 1.), obs=data)
+
+    def guide():
+        w_loc = pyro.param("w_loc", torch.tensor(0.5))
+        z_loc = pyro.param("z_loc", torch.zeros(len(data)))
+        pyro.sample("w", dist.Delta(w_loc))
+        with pyro.plate("data", len(data)):
+            pyro.sample("z", dist.Delta(z_loc))
+
+    # with deterministic guides, all particles coincide
+    results = []
+    for vectorize_particles in [False, True]:
+        pyro.clear_param_store()
+        elbo = RenyiELBO(alpha=alpha, num_particles=4, vectorize_particles=vectorize_particles)
+        loss = elbo.loss_and_grads(model, guide)
+        params = dict(pyro.get_param_store().named_parameters())
+        grads = {name: param.grad.detach() for name, param in params.items()}
+        results.append((loss, elbo.loss(model, guide), grads))
+
+    assert_equal(results[1], results[0], prec=1e-5)
+
+
 @pytest.mark.parameterize("reparameterized", [True, False], ids=["reparam", "nonreparam"])
 @pytest.mark.parameterize("subsample", [False, True], ids=["full", "subsample"])
 @pytest.mark.parameterize("Elbo", [
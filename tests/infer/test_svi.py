@@ -0,0 +1,120 @@
+import os
+import socket
+
+import pytest
+import torch
+
+import pyro
+import pyro.distributions as dist
+import pyro.optim as optim
+from pyro.infer import SVI, DataParallelSVI, Trace_ELBO
+from pyro.infer.svi import _prefetch
+from tests.common import assert_equal
+
+
+def model(data):
+    loc = pyro.param("loc", torch.tensor(0.))
+    with pyro.plate("data", len(data)):
+        pyro.sample("x", dist.Normal(loc, 1.), obs=data)
+
+
+def guide(data):
+    pass
+
+
+def tensor_loss(model, guide, *args, **kwargs):
+    return Trace_ELBO().differentiable_loss(model, guide, *args, **kwargs)
+
+
+@pytest.mark.parameterize("loss_read_interval", [1, 3, 10])
+@pytest.mark.parameterize("loss_type", ["elbo", "tensor"])
+def test_run_stream_matches_step(loss_type, loss_read_interval):
+    loss = Trace_ELBO() if loss_type == "elbo" else tensor_loss
+    batches = [torch.randn(4) + i for i in range(7)]
+
+    pyro.clear_param_store()
+    svi = SVI(model, guide, optim.Adam({"lr": 0.1}), loss=loss)
+    expected = [svi.step(batch) for batch in batches]
+    expected_loc = pyro.param("loc").detach().clone()
+
+    pyro.clear_param_store()
+    svi = SVI(model, guide, optim.Adam({"lr": 0.1}), loss=loss)
+    actual = svi.run_stream(iter(batches), num_prefetch=2, loss_read_interval=loss_read_interval)
+
+    assert all(isinstance(x, float) for x in actual)
+    assert_equal(actual, expected, prec=1e-5)
+    assert_equal(pyro.param("loc").detach(), expected_loc, prec=1e-5)
+
+
+def test_run_stream_num_steps_and_collate():
+    pyro.clear_param_store()
+    svi = SVI(model, guide, optim.Adam({"lr": 0.1}), loss=Trace_ELBO())
+    batches = ([float(i)] * 3 for i in range(100))
+    losses = svi.run_stream(batches, num_steps=5, collate_fn=lambda b: (torch.tensor(b),))
+    assert len(losses) == 5
+    # no minibatch beyond num_steps is consumed
+    assert next(batches) == [5.] * 3
+
+
+@pytest.mark.parameterize("num_prefetch", [1, 2, 5])
+def test_prefetch_order(num_prefetch):
+    actual = list(_prefetch(range(20), num_prefetch, lambda x: x * x))
+    assert actual == [x * x for x in range(20)]
+
+
+def test_prefetch_error():
+    def batches():
+        yield 1
+        raise ValueError("bad batch")
+
+    items = _prefetch(batches(), 1, lambda x: x)
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="bad batch"):
+        next(items)
+
+
+def data_parallel_model(data):
+    z = pyro.sample("z", dist.Normal(0., 1.))
+    with pyro.plate("data", len(data)):
+        pyro.sample("x", dist.Normal(z, 1.), obs=data)
+
+
+def data_parallel_guide(data):
+    z_loc = pyro.param("z_loc", lambda: torch.randn(()))
+    pyro.sample("z", dist.Delta(z_loc))
+
+
+def _data_parallel_worker(rank, world_size, port, data, filename):
+    torch.set_num_threads(1)
+    torch.distributed.init_process_group("gloo", init_method="tcp://127.0.0.1:{}".format(port),
+                                         rank=rank, world_size=world_size)
+    pyro.clear_param_store()
+    torch.manual_seed(rank)  # workers initialize params differently
+    svi = DataParallelSVI(data_parallel_model, data_parallel_guide, optim.Adam({"lr": 0.1}),
+                          Trace_ELBO(), plate="data")
+    shard = svi.shard(data)
+    losses = [svi.step(shard) for _ in range(5)]
+    if rank == 0:
+        torch.save((losses, pyro.param("z_loc").detach()), filename)
+    torch.distributed.destroy_process_group()
+
+
+@pytest.mark.skipif(not torch.distributed.is_available(), reason="torch.distributed is not available")
+def test_data_parallel_svi(tmpdir):
+    data = torch.randn(10) + 3.
+
+    pyro.clear_param_store()
+    torch.manual_seed(0)
+    svi = SVI(data_parallel_model, data_parallel_guide, optim.Adam({"lr": 0.1}), Trace_ELBO())
+    expected_losses = [svi.step(data) for _ in range(5)]
+    expected_z_loc = pyro.param("z_loc").detach()
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    filename = os.path.join(str(tmpdir), "result.pt")
+    torch.multiprocessing.spawn(_data_parallel_worker, args=(2, port, data, filename), nprocs=2)
+    actual_losses, actual_z_loc = torch.load(filename)
+
+    assert_equal(actual_losses, expected_losses, prec=1e-4)
+    assert_equal(actual_z_loc, expected_z_loc, prec=1e-5)
@@ -6,8 +6,9 @@ import pyro
 import pyro.distributions as dist
 import pyro.poutine as poutine
 import pytest
+from pyro.infer.enum import get_importance_trace
 from pyro.infer.importance import psis_diagnostic
-from pyro.infer.util import MultiFrameTensor
+from pyro.infer.util import MultiFrameTensor, TraceStructureCache, get_plate_stacks
 from tests.common import assert_equal
 
 
@@ -48,6 +49,31 @@ def test_multi_frame_tensor():
         assert_equal(actual_sum, expected_sum, msg=name)
 
 
+def test_trace_structure_cache(monkeypatch):
+    calls = []
+    monkeypatch.setattr(pyro.infer.enum, "check_model_guide_match", lambda *args: calls.append(args))
+
+    def model(size):
+        with pyro.plate("data", size):
+            pyro.sample("x", dist.Normal(0., 1.))
+
+    def guide(size):
+        with pyro.plate("data", size):
+            pyro.sample("x", dist.Normal(0., 2.))
+
+    cache = TraceStructureCache()
+    with pyro.validation_enabled():
+        for _ in range(3):
+            model_trace, _ = get_importance_trace("flat", 1, model, guide, 3, structure_cache=cache)
+        assert len(calls) == 1
+        assert cache.get_plate_stacks(model_trace) == get_plate_stacks(model_trace)
+
+        # a change of structure invalidates the cache
+        model_trace, _ = get_importance_trace("flat", 1, model, guide, 4, structure_cache=cache)
+        assert len(calls) == 2
+        assert cache.get_plate_stacks(model_trace) == get_plate_stacks(model_trace)
+
+
 @pytest.mark.parameterize('max_particles', [250 * 1000, 500 * 1000])
 @pytest.mark.parameterize('scale,krange', [(0.5, (0.7, 0.9)),
                                           (0.95, (0.05, 0.2))])
@@ -1,7 +1,7 @@
 import torch
 
 import pyro.distributions as dist
-from pyro.ops.gaussian import Gaussian
+from pyro.ops.gaussian import Gaussian, SqrtGaussian
 from tests.common import assert_close
 
 
@@ -21,6 +21,21 @@ def random_gaussian(batch_shape, dim, rank=None):
     return result
 
 
+def random_sqrt_gaussian(batch_shape, dim, rank=None):
+    """
+    Generate a random SqrtGaussian for testing.
+    """
+    if rank is None:
+        rank = dim + dim
+    log_normalizer = torch.randn(batch_shape)
+    white_vec = torch.randn(batch_shape + (rank,))
+    prec_sqrt = torch.randn(batch_shape + (dim, rank))
+    result = SqrtGaussian(log_normalizer, white_vec, prec_sqrt)
+    assert result.dim() == dim
+    assert result.batch_shape == batch_shape
+    return result
+
+
 def random_mvn(batch_shape, dim):
     """
     Generate a random MultivariateNormal distribution for testing.
@@ -8,7 +8,8 @@ import torch
 
 import pyro.ops.jit
 from pyro.distributions.util import logsumexp
-from pyro.ops.contract import _partition_terms, contract_tensor_tree, contract_to_tensor, einsum, naive_ubersum, ubersum
+from pyro.ops.contract import (_partition_terms, _plan_partition, contract_tensor_tree, contract_to_tensor, einsum,
+                               naive_ubersum, ubersum)
 from pyro.ops.einsum.adjoint import require_backward
 from pyro.ops.rings import LogRing
 from pyro.poutine.indep_messenger import CondIndepStackFrame
@@ -127,6 +128,26 @@ def test_partition_terms(inputs, dims, expected_num_components):
                     assert component_dict[x] == component_dict[y]
 
 
+def test_partition_terms_cached():
+    ring = LogRing()
+    inputs = ['a', 'ab', 'bc', 'c']
+    dims = set('ac')
+    components = []
+    _plan_partition.cache_clear()
+    for _ in range(2):
+        tensors = [torch.randn((2,) * len(input_)) for input_ in inputs]
+        for input_, tensor in zip(inputs, tensors):
+            tensor._pyro_dims = input_
+        # terms with the same structure are partitioned in the same way
+        positions = {id(x): i for i, x in enumerate(tensors)}
+        components.append([([positions[id(x)] for x in terms], component_dims)
+                           for terms, component_dims in _partition_terms(ring, tensors, dims)])
+    assert components[0] == components[1]
+    cache_info = _plan_partition.cache_info()
+    assert cache_info.misses == 1
+    assert cache_info.hits == 1
+
+
 def frame(dim, size):
     return CondIndepStackFrame(name="plate_{}".format(size), dim=dim, size=size, counter=0)
 
@@ -6,9 +6,10 @@ from torch.nn.functional import pad
 
 import pyro.distributions as dist
 from pyro.distributions.util import broadcast_shape
-from pyro.ops.gaussian import AffineNormal, Gaussian, gaussian_tensordot, matrix_and_mvn_to_gaussian, mvn_to_gaussian
+from pyro.ops.gaussian import (AffineNormal, Gaussian, SqrtGaussian, gaussian_tensordot, matrix_and_mvn_to_gaussian,
+                               matrix_and_mvn_to_sqrt_gaussian, mvn_to_gaussian, mvn_to_sqrt_gaussian)
 from tests.common import assert_close
-from tests.ops.gaussian import assert_close_gaussian, random_gaussian, random_mvn
+from tests.ops.gaussian import assert_close_gaussian, random_gaussian, random_mvn, random_sqrt_gaussian
 
 
 @pytest.mark.parameterize("extra_shape", [(), (4,), (3, 2)], ids=str)
@@ -313,3 +314,159 @@ def test_gaussian_tensordot(dot_dims,
     # TODO(fehiepsi): find some condition to make this test stable, so we can compare large value
     # log densities.
     assert_close(actual.clamp(max=10.), expect.clamp(max=10.), atol=0.1, rtol=0.1)
+
+
+@pytest.mark.parameterize("shape,cat_dim,split", [
+    ((4, 7, 6), -1, (2, 1, 3)),
+    ((4, 7, 6), -2, (1, 1, 2, 3)),
+    ((4, 7, 6), 1, (1, 1, 2, 3)),
+], ids=str)
+@pytest.mark.parameterize("dim", [1, 2, 3])
+def test_sqrt_cat(shape, cat_dim, split, dim):
+    assert sum(split) == shape[cat_dim]
+    gaussian = random_sqrt_gaussian(shape, dim)
+    parts = []
+    end = 0
+    for size in split:
+        beg, end = end, end + size
+        index = (slice(None),) * (cat_dim % len(shape)) + (slice(beg, end),)
+        part = gaussian[index]
+        # Parts may have different ranks.
+        part = SqrtGaussian(part.log_normalizer, pad(part.white_vec, (0, size)),
+                            pad(part.prec_sqrt, (0, size)))
+        parts.append(part)
+
+    actual = SqrtGaussian.cat(parts, cat_dim)
+    assert_close_gaussian(actual.to_gaussian(), gaussian.to_gaussian())
+
+
+@pytest.mark.parameterize("shape", [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize("dim", [1, 2, 3])
+@pytest.mark.parameterize("left", [0, 1, 2])
+@pytest.mark.parameterize("right", [0, 1, 2])
+def test_sqrt_pad(shape, left, right, dim):
+    g = random_sqrt_gaussian(shape, dim)
+    assert_close_gaussian(g.event_pad(left=left, right=right).to_gaussian(),
+                          g.to_gaussian().event_pad(left=left, right=right))
+
+
+@pytest.mark.parameterize("shape", [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize("dim", [1, 2, 3])
+def test_sqrt_add(shape, dim):
+    x = random_sqrt_gaussian(shape, dim)
+    y = random_sqrt_gaussian((), dim, rank=1)
+    assert_close_gaussian((x + y).to_gaussian(), x.to_gaussian() + y.to_gaussian())
+
+
+@pytest.mark.parameterize("sample_shape", [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize("batch_shape", [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize("left", [1, 2, 3])
+@pytest.mark.parameterize("right", [1, 2, 3])
+def test_sqrt_condition(sample_shape, batch_shape, left, right):
+    dim = left + right
+    g = random_sqrt_gaussian(batch_shape, dim)
+    value = torch.randn(sample_shape + (1,) * len(batch_shape) + (dim,))
+    left_value, right_value = value[..., :left], value[..., left:]
+
+    conditioned = g.condition(right_value)
+    assert conditioned.batch_shape == sample_shape + g.batch_shape
+    assert conditioned.dim() == left
+    assert_close(conditioned.log_density(left_value), g.log_density(value))
+    assert_close(g.log_density(value), g.to_gaussian().log_density(value))
+
+
+@pytest.mark.parameterize("batch_shape", [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize("left", [1, 2, 3])
+@pytest.mark.parameterize("right", [1, 2, 3])
+@pytest.mark.parameterize("rank", [None, 1], ids=["full", "low"])
+def test_sqrt_marginalize(batch_shape, left, right, rank):
+    dim = left + right
+    g = random_sqrt_gaussian(batch_shape, dim, None if rank is None else left)
+    expected = g.to_gaussian().marginalize(left=left)
+    assert_close_gaussian(g.marginalize(left=left).to_gaussian(), expected)
+
+    g = random_sqrt_gaussian(batch_shape, dim, None if rank is None else right)
+    expected = g.to_gaussian().marginalize(right=right)
+    assert_close_gaussian(g.marginalize(right=right).to_gaussian(), expected)
+
+
+@pytest.mark.parameterize("batch_shape", [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize("dim", [1, 2, 3])
+def test_sqrt_logsumexp(batch_shape, dim):
+    g = random_sqrt_gaussian(batch_shape, dim)
+    assert_close(g.event_logsumexp(), g.to_gaussian().event_logsumexp())
+
+
+@pytest.mark.parameterize("sample_shape", [(), (7,), (6, 5)], ids=str)
+@pytest.mark.parameterize("batch_shape", [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize("dim", [1, 2, 3])
+def test_mvn_to_sqrt_gaussian(sample_shape, batch_shape, dim):
+    mvn = random_mvn(batch_shape, dim)
+    gaussian = mvn_to_sqrt_gaussian(mvn)
+    value = mvn.sample(sample_shape)
+    actual_log_prob = gaussian.log_density(value)
+    expected_log_prob = mvn.log_prob(value)
+    assert_close(actual_log_prob, expected_log_prob)
+
+
+@pytest.mark.parameterize("batch_shape", [(), (4,), (3, 2)], ids=str)
+@pytest.mark.parameterize("x_dim", [1, 2, 3])
+@pytest.mark.parameterize("y_dim", [1, 2, 3])
+@pytest.mark.parameterize("diag", [False, True], ids=["full", "diag"])
+def test_matrix_and_mvn_to_sqrt_gaussian(batch_shape, x_dim, y_dim, diag):
+    matrix = torch.randn(batch_shape + (x_dim, y_dim))
+    y_mvn = random_mvn(batch_shape, y_dim)
+    if diag:
+        scale = y_mvn.scale_tril.diagonal(dim1=-2, dim2=-1)
+        y_mvn = dist.MultivariateNormal(y_mvn.loc, scale_tril=scale.diag_embed())
+        noise = dist.Normal(y_mvn.loc, scale).to_event(1)
+    else:
+        noise = y_mvn
+    actual = matrix_and_mvn_to_sqrt_gaussian(matrix, noise)
+    assert isinstance(actual, SqrtGaussian)
+    expected = matrix_and_mvn_to_gaussian(matrix, y_mvn)
+    assert_close_gaussian(actual.to_gaussian(), expected)
+
+
+@pytest.mark.parameterize("x_batch_shape,y_batch_shape", [
+    ((), ()),
+    ((3,), ()),
+    ((), (3,)),
+    ((2, 1), (3,)),
+    ((2, 3), (2, 3,)),
+], ids=str)
+@pytest.mark.parameterize("x_dim,y_dim,dot_dims", [
+    (0, 0, 0),
+    (0, 2, 0),
+    (1, 0, 0),
+    (2, 1, 0),
+    (3, 3, 3),
+    (3, 2, 1),
+    (3, 2, 2),
+    (5, 4, 2),
+], ids=str)
+@pytest.mark.parameterize("x_rank,y_rank", [
+    (1, 1), (4, 1), (1, 4), (4, 4)
+], ids=str)
+def test_sqrt_gaussian_tensordot(dot_dims,
+                                 x_batch_shape, x_dim, x_rank,
+                                 y_batch_shape, y_dim, y_rank):
+    x = random_sqrt_gaussian(x_batch_shape, x_dim, x_rank)
+    y = random_sqrt_gaussian(y_batch_shape, y_dim, y_rank)
+    na = x_dim - dot_dims
+    nb = dot_dims
+    x_dense = x.to_gaussian()
+    y_dense = y.to_gaussian()
+    if x_rank + y_rank < nb:
+        pytest.skip("Cannot marginalize the common variables of two Gaussians.")
+    try:
+        torch.cholesky(x_dense.precision[..., na:, na:] + y_dense.precision[..., :nb, :nb])
+    except RuntimeError:
+        pytest.skip("Cannot marginalize the common variables of two Gaussians.")
+
+    actual = gaussian_tensordot(x, y, dot_dims)
+    assert isinstance(actual, SqrtGaussian)
+    assert actual.dim() == x_dim + y_dim - 2 * dot_dims
+    assert actual.rank() <= x_rank + y_rank
+    expected = gaussian_tensordot(x_dense, y_dense, dot_dims)
+    assert_close_gaussian(actual.to_gaussian(), expected)
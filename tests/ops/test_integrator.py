@@ -4,7 +4,7 @@ from collections import namedtuple
 import pytest
 import torch
 
-from pyro.ops.integrator import velocity_verlet
+from pyro.ops.integrator import velocity_verlet, velocity_verlet_packed
 from tests.common import assert_equal
 
 logger = logging.getLogger(__name__)
@@ -148,3 +148,45 @@ def test_time_reversibility(example):
                                      args.step_size,
                                      args.num_steps)
     assert_equal(q_f, args.q_i, 1e-5)
+
+
+@pytest.mark.parameterize('example', TEST_EXAMPLES, ids=EXAMPLE_IDS)
+def test_packed_trajectory(example):
+    model, args = example
+    names = sorted(args.q_i)
+
+    def pack(x):
+        return torch.cat([x[name].reshape(-1) for name in names])
+
+    def unpack(x):
+        return {name: x[i:i + 1] for i, name in enumerate(names)}
+
+    def potential_fn(q):
+        return model.potential_fn(unpack(q)).sum()
+
+    q, p = pack(args.q_i), pack(args.p_i)
+    q_f, p_f, _, _ = velocity_verlet_packed(q,
+                                            p,
+                                            potential_fn,
+                                            model.inverse_mass_matrix,
+                                            args.step_size,
+                                            args.num_steps)
+    # packed tensors are updated in place
+    assert q_f is q
+    assert p_f is p
+    assert_equal(unpack(q_f), args.q_f, args.prec)
+    assert_equal(unpack(p_f), args.p_f, args.prec)
+
+
+def test_packed_zero_steps():
+    inverse_mass_matrix = torch.ones(2)
+
+    def potential_fn(q):
+        return 0.5 * (q ** 2).sum()
+
+    q, p = torch.tensor([1., 2.]), torch.tensor([0.5, -0.5])
+    q_f, p_f, _, potential_energy = velocity_verlet_packed(q, p, potential_fn, inverse_mass_matrix,
+                                                           0.1, num_steps=0, z_grads=q.clone())
+    assert_equal(q_f, torch.tensor([1., 2.]))
+    assert_equal(p_f, torch.tensor([0.5, -0.5]))
+    assert_equal(potential_energy, torch.tensor(2.5))
@@ -193,6 +193,17 @@ def test_diagnostics_ok_with_sample_shape(diagnostics, sample_shape):
         assert_equal(diagnostics(c, sample_dim=-1), y)
 
 
+@pytest.mark.parameterize('diagnostics', [split_gelman_rubin, effective_sample_size])
+@pytest.mark.parameterize('batch_size', [1, 4, 10])
+def test_diagnostics_batched(diagnostics, batch_size):
+    xs = torch.rand(4, 100, 2, 3)
+
+    with xfail_if_not_implemented():
+        assert_equal(diagnostics(xs, batch_size=batch_size), diagnostics(xs))
+        a = xs.transpose(0, 1)
+        assert_equal(diagnostics(a, chain_dim=1, sample_dim=0, batch_size=batch_size), diagnostics(xs))
+
+
 def test_waic():
     x = - torch.arange(1., 101).log().reshape(25, 4)
     w_pw, p_pw = waic(x, pointwise=True)
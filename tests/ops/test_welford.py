@@ -49,3 +49,20 @@ def test_welford_dense(n_samples, dim_size):
         estimates = w.get_covariance(regularize=False).data.cpu().numpy()
         sample_cov = np.cov(torch.stack(samples).data.cpu().numpy(), bias=False, rowvar=False)
         assert_equal(estimates, sample_cov)
+
+
+@pytest.mark.parameterize('diagonal', [True, False])
+@pytest.mark.init(rng_seed=7)
+def test_welford_batched(diagonal):
+    batch_size, n_samples, dim_size = 3, 100, 4
+    w = WelfordCovariance(diagonal=diagonal)
+    samples = torch.randn(n_samples, batch_size, dim_size)
+    for sample in samples:
+        w.update(sample)
+
+    estimates = w.get_covariance(regularize=False)
+    for i in range(batch_size):
+        w_i = WelfordCovariance(diagonal=diagonal)
+        for sample in samples[:, i]:
+            w_i.update(sample)
+        assert_equal(estimates[i], w_i.get_covariance(regularize=False))
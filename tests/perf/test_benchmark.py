@@ -6,13 +6,15 @@ from collections import namedtuple
 
 import pytest
 import torch
+from torch.distributions import constraints
 
 import pyro
 import pyro.contrib.gp as gp
 import pyro.distributions as dist
 import pyro.optim as optim
 from pyro.distributions.testing import fakes
-from pyro.infer import SVI, Trace_ELBO, TraceGraph_ELBO
+from pyro.infer import (SVI, RenyiELBO, Trace_ELBO, TraceEnum_ELBO, TraceGraph_ELBO, TraceMeanField_ELBO,
+                        TraceTailAdaptive_ELBO)
 from pyro.infer.mcmc.hmc import HMC
 from pyro.infer.mcmc.api import MCMC
 from pyro.infer.mcmc.nuts import NUTS
@@ -75,6 +77,39 @@ def poisson_gamma_model(reparameterized, Elbo):
         svi.step()
 
 
+@register_model(Elbo=TraceTailAdaptive_ELBO, id='VectorizedParticles::TraceTailAdaptive')
+@register_model(Elbo=RenyiELBO, id='VectorizedParticles::Renyi')
+@register_model(Elbo=TraceMeanField_ELBO, id='VectorizedParticles::TraceMeanField')
+@register_model(Elbo=TraceEnum_ELBO, id='VectorizedParticles::TraceEnum')
+@register_model(Elbo=TraceGraph_ELBO, id='VectorizedParticles::TraceGraph')
+@register_model(Elbo=Trace_ELBO, id='VectorizedParticles::Trace')
+def vectorized_particles(Elbo):
+    # With vectorized particles, each step is a single batched forward and
+    # backward pass over num_particles=64.
+    pyro.set_rng_seed(0)
+    data = torch.randn(100) + 3.
+
+    def model():
+        loc = pyro.sample("loc", dist.Normal(0., 10.))
+        with pyro.plate("data", len(data)):
+            z = pyro.sample("z", dist.Normal(loc, 1.))
+            pyro.sample("obs", dist.Normal(z, 1.), obs=data)
+
+    def guide():
+        loc_loc = pyro.param("loc_loc", torch.tensor(0.))
+        z_loc = pyro.param("z_loc", torch.zeros(len(data)))
+        z_scale = pyro.param("z_scale", torch.ones(len(data)), constraint=constraints.positive)
+        pyro.sample("loc", dist.Normal(loc_loc, 1.))
+        with pyro.plate("data", len(data)):
+            pyro.sample("z", dist.Normal(z_loc, z_scale))
+
+    pyro.clear_param_store()
+    elbo = Elbo(num_particles=64, vectorize_particles=True, max_plate_nesting=1)
+    svi = SVI(model, guide, optim.Adam({"lr": 0.01}), loss=elbo)
+    for k in range(100):
+        svi.step()
+
+
 @register_model(kernel=NUTS, step_size=0.02, num_samples=300, id='BernoulliBeta::NUTS')
 @register_model(kernel=HMC, step_size=0.02, num_steps=3, num_samples=1000, id='BernoulliBeta::HMC')
 def bernoulli_beta_hmc(**kwargs):
@@ -96,6 +131,47 @@ def bernoulli_beta_hmc(**kwargs):
     return mcmc.get_samples()['p_latent']
 
 
+@register_model(max_tree_depth=10, id='NUTS::tree_depth=10')
+@register_model(max_tree_depth=8, id='NUTS::tree_depth=8')
+def nuts_tree_building(max_tree_depth):
+    # With a cheap potential energy and a small step size, each trajectory reaches
+    # the maximum tree depth, i.e. takes 2 ** max_tree_depth - 1 leapfrog steps,
+    # so the run time reflects the overhead per leaf of building trees.
+    def potential_fn(params):
+        return 0.5 * params['x'].pow(2).sum()
+
+    pyro.set_rng_seed(0)
+    kernel = NUTS(potential_fn=potential_fn, step_size=1e-3, adapt_step_size=False,
+                  adapt_mass_matrix=False, max_tree_depth=max_tree_depth)
+    mcmc = MCMC(kernel, num_samples=5, warmup_steps=0, initial_params={'x': torch.zeros(10)},
+                disable_progbar=True)
+    mcmc.run()
+
+
+@register_model(hidden_dim=64, square_root=True, id='GaussianHMM::hidden_dim=64_square_root=True')
+@register_model(hidden_dim=64, square_root=False, id='GaussianHMM::hidden_dim=64_square_root=False')
+@register_model(hidden_dim=16, square_root=True, id='GaussianHMM::hidden_dim=16_square_root=True')
+@register_model(hidden_dim=16, square_root=False, id='GaussianHMM::hidden_dim=16_square_root=False')
+@register_model(hidden_dim=4, square_root=True, id='GaussianHMM::hidden_dim=4_square_root=True')
+@register_model(hidden_dim=4, square_root=False, id='GaussianHMM::hidden_dim=4_square_root=False')
+@register_model(hidden_dim=2, square_root=True, id='GaussianHMM::hidden_dim=2_square_root=True')
+@register_model(hidden_dim=2, square_root=False, id='GaussianHMM::hidden_dim=2_square_root=False')
+def gaussian_hmm_log_prob(hidden_dim, square_root):
+    # Each step differentiates log_prob through the parallel-scan contraction,
+    # which is dominated by batched Cholesky (dense) or QR (square root) solves.
+    pyro.set_rng_seed(0)
+    num_steps, obs_dim = 256, 4
+    init_dist = dist.MultivariateNormal(torch.zeros(hidden_dim), torch.eye(hidden_dim))
+    trans_mat = (0.5 * torch.randn(num_steps, hidden_dim, hidden_dim) / hidden_dim ** 0.5).requires_grad_()
+    trans_dist = dist.MultivariateNormal(torch.zeros(num_steps, hidden_dim), torch.eye(hidden_dim))
+    obs_mat = torch.randn(hidden_dim, obs_dim).requires_grad_()
+    obs_dist = dist.Normal(torch.zeros(obs_dim), torch.ones(obs_dim)).to_event(1)
+    data = torch.randn(num_steps, obs_dim)
+    for _ in range(10):
+        d = dist.GaussianHMM(init_dist, trans_mat, trans_dist, obs_mat, obs_dist, square_root=square_root)
+        d.log_prob(data).backward()
+
+
 @register_model(num_steps=2000, whiten=False, id='VSGP::MultiClass_whiten=False')
 @register_model(num_steps=2000, whiten=True, id='VSGP::MultiClass_whiten=True')
 def vsgp_multiclass(num_steps, whiten):
@@ -6,7 +6,8 @@ import torch
 import pyro
 import pyro.distributions as dist
 import pyro.poutine as poutine
-from tests.common import requires_cuda
+from pyro.poutine.subsample_messenger import ShuffledSubsampler, StratifiedSubsampler, WeightedSubsampler
+from tests.common import assert_equal, requires_cuda
 
 logger = logging.getLogger(__name__)
 
@@ -158,3 +159,75 @@ def test_model_guide_mismatch(behavior, model_size, guide_size, model):
     else:
         with pytest.raises(ValueError):
             poutine.replay(model, trace=model.trace)(model_size)
+
+
+def test_shuffled_subsampler_epochs():
+    pyro.set_rng_seed(0)
+    subsampler = ShuffledSubsampler(12, 4)
+    for epoch in range(3):
+        batches = []
+        for step in range(3):
+            with pyro.plate("data", subsample=subsampler) as ind:
+                batches.append(ind)
+        assert sorted(torch.cat(batches).tolist()) == list(range(12))
+
+
+def subsampler_model(subsampler, data):
+    with pyro.plate("data", len(data), subsample=subsampler) as ind:
+        pyro.sample("x", dist.Normal(0., 1.), obs=data[ind])
+
+
+@pytest.mark.parameterize("subsampler", [
+    ShuffledSubsampler(10, 3),
+    StratifiedSubsampler(torch.tensor([0, 0, 0, 0, 0, 0, 0, 0, 1, 1]), 4),
+    StratifiedSubsampler(torch.tensor([0, 1, 2, 0, 1, 2, 0, 1, 2, 2]), [1, 2, 3]),
+    WeightedSubsampler(torch.arange(1., 11.), 4),
+], ids=["shuffled", "stratified", "stratified_sizes", "weighted"])
+def test_subsampler_unbiased(subsampler):
+    pyro.set_rng_seed(0)
+    data = torch.randn(10)
+    expected = poutine.trace(subsampler_model).get_trace(None, data).log_prob_sum()
+    num_samples = 5000
+    actual = 0.
+    for _ in range(num_samples):
+        ind = subsampler.sample()
+        actual = actual + (subsampler.scale(ind) * dist.Normal(0., 1.).log_prob(data[ind])).sum()
+    assert_equal(actual / num_samples, expected, prec=0.2)
+
+
+@pytest.mark.parameterize("strata,subsample_size,expected_scale", [
+    ([0, 0, 0, 0, 0, 0, 0, 0, 1, 1], 4, [8 / 3, 8 / 3, 8 / 3, 2.]),
+    ([0, 1, 1, 1], [1, 2], [1., 1.5, 1.5]),
+])
+def test_stratified_subsampler_scale(strata, subsample_size, expected_scale):
+    subsampler = StratifiedSubsampler(torch.tensor(strata), subsample_size)
+    trace = poutine.trace(subsampler_model).get_trace(subsampler, torch.randn(len(strata)))
+    assert_equal(trace.nodes["x"]["scale"], torch.tensor(expected_scale))
+
+
+def test_weighted_subsampler_probs():
+    pyro.set_rng_seed(0)
+    weights = torch.tensor([1., 2., 3., 4.])
+    subsampler = WeightedSubsampler(weights, 100000)
+    counts = torch.bincount(subsampler.sample(), minlength=4).float()
+    assert_equal(counts / counts.sum(), weights / weights.sum(), prec=0.01)
+
+
+@pytest.mark.parameterize("prefetch", [False, True])
+def test_subsampler_dataset(prefetch):
+    pyro.set_rng_seed(0)
+    data = torch.randn(20, 2)
+    subsampler = ShuffledSubsampler(len(data), 5, dataset=data, prefetch=prefetch)
+
+    def model():
+        with pyro.plate("data", subsample=subsampler) as ind:
+            pyro.sample("x", dist.Normal(0., 1.).expand([2]).to_event(1), obs=subsampler.data)
+        return ind
+
+    for step in range(6):
+        guide_trace = poutine.trace(model).get_trace()
+        model_trace = poutine.trace(poutine.replay(model, trace=guide_trace)).get_trace()
+        ind = guide_trace.nodes["_RETURN"]["value"]
+        assert_equal(model_trace.nodes["_RETURN"]["value"], ind)
+        assert_equal(model_trace.nodes["x"]["value"], data[ind])
+        assert model_trace.nodes["x"]["scale"] == 4.
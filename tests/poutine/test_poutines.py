@@ -889,3 +889,48 @@ def test_pickling(wrapper):
     assert tuple(actual_trace) == tuple(expected_trace.nodes)
     assert_close([actual_trace.nodes[site]['value'] for site in actual_trace.stochastic_nodes],
                  [expected_trace.nodes[site]['value'] for site in expected_trace.stochastic_nodes])
+
+
+def test_dispatch_table_register():
+    class CountMessenger(poutine.messenger.Messenger):
+        pass
+
+    calls = []
+
+    def model():
+        return pyro.sample("x", Normal(0., 1.))
+
+    with CountMessenger():
+        model()
+        # handlers registered while the messenger is installed take effect immediately
+        CountMessenger.register(lambda msg: calls.append(msg["name"]), type="sample")
+        try:
+            model()
+        finally:
+            CountMessenger.unregister(type="sample")
+        model()
+    assert calls == ["x"]
+
+
+def test_dispatch_table_stop():
+    # postprocessing only applies to the frames below the one which stops the message
+    def model():
+        return pyro.sample("x", Normal(0., 1.))
+
+    outer = poutine.trace(model)
+    inner = poutine.trace(poutine.block(outer))
+    tr = inner.get_trace()
+    assert "x" not in tr
+    assert "x" in outer.msngr.trace
+
+
+def test_sample_message():
+    def model():
+        pyro.sample("x", Normal(0., 1.), obs=torch.tensor(0.5), infer={"foo": 1})
+
+    tr = poutine.trace(model).get_trace()
+    node = tr.nodes["x"]
+    assert isinstance(node, dict)
+    assert node["is_observed"]
+    assert_equal(node["value"], torch.tensor(0.5))
+    assert node["infer"] == {"foo": 1}
@@ -1,7 +1,11 @@
 import itertools
 
 import pytest
+import torch
 
+import pyro
+import pyro.distributions as dist
+import pyro.poutine as poutine
 from pyro.poutine import Trace
 from tests.common import assert_equal
 
@@ -67,3 +71,97 @@ def test_connectivity_on_removal(edges):
         num_expected = len(top_sort)
         assert_equal(num_nodes, num_expected)
         tr.remove_node(top_sort.pop())
+
+
+@pytest.mark.parameterize('edges', EDGE_SETS)
+def test_copy_preserves_edges(edges):
+    tr = Trace()
+    for n1, n2 in edges:
+        tr.add_edge(n1, n2)
+    tr_copy = tr.copy()
+    assert set(tr_copy.edges) == set(tr.edges)
+
+    # mutating the copy must not mutate the original
+    tr_copy.add_edge(2, 8)
+    assert 8 not in tr
+    assert 8 not in tr.successors(2)
+    assert set(tr_copy.edges) == set(tr.edges) | {(2, 8)}
+
+
+def test_flat_trace_without_edges():
+    tr = Trace()
+    for name in "abc":
+        tr.add_node(name, type="sample")
+    tr_copy = tr.copy()
+    assert list(tr_copy) == ["a", "b", "c"]
+    assert not list(tr_copy.edges)
+    assert tr_copy.successors("a") == set()
+    assert tr_copy.predecessors("a") == set()
+    assert tr_copy.topological_sort() == ["c", "b", "a"]
+    with pytest.raises(KeyError):
+        tr_copy.successors("d")
+    tr_copy.remove_node("b")
+    assert list(tr_copy) == ["a", "c"]
+    assert list(tr) == ["a", "b", "c"]
+
+
+def test_reuse_log_prob():
+    data = torch.tensor([0., 1., 1.])
+
+    def model():
+        z1 = pyro.sample("z1", dist.Categorical(torch.ones(3)))
+        z2 = pyro.sample("z2", dist.Categorical(torch.ones(3)))
+        pyro.sample("x1", dist.Normal(z1.float(), 1.), obs=data[0])
+        with pyro.plate("data", 2):
+            pyro.sample("x2", dist.Normal(z2.float(), 1.), obs=data[1:])
+
+    conditioned = poutine.condition(model, data={"z1": torch.tensor(0), "z2": torch.tensor(1)})
+    old_trace = poutine.trace(conditioned).get_trace()
+    old_trace.compute_log_prob()
+
+    conditioned = poutine.condition(model, data={"z1": torch.tensor(2), "z2": torch.tensor(1)})
+    trace = poutine.trace(conditioned).get_trace()
+    assert trace.reuse_log_prob(old_trace) == {"z1", "x1"}
+    assert trace.nodes["x2"]["log_prob"] is old_trace.nodes["x2"]["log_prob"]
+    trace.compute_log_prob()
+
+    expected_trace = poutine.trace(conditioned).get_trace()
+    expected_trace.compute_log_prob()
+    for name in ["z1", "z2", "x1", "x2"]:
+        assert_equal(trace.nodes[name]["log_prob"], expected_trace.nodes[name]["log_prob"])
+    assert_equal(trace.log_prob_sum(), expected_trace.log_prob_sum())
+
+
+def test_reuse_log_prob_requires_grad():
+    loc = torch.tensor(0., requires_grad=True)
+
+    def model(loc):
+        pyro.sample("x", dist.Normal(loc, 1.), obs=torch.tensor(1.))
+
+    old_trace = poutine.trace(model).get_trace(loc)
+    old_trace.compute_log_prob()
+
+    # equal values that require grad are not reused
+    trace = poutine.trace(model).get_trace(loc.detach().requires_grad_())
+    assert trace.reuse_log_prob(old_trace) == {"x"}
+
+
+@pytest.mark.parameterize("inplace", ["value", "param"])
+def test_reuse_log_prob_inplace(inplace):
+    loc = torch.tensor(0.)
+    data = torch.tensor(1.)
+
+    def model():
+        pyro.sample("x", dist.Normal(loc, 1.), obs=data)
+
+    old_trace = poutine.trace(model).get_trace()
+    old_trace.log_prob_sum()
+    with torch.no_grad():
+        if inplace == "value":
+            data.add_(5.)
+        else:
+            loc.add_(5.)
+
+    trace = poutine.trace(model).get_trace()
+    assert trace.reuse_log_prob(old_trace) == {"x"}
+    assert_equal(trace.log_prob_sum(), dist.Normal(loc, 1.).log_prob(data))